@@ -0,0 +1,216 @@
+import os
+import math
+import time
+import asyncio
+import bisect
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from llm_utils import parse_model_map
+
+logger = logging.getLogger(__name__)
+
+# 숫자가 작을수록 먼저 슬롯을 받습니다.
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1, "background": 2}
+
+# 엔드포인트별 우선순위 클래스 / 동시 실행 한도 / 지연 예산(초) / 초기 처리 시간 추정치(초)
+DEFAULT_ENDPOINTS = {
+    "chat": {"priority": "interactive", "limit": 8, "latency_budget_s": 15.0, "service_time_s": 5.0},
+    "populate_note": {"priority": "batch", "limit": 2, "latency_budget_s": 300.0, "service_time_s": 60.0},
+}
+
+
+class AdmissionRejected(Exception):
+    """대기열이 지연 예산을 넘었을 때 발생합니다. main.py에서 429 + Retry-After로 변환합니다."""
+
+    status_code = 429
+
+    def __init__(self, endpoint: str, estimated_wait_s: float, retry_after_s: int, queue_depth: int):
+        super().__init__(f"Admission rejected for '{endpoint}' (estimated wait {estimated_wait_s:.1f}s, queue depth {queue_depth}).")
+        self.endpoint = endpoint
+        self.estimated_wait_s = estimated_wait_s
+        self.retry_after_s = retry_after_s
+        self.queue_depth = queue_depth
+
+
+class EndpointState:
+    def __init__(self, priority: str, limit: int, latency_budget_s: float, service_time_s: float):
+        self.priority = priority
+        self.limit = max(1, limit)
+        self.latency_budget_s = latency_budget_s
+        self.service_time_s = service_time_s  # 처리 시간의 지수 이동 평균
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait_s = 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "latency_budget_s": self.latency_budget_s,
+            "service_time_s": round(self.service_time_s, 2),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_s": round(self.total_wait_s / self.admitted, 3) if self.admitted else 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    LLM을 호출하는 엔드포인트의 수락 제어기.
+    - 전체 슬롯(total_slots)을 엔드포인트들이 공유하고, 엔드포인트마다 동시 실행 한도(limit)를 둡니다.
+    - 슬롯이 비면 우선순위 클래스(interactive → batch → background), 같은 클래스 안에서는 도착 순서로 대기자에게 넘깁니다.
+      한도에 걸린 엔드포인트의 대기자는 건너뛰므로, populate 버스트가 있어도 chat은 남은 슬롯을 먼저 받습니다.
+    - 도착 시 앞선 대기자와 처리 시간 추정치로 대기 시간을 계산하고, 지연 예산을 넘으면 큐에 넣지 않고 바로 거절합니다.
+    모든 상태는 이벤트 루프 안에서만 바뀌므로 별도의 락을 쓰지 않습니다.
+    """
+
+    def __init__(self, endpoints: Dict[str, Dict] = None, total_slots: int = 8, max_queue: int = 64, ewma_alpha: float = 0.2):
+        self.total_slots = max(1, total_slots)
+        self.max_queue = max_queue
+        self.ewma_alpha = ewma_alpha
+        self.endpoints = {name: EndpointState(**config) for name, config in (endpoints or DEFAULT_ENDPOINTS).items()}
+        self.in_flight = 0
+        self._waiters: List[tuple] = []  # (priority, seq, endpoint, future), 정렬 상태 유지
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        limits = parse_model_map(os.getenv("ADMISSION_LIMITS", ""))
+        budgets = parse_model_map(os.getenv("ADMISSION_LATENCY_BUDGETS", ""))
+        endpoints = {}
+        for name, config in DEFAULT_ENDPOINTS.items():
+            endpoints[name] = {
+                **config,
+                "limit": int(limits.get(name, config["limit"])),
+                "latency_budget_s": budgets.get(name, config["latency_budget_s"]),
+            }
+        return cls(
+            endpoints,
+            total_slots=int(os.getenv("ADMISSION_TOTAL_SLOTS", "8")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+        )
+
+    def _priority(self, endpoint: str) -> int:
+        return PRIORITY_CLASSES[self.endpoints[endpoint].priority]
+
+    def _has_capacity(self, endpoint: str) -> bool:
+        return self.in_flight < self.total_slots and self.endpoints[endpoint].in_flight < self.endpoints[endpoint].limit
+
+    def _waiters_ahead(self, endpoint: str) -> List[str]:
+        """새 요청보다 먼저 슬롯을 받을 대기자들의 엔드포인트 (같은 클래스는 먼저 온 쪽이 우선)."""
+        priority = self._priority(endpoint)
+        return [name for waiter_priority, _, name, _ in self._waiters if waiter_priority <= priority]
+
+    def estimate_wait(self, endpoint: str) -> float:
+        """지금 도착한 요청이 슬롯을 받기까지의 예상 대기 시간(초)."""
+        if self._has_capacity(endpoint):
+            return 0.0
+        ahead = self._waiters_ahead(endpoint)
+        state = self.endpoints[endpoint]
+        # 공유 슬롯 기준: 앞선 작업량 + 진행 중인 작업의 잔여분(한 건으로 근사)을 전체 슬롯으로 나눈 값
+        shared = (sum(self.endpoints[name].service_time_s for name in ahead) + state.service_time_s) / self.total_slots
+        # 엔드포인트 한도 기준: 같은 엔드포인트의 앞선 대기자를 한도만큼씩 처리하는 데 걸리는 시간
+        local = (ahead.count(endpoint) + 1) * state.service_time_s / state.limit
+        return max(shared, local)
+
+    async def acquire(self, endpoint: str) -> float:
+        """슬롯을 받을 때까지 기다리고 대기한 시간(초)을 반환합니다. 지연 예산을 넘으면 AdmissionRejected."""
+        state = self.endpoints[endpoint]
+        # 해제할 때마다 _dispatch가 받을 수 있는 대기자에게 슬롯을 넘기므로, 여유가 있으면 남은 대기자는 모두 한도에 걸린 다른 엔드포인트입니다.
+        if self._has_capacity(endpoint):
+            self._grant(endpoint)
+            return 0.0
+
+        estimated = self.estimate_wait(endpoint)
+        if estimated > state.latency_budget_s or len(self._waiters) >= self.max_queue:
+            state.rejected += 1
+            retry_after = max(1, math.ceil(estimated - state.latency_budget_s))
+            logger.warning(f"Rejecting '{endpoint}' request: estimated wait {estimated:.1f}s exceeds budget {state.latency_budget_s:.0f}s "
+                           f"({len(self._waiters)} queued).")
+            raise AdmissionRejected(endpoint, estimated, retry_after, len(self._waiters))
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (self._priority(endpoint), next(self._seq), endpoint, future)
+        bisect.insort(self._waiters, waiter, key=lambda item: item[:2])
+        state.queued += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(endpoint, 0.0)  # 슬롯을 받은 직후 취소된 경우 바로 돌려줍니다.
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                state.queued -= 1
+            raise
+        waited = time.monotonic() - started
+        state.total_wait_s += waited
+        return waited
+
+    def _grant(self, endpoint: str):
+        self.in_flight += 1
+        self.endpoints[endpoint].in_flight += 1
+        self.endpoints[endpoint].admitted += 1
+
+    def release(self, endpoint: str, service_time_s: Optional[float] = None):
+        state = self.endpoints[endpoint]
+        self.in_flight -= 1
+        state.in_flight -= 1
+        if service_time_s:
+            state.service_time_s += self.ewma_alpha * (service_time_s - state.service_time_s)
+        self._dispatch()
+
+    def _dispatch(self):
+        """빈 슬롯을 우선순위가 가장 높은 대기자부터 넘기되, 한도에 걸린 엔드포인트의 대기자는 건너뜁니다."""
+        index = 0
+        while index < len(self._waiters) and self.in_flight < self.total_slots:
+            _, _, endpoint, future = self._waiters[index]
+            if future.cancelled():
+                # 취소된 대기자는 acquire의 except 블록이 실행되기 전에도 여기서 정리합니다.
+                del self._waiters[index]
+                self.endpoints[endpoint].queued -= 1
+                continue
+            if not self._has_capacity(endpoint):
+                index += 1
+                continue
+            del self._waiters[index]
+            self.endpoints[endpoint].queued -= 1
+            self._grant(endpoint)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str):
+        """with 블록 동안 슬롯을 점유하고, 끝나면 처리 시간을 추정치에 반영하며 반납합니다."""
+        await self.acquire(endpoint)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(endpoint, time.monotonic() - started)
+
+    def snapshot(self) -> Dict:
+        return {
+            "total_slots": self.total_slots,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "endpoints": {
+                name: {**state.snapshot(), "estimated_wait_s": round(self.estimate_wait(name), 2)}
+                for name, state in self.endpoints.items()
+            },
+        }
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController.from_env()
+    return _admission_controller
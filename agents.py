@@ -3,19 +3,96 @@ import re
 import logging
 import asyncio
 import json
-from typing import List, Dict, TypedDict, Annotated, Tuple
+import threading
+from typing import List, Dict, Optional, TypedDict, Annotated, Tuple
 
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 
 # Local imports
 import rag_pipeline as rag_module
-from llm_utils import call_llm_api
+from llm_utils import call_llm_api, track_llm_usage, get_circuit_breakers
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 채점 모델
+SCORING_MODEL = "llama3:70b"
+# 채점 모델의 서킷 브레이커가 열려 있을 때 순서대로 대신 사용할 채점 모델
+JUDGE_FALLBACK_MODELS = [m.strip() for m in os.getenv("JUDGE_FALLBACK_MODELS", "mixtral,biollama3").split(",") if m.strip()]
+
+def select_judge_model() -> str:
+    """서킷 브레이커가 열리지 않은 첫 번째 채점 모델을 고릅니다. 모두 차단되어 있으면 기본 채점 모델을 반환합니다."""
+    available = get_circuit_breakers().available_models([SCORING_MODEL] + JUDGE_FALLBACK_MODELS)
+    return available[0] if available else SCORING_MODEL
+
+# --- 섹션별 모델 캐스케이드 정책 ---
+# tiers: 비용이 낮은 모델 그룹부터 순서대로 실행합니다. 앞 단계 초안의 사전 점수(pre-score)가
+#        pre_score_threshold에 못 미치거나, Supervisor 채점이 기준에 못 미쳐 재작성이 필요할 때만 다음 단계로 확장합니다.
+# CASCADE_POLICY_PATH 환경변수로 같은 형식의 JSON 파일을 지정하면 섹션별 정책을 덮어씁니다.
+DEFAULT_CASCADE_POLICIES = {
+    "default": {"tiers": [["biollama3"], ["mixtral"], ["llama3:70b"]], "pre_score_threshold": 7.0},
+    "Consumables": {"tiers": [["biollama3"], ["mixtral"]], "pre_score_threshold": 6.0},
+    "Equipment": {"tiers": [["biollama3"], ["mixtral"]], "pre_score_threshold": 6.0},
+    "Reagent": {"tiers": [["biollama3"], ["mixtral"], ["llama3:70b"]], "pre_score_threshold": 6.5},
+    "Method": {"tiers": [["biollama3", "mixtral"], ["llama3:70b"]], "pre_score_threshold": 7.5},
+}
+
+def _load_cascade_policies() -> Dict[str, Dict]:
+    policies = dict(DEFAULT_CASCADE_POLICIES)
+    policy_path = os.getenv("CASCADE_POLICY_PATH")
+    if policy_path:
+        try:
+            with open(policy_path, 'r', encoding='utf-8') as f:
+                policies.update(json.load(f))
+            logger.info(f"Loaded cascade policies from '{policy_path}'.")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to load cascade policies from '{policy_path}': {e}. Using defaults.")
+    return policies
+
+CASCADE_POLICIES = _load_cascade_policies()
+
+def get_cascade_policy(section: str) -> Dict:
+    return CASCADE_POLICIES.get(section, CASCADE_POLICIES["default"])
+
+def get_cascade_models(section: str) -> List[str]:
+    """해당 섹션 정책에 포함된 모든 초안 모델 (비용 순)."""
+    return [model for tier in get_cascade_policy(section)["tiers"] for model in tier]
+
+# 섹션 단위 캐스케이드 지표 (GPU 시간, 확장률)
+_cascade_lock = threading.Lock()
+_cascade_stats = {"sections": 0, "escalated_sections": 0, "gpu_seconds": 0.0, "by_section": {}}
+
+def _record_cascade_result(section: str, escalations: int, gpu_seconds: float):
+    with _cascade_lock:
+        section_stats = _cascade_stats["by_section"].setdefault(section, {"populated": 0, "escalated": 0, "gpu_seconds": 0.0})
+        for stats in (_cascade_stats, section_stats):
+            stats["gpu_seconds"] += gpu_seconds
+        _cascade_stats["sections"] += 1
+        section_stats["populated"] += 1
+        if escalations:
+            _cascade_stats["escalated_sections"] += 1
+            section_stats["escalated"] += 1
+
+def get_cascade_metrics() -> Dict:
+    """섹션당 평균 GPU 시간과 상위 모델로의 확장 비율을 반환합니다."""
+    with _cascade_lock:
+        sections = _cascade_stats["sections"]
+        return {
+            "sections_populated": sections,
+            "escalation_rate": _cascade_stats["escalated_sections"] / sections if sections else 0.0,
+            "gpu_seconds_per_section": _cascade_stats["gpu_seconds"] / sections if sections else 0.0,
+            "by_section": {
+                name: {
+                    "populated": stats["populated"],
+                    "escalation_rate": stats["escalated"] / stats["populated"],
+                    "gpu_seconds_per_section": stats["gpu_seconds"] / stats["populated"],
+                }
+                for name, stats in _cascade_stats["by_section"].items()
+            },
+        }
+
 # --- Agent State Definition ---
 class AgentState(TypedDict):
     query: str
@@ -27,6 +104,9 @@ class AgentState(TypedDict):
     drafts: List[Dict[str, str]] # [{'model': 'biollama3', 'content': '...'}, ...]
     feedback: str # Supervisor의 재작성 요구사항
     final_options: List[str] # 최종 사용자에게 보여줄 옵션
+    rag_context: Optional[str] # 첫 라운드에 검색한 SOP 컨텍스트 (재작성 라운드에서 재사용)
+    cascade_level: int # 다음 초안 생성 시 시작할 캐스케이드 단계
+    escalations: int # 상위 모델 단계로 확장한 횟수
     messages: Annotated[list, add_messages]
 
 
@@ -40,6 +120,45 @@ def _extract_section_content(uo_block: str, section_name: str) -> str:
         return content if content and not content.startswith('(') else "(not specified)"
     return "(not specified)"
 
+def _pre_score_draft(content: str) -> float:
+    """
+    LLM 채점 전에 초안의 구조와 구체성을 가볍게 평가하는 휴리스틱 점수 (0~10).
+    목록/단계 구조, 수치+단위 등 정량 정보, 적정 분량을 기준으로 합니다.
+    """
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    structured = sum(1 for line in lines if re.match(r'^([-*+]|\d+[.)])\s+', line))
+    quantities = len(re.findall(r'\d+(\.\d+)?\s*(%|°C|℃|x\s*g|rpm|m[lLgM]|µ[lLgM]|u[lLgM]|n[gM]|mM|µM|min|h|hr|sec|s)\b', content))
+    score = 4.0 * min(structured / max(len(lines), 1) * 1.5, 1.0)
+    score += 4.0 * min(quantities / 5.0, 1.0)
+    score += 2.0 if 80 <= len(content) <= 6000 else 0.5
+    return round(score, 2)
+
+DRAFT_SYSTEM_PROMPT = "You are a specialized scientific assistant. Your task is to generate a comprehensive and well-structured response for a specific section of a lab note, using the provided context. The response should be clear, detailed, and directly applicable to the experiment. Your answer MUST be only the list or method itself, without any extra conversation or explanation."
+
+def _build_draft_prompts(query: str, uo_id: str, uo_name: str, section: str, input_context: str, rag_context: str, feedback: str = '') -> Tuple[str, str]:
+    """
+    초안 생성 프롬프트를 (system, user)로 구성합니다.
+    Ollama는 이전 요청과 앞부분이 같은 프롬프트의 KV 캐시를 재사용하므로,
+    변하지 않는 부분(시스템 지시문 + SOP 컨텍스트)을 앞에 두고 요청마다 달라지는
+    필드(실험 목표, UO, 섹션, 입력)와 재작성 피드백은 뒤에 둡니다.
+    """
+    system_prompt = DRAFT_SYSTEM_PROMPT
+    if "No relevant context found" not in rag_context:
+        system_prompt += f"\n\n--- **Relevant SOP Context** ---\n{rag_context}\n---"
+
+    user_prompt = f"""
+- **Experiment Goal**: '{query}'
+- **Unit Operation**: '{uo_id}: {uo_name}'
+- **Section to Write**: '{section}'
+- **Inputs**: '{input_context}'
+"""
+    # 재작성 요청이 있을 경우 프롬프트 끝에 피드백 추가
+    if feedback:
+        user_prompt += f"\n**IMPORTANT FEEDBACK FOR REVISION**: {feedback}\nPlease regenerate the content reflecting this feedback."
+    return system_prompt, user_prompt
+
 async def _generate_drafts(state: AgentState) -> AgentState:
     """
     Specialist Agent들의 역할을 수행하는 함수.
@@ -54,81 +173,98 @@ async def _generate_drafts(state: AgentState) -> AgentState:
 
     logger.info(f"Generating drafts for UO '{uo_id}' - Section '{section}'")
     input_context = _extract_section_content(uo_block, "Input")
-    rag_query = f"Find the specific procedure or list of items for the '{section}' section of the unit operation '{uo_id}: {uo_name}' related to the experiment: {query}"
 
-    context_docs = rag_module.rag_pipeline.retrieve_context(rag_query, k=3)
-    rag_context = rag_module.rag_pipeline.format_context_for_prompt(context_docs)
+    # 재작성 라운드에서는 첫 라운드의 SOP 컨텍스트를 그대로 재사용하여 프롬프트 prefix를 동일하게 유지합니다.
+    rag_context = state.get('rag_context')
+    if rag_context is None:
+        rag_query = f"Find the specific procedure or list of items for the '{section}' section of the unit operation '{uo_id}: {uo_name}' related to the experiment: {query}"
+        context_docs = rag_module.rag_pipeline.retrieve_context(rag_query, k=3)
+        rag_context = rag_module.rag_pipeline.format_context_for_prompt(context_docs)
+        state['rag_context'] = rag_context
 
-    base_user_prompt = f"""
-- **Experiment Goal**: '{query}'
-- **Unit Operation**: '{uo_id}: {uo_name}'
-- **Section to Write**: '{section}'
-- **Inputs**: '{input_context}'
-"""
-    if "No relevant context found" not in rag_context:
-        base_user_prompt += f"\n--- **Relevant SOP Context** ---\n{rag_context}\n---"
+    system_prompt, base_user_prompt = _build_draft_prompts(query, uo_id, uo_name, section, input_context, rag_context, feedback)
 
-    # 재작성 요청이 있을 경우 프롬프트에 피드백 추가
-    if feedback:
-        base_user_prompt += f"\n**IMPORTANT FEEDBACK FOR REVISION**: {feedback}\nPlease regenerate the content reflecting this feedback."
+    policy = get_cascade_policy(section)
+    tiers = policy["tiers"]
+    level = min(state.get('cascade_level', 0), len(tiers) - 1)
 
+    # 현재 단계의 모델로 초안을 만들고, 사전 점수가 기준에 못 미칠 때만 다음 단계 모델로 확장합니다.
+    drafts = []
+    breakers = get_circuit_breakers()
+    while True:
+        # 서킷 브레이커가 열린 모델은 제외하고, 단계의 모든 모델이 차단되었으면 다음 단계로 넘어갑니다.
+        models_to_use = breakers.available_models(tiers[level])
+        if not models_to_use:
+            if level + 1 >= len(tiers):
+                logger.warning(f"Cascade: all models in the last tier {tiers[level]} are unavailable (circuit open).")
+                break
+            logger.warning(f"Cascade: all models in tier {level} {tiers[level]} are unavailable (circuit open). Skipping to tier {level + 1}.")
+            level += 1
+            continue
+        tasks = [
+            call_llm_api(system_prompt, base_user_prompt, model_name)
+            for model_name in models_to_use
+        ]
+        generated_contents = await asyncio.gather(*tasks)
 
-    system_prompt = "You are a specialized scientific assistant. Your task is to generate a comprehensive and well-structured response for a specific section of a lab note, using the provided context. The response should be clear, detailed, and directly applicable to the experiment. Your answer MUST be only the list or method itself, without any extra conversation or explanation."
+        for model_name, content in zip(models_to_use, generated_contents):
+            if content and not content.startswith("(LLM Error"):
+                drafts.append({'model': model_name, 'content': content})
 
-    models_to_use = ["biollama3", "mixtral", "llama3:70b"]
-    tasks = [
-        call_llm_api(system_prompt, base_user_prompt, model_name)
-        for model_name in models_to_use
-    ]
-    
-    generated_contents = await asyncio.gather(*tasks)
-    
-    drafts = []
-    for model_name, content in zip(models_to_use, generated_contents):
-        if content and not content.startswith("(LLM Error"):
-            drafts.append({'model': model_name, 'content': content})
+        best_pre_score = max((_pre_score_draft(d['content']) for d in drafts), default=0.0)
+        if best_pre_score >= policy["pre_score_threshold"] or level + 1 >= len(tiers):
+            break
+        logger.info(f"Cascade: best pre-score {best_pre_score} < {policy['pre_score_threshold']} at tier {level}. Escalating to {tiers[level + 1]}.")
+        level += 1
+        state['escalations'] = state.get('escalations', 0) + 1
 
+    state['cascade_level'] = level
     state['drafts'] = drafts
     return state
 
 
-async def supervisor_agent(state: AgentState) -> AgentState:
-    """
-    Supervisor Agent. 생성된 초안들을 평가하고 다음 단계를 결정합니다.
-    """
-    logger.info(f"Supervisor Agent: Evaluating drafts for UO '{state['uo_id']}' - Section '{state['section_to_populate']}'")
-    drafts = state['drafts']
-    if not drafts:
-        logger.warning("Supervisor: No drafts to evaluate. Ending.")
-        state['final_options'] = ["AI가 초안을 생성하지 못했습니다. 다시 시도해주세요."]
-        return state
+# 채점 프롬프트: 섹션과 무관한 지시문/기준은 system에 고정하여 모든 채점 호출이 같은 prefix를 공유하도록 합니다.
+EVALUATION_SYSTEM_PROMPT = """You are an expert lab note reviewer. Your output must be a valid JSON array of objects.
 
-    # 평가를 위한 프롬프트 구성
-    evaluation_prompt = """
-You are a highly experienced principal investigator reviewing lab notes. Evaluate the following drafts for the '{section}' section of a protocol. For each draft, provide a score (out of 10) and a brief justification based on these criteria:
+You are a highly experienced principal investigator reviewing lab notes. Evaluate the given drafts for a section of a protocol. For each draft, provide a score (out of 10) and a brief justification based on these criteria:
 1.  **Structural Integrity (구조적 완성도)**: Is the format (e.g., Markdown list, numbered steps) clear and well-organized?
 2.  **Specificity and Detail (내용의 구체성)**: Does it include specific, quantitative details like reagent concentrations, times, equipment models, etc.?
 3.  **SOP Relevance (SOP 연관성)**: How well does it incorporate information from the provided SOP context?
 
 **Format your response strictly as a JSON object, like this example:**
 [
-  {{"draft_index": 0, "model": "biollama3", "score": 8.5, "justification": "Clear steps, but lacks specific buffer concentrations."}},
-  {{"draft_index": 1, "model": "mixtral", "score": 7.0, "justification": "Too generic and misses key details from the SOP."}},
-  {{"draft_index": 2, "model": "llama3:70b", "score": 9.2, "justification": "Excellent detail and structure, accurately reflects the SOP."}}
-]
+  {"draft_index": 0, "model": "biollama3", "score": 8.5, "justification": "Clear steps, but lacks specific buffer concentrations."},
+  {"draft_index": 1, "model": "mixtral", "score": 7.0, "justification": "Too generic and misses key details from the SOP."},
+  {"draft_index": 2, "model": "llama3:70b", "score": 9.2, "justification": "Excellent detail and structure, accurately reflects the SOP."}
+]"""
+
+EVALUATION_USER_PROMPT = """
+Section to evaluate: '{section}'
 
 --- DRAFTS TO EVALUATE ---
 {draft_texts}
 """
+
+async def supervisor_agent(state: AgentState) -> AgentState:
+    """
+    Supervisor Agent. 생성된 초안들을 평가하고 다음 단계를 결정합니다.
+    """
+    logger.info(f"Supervisor Agent: Evaluating drafts for UO '{state['uo_id']}' - Section '{state['section_to_populate']}'")
+    drafts = state['drafts']
+    if not drafts:
+        logger.warning("Supervisor: No drafts to evaluate. Ending.")
+        state['final_options'] = ["AI가 초안을 생성하지 못했습니다. 다시 시도해주세요."]
+        return state
+
     draft_texts = "\n\n---\n\n".join([f"**Draft {i} (from {d['model']})**:\n{d['content']}" for i, d in enumerate(drafts)])
     
-    # llama3:70b를 채점자로 사용
-    scoring_llm = "llama3:70b"
+    # llama3:70b를 채점자로 사용 (서킷 브레이커가 열려 있으면 대체 채점 모델 사용)
+    scoring_llm = select_judge_model()
     logger.info(f"Calling Scoring LLM ({scoring_llm}) to evaluate drafts.")
     
     response_str = await call_llm_api(
-        system_prompt="You are an expert lab note reviewer. Your output must be a valid JSON array of objects.",
-        user_prompt=evaluation_prompt.format(section=state['section_to_populate'], draft_texts=draft_texts),
+        system_prompt=EVALUATION_SYSTEM_PROMPT,
+        user_prompt=EVALUATION_USER_PROMPT.format(section=state['section_to_populate'], draft_texts=draft_texts),
         model_name=scoring_llm
     )
     
@@ -163,6 +299,11 @@ You are a highly experienced principal investigator reviewing lab notes. Evaluat
         logger.info(f"Supervisor: Quality threshold NOT passed (highest score: {highest_score}). Requesting revision.")
         # 재작성을 위한 피드백 생성
         feedback_points = [f"Draft from {e['model']} was critiqued: '{e['justification']}'" for e in evaluations]
+        # 채점 기준 미달 시 다음 캐스케이드 단계(더 큰 모델)로 재작성합니다.
+        tiers = get_cascade_policy(state['section_to_populate'])["tiers"]
+        if state.get('cascade_level', 0) + 1 < len(tiers):
+            state['cascade_level'] = state.get('cascade_level', 0) + 1
+            state['escalations'] = state.get('escalations', 0) + 1
         state['final_options'] = [] # 최종 옵션 없음
         state['feedback'] = f"The previous drafts were not detailed enough (top score was {highest_score}). Specific feedback: {' '.join(feedback_points)}. Please generate a much more detailed and specific version."
 
@@ -211,7 +352,23 @@ def create_agent_graph():
     return agent_graph
 
 # --- Main execution function ---
+def find_uo_block(file_content: str, uo_id: str) -> Optional[str]:
+    """워크플로우 마크다운에서 `### [UO_ID ...]`로 시작하는 단위 공정 블록을 찾아 반환합니다."""
+    pattern = re.compile(
+        r"(### \\?\[" + re.escape(uo_id) + r".*?\\?\]\n.*?)(?=### \\?\[U[A-Z]{2,3}\d{3}|\Z)",
+        re.DOTALL
+    )
+    match = pattern.search(file_content)
+    return match.group(1) if match else None
+
+
 def run_agent_team(query: str, uo_block: str, section: str) -> Dict:
+    """별도 스레드에서 새 이벤트 루프로 에이전트 팀을 실행합니다 (API 프로세스의 동기 경로용)."""
+    return asyncio.run(arun_agent_team(query, uo_block, section))
+
+
+async def arun_agent_team(query: str, uo_block: str, section: str) -> Dict:
+    """현재 이벤트 루프에서 에이전트 팀을 실행합니다. 태스크를 취소하면 진행 중인 LLM 호출도 함께 취소됩니다."""
     # 정규식에 \\? 를 추가하여 `[` 와 `\[` 를 모두 처리하도록 변경
     match = re.search(r"### \\?\[(U[A-Z]{2,3}\d{3,4}) (.*?)\\?\]", uo_block)
     if not match:
@@ -234,12 +391,18 @@ def run_agent_team(query: str, uo_block: str, section: str) -> Dict:
         drafts=[],
         feedback='',
         final_options=[],
+        rag_context=None,
+        cascade_level=0,
+        escalations=0,
         messages=[]
     )
     
     graph = create_agent_graph()
-    # 비동기 그래프 실행
-    final_state = asyncio.run(graph.ainvoke(initial_state))
+    # 비동기 그래프 실행 (섹션 단위 GPU 사용량 집계)
+    with track_llm_usage() as usage:
+        final_state = await graph.ainvoke(initial_state)
+    _record_cascade_result(section, final_state.get('escalations', 0), usage["gpu_seconds"])
+    logger.info(f"Populated '{section}' for {uo_id} using {usage['gpu_seconds']:.1f} GPU seconds ({final_state.get('escalations', 0)} escalations).")
     
     return {
         "uo_id": uo_id,
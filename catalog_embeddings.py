@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class CatalogEmbeddingIndex:
+    """
+    단위 공정(UO)·워크플로 카탈로그의 임베딩 인덱스. /create_scaffold에서 실험 목표에 맞는 UO를 추천하는 데 사용합니다.
+    - 카탈로그는 시작 시 한 번만 임베딩하고, 모델 이름과 카탈로그 내용의 해시를 키로 디스크(.npz)에 캐시합니다.
+    - 벡터는 L2 정규화해 두므로 코사인 유사도는 행렬-벡터 곱 한 번으로 계산됩니다.
+    - UO×워크플로 유사도 행렬을 미리 계산해 두어, 워크플로를 고른 경우의 재순위도 열 하나를 더하는 것으로 끝납니다.
+    요청 경로에서는 질의 임베딩 한 번 외에 모델 호출이 없습니다.
+    """
+
+    def __init__(self, embeddings, catalogs: Dict[str, Dict[str, str]], cache_path: Optional[str] = None,
+                 model_name: str = ""):
+        self.embeddings = embeddings
+        self.unit_operations = catalogs["unit_operation"]
+        self.workflows = catalogs["workflow"]
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.model_name = model_name
+        self.uo_ids = list(self.unit_operations)
+        self.workflow_ids = list(self.workflows)
+        self._workflow_positions = {workflow_id: i for i, workflow_id in enumerate(self.workflow_ids)}
+        self.uo_matrix: Optional[np.ndarray] = None
+        self.workflow_matrix: Optional[np.ndarray] = None
+        self.uo_workflow_similarity: Optional[np.ndarray] = None
+
+    @staticmethod
+    def _texts(items: Dict[str, str]) -> List[str]:
+        return [f"{item_id}: {name}" for item_id, name in items.items()]
+
+    def cache_key(self) -> str:
+        payload = json.dumps([self.model_name, self._texts(self.unit_operations), self._texts(self.workflows)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_cache(self, key: str) -> bool:
+        if not self.cache_path or not self.cache_path.exists():
+            return False
+        try:
+            with np.load(self.cache_path) as data:
+                if str(data["key"]) != key:
+                    return False
+                self.uo_matrix = data["uo_matrix"]
+                self.workflow_matrix = data["workflow_matrix"]
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable catalog embedding cache {self.cache_path}: {e}")
+            return False
+        return True
+
+    def _save_cache(self, key: str):
+        if not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, key=np.array(key), uo_matrix=self.uo_matrix, workflow_matrix=self.workflow_matrix)
+        os.replace(tmp_path, self.cache_path)
+
+    def build(self) -> "CatalogEmbeddingIndex":
+        """캐시가 현재 카탈로그·모델과 일치하면 불러오고, 아니면 한 번의 배치 요청으로 임베딩하여 저장합니다."""
+        key = self.cache_key()
+        if self._load_cache(key):
+            logger.info(f"Loaded catalog embeddings from cache ({len(self.uo_ids)} UOs, {len(self.workflow_ids)} workflows).")
+        else:
+            logger.info(f"Embedding catalog ({len(self.uo_ids)} UOs, {len(self.workflow_ids)} workflows)...")
+            vectors = np.asarray(self.embeddings.embed_documents(self._texts(self.unit_operations) + self._texts(self.workflows)),
+                                 dtype=np.float32)
+            vectors = _normalize_rows(vectors)
+            self.uo_matrix = vectors[:len(self.uo_ids)]
+            self.workflow_matrix = vectors[len(self.uo_ids):]
+            self._save_cache(key)
+        self.uo_workflow_similarity = self.uo_matrix @ self.workflow_matrix.T
+        return self
+
+    def _top(self, scores: np.ndarray, ids: List[str], names: Dict[str, str], limit: int) -> List[Dict]:
+        limit = min(limit, len(ids))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [{"id": ids[i], "name": names[ids[i]], "score": round(float(scores[i]), 4)} for i in top]
+
+    def recommend(self, query_vector: List[float], workflow_id: Optional[str] = None, limit: int = 10,
+                  workflow_weight: float = 0.3) -> Dict[str, List[Dict]]:
+        """
+        실험 목표 벡터와의 코사인 유사도로 UO를 순위화합니다.
+        workflow_id가 주어지면 (1 - workflow_weight) * 목표 유사도 + workflow_weight * 워크플로 유사도로 재순위합니다.
+        """
+        query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        uo_scores = self.uo_matrix @ query
+        position = self._workflow_positions.get(workflow_id) if workflow_id else None
+        if position is not None:
+            uo_scores = (1.0 - workflow_weight) * uo_scores + workflow_weight * self.uo_workflow_similarity[:, position]
+        return {
+            "unit_operations": self._top(uo_scores, self.uo_ids, self.unit_operations, limit),
+            "workflows": self._top(self.workflow_matrix @ query, self.workflow_ids, self.workflows, 3),
+        }
+
+    async def arecommend(self, query: str, workflow_id: Optional[str] = None, limit: int = 10,
+                         workflow_weight: float = 0.3) -> Dict[str, List[Dict]]:
+        query_vector = await self.embeddings.aembed_query(query)
+        return self.recommend(query_vector, workflow_id, limit, workflow_weight)
+
+
+# main.py의 lifespan에서 백그라운드로 생성합니다 (임베딩 서버가 준비되지 않았어도 서버 시작을 막지 않도록).
+catalog_embedding_index: Optional[CatalogEmbeddingIndex] = None
+
+def init_catalog_embedding_index(embeddings, catalogs: Dict[str, Dict[str, str]]) -> Optional[CatalogEmbeddingIndex]:
+    global catalog_embedding_index
+    try:
+        catalog_embedding_index = CatalogEmbeddingIndex(
+            embeddings, catalogs,
+            cache_path=os.getenv("CATALOG_EMBEDDING_CACHE_PATH", "./.cache/catalog_embeddings.npz"),
+            model_name=getattr(embeddings, "model", ""),
+        ).build()
+    except Exception as e:
+        logger.warning(f"Catalog embedding index is unavailable; UO recommendation is disabled: {e}")
+    return catalog_embedding_index
+
+def get_catalog_embedding_index() -> CatalogEmbeddingIndex:
+    if catalog_embedding_index is None:
+        raise RuntimeError("Catalog embedding index not initialized.")
+    return catalog_embedding_index
@@ -0,0 +1,109 @@
+import re
+import bisect
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+from rapidfuzz import fuzz, process
+
+_NON_WORD_PATTERN = re.compile(r"[^0-9a-z가-힣]+")
+
+
+def normalize(text: str) -> str:
+    """NFKC 정규화 + 소문자화 후 영문/숫자/한글 이외의 문자를 공백으로 바꿉니다."""
+    return " ".join(_NON_WORD_PATTERN.sub(" ", unicodedata.normalize("NFKC", text).lower()).split())
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    """단어별 문자 n-gram. 한글 단어는 짧으므로 기본값으로 bigram을 사용합니다."""
+    grams = set()
+    for token in text.split():
+        if len(token) <= n:
+            grams.add(token)
+        else:
+            grams.update(token[i:i + n] for i in range(len(token) - n + 1))
+    return grams
+
+
+class CatalogSearchIndex:
+    """
+    워크플로/단위 공정 카탈로그에 대한 퍼지 검색 인덱스. 생성 시 한 번만 전처리합니다.
+    - 정규화된 선택지 문자열("uhw010 liquid handling 액체 시약의 ...")과 정렬된 토큰 목록(접두어 검색용),
+      문자 n-gram → 항목 역색인을 만들어 둡니다.
+    - 검색 시 접두어가 모두 일치하는 항목과 n-gram이 많이 겹치는 상위 후보만 rapidfuzz로 채점하므로,
+      오타가 있어도 찾을 수 있으면서 카탈로그 전체를 매번 훑지 않습니다.
+    """
+
+    PREFIX_MATCH_SCORE = 90.0
+
+    def __init__(self, catalogs: Dict[str, Dict[str, str]], ngram_size: int = 2, max_candidates: int = 50):
+        self.ngram_size = ngram_size
+        self.max_candidates = max_candidates
+        self.entries: List[Dict[str, str]] = [
+            {"id": item_id, "name": name, "type": item_type}
+            for item_type, items in catalogs.items()
+            for item_id, name in items.items()
+        ]
+        self._choices = [normalize(f"{entry['id']} {entry['name']}") for entry in self.entries]
+        # 동점 정렬용 제목 ("Liquid Handling (액체 ...)"에서 괄호 앞의 영문 이름)
+        self._titles = [normalize(entry["name"].split(" (")[0]) for entry in self.entries]
+        self._ids = {entry["id"].lower(): index for index, entry in enumerate(self.entries)}
+        self._tokens = sorted({(token, index) for index, choice in enumerate(self._choices) for token in choice.split()})
+        self._ngrams: Dict[str, List[int]] = {}
+        for index, choice in enumerate(self._choices):
+            for gram in char_ngrams(choice, ngram_size):
+                self._ngrams.setdefault(gram, []).append(index)
+
+    def _prefix_matches(self, token: str) -> set:
+        start = bisect.bisect_left(self._tokens, (token, -1))
+        matches = set()
+        for candidate, index in self._tokens[start:]:
+            if not candidate.startswith(token):
+                break
+            matches.add(index)
+        return matches
+
+    def _prefix_hits(self, tokens: List[str]) -> set:
+        """모든 질의 토큰이 어떤 토큰의 접두어인 항목 (입력 중인 검색어를 바로 찾기 위함)."""
+        hits = None
+        for token in tokens:
+            matches = self._prefix_matches(token)
+            hits = matches if hits is None else hits & matches
+            if not hits:
+                return set()
+        return hits or set()
+
+    def _ngram_candidates(self, query: str) -> List[int]:
+        overlap = Counter()
+        for gram in char_ngrams(query, self.ngram_size):
+            overlap.update(self._ngrams.get(gram, ()))
+        return [index for index, _ in overlap.most_common(self.max_candidates)]
+
+    def search(self, query: str, limit: int = 10, item_type: Optional[str] = None, score_cutoff: float = 60.0) -> List[Dict]:
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        prefix_hits = self._prefix_hits(normalized.split())
+        candidates = prefix_hits.union(self._ngram_candidates(normalized))
+        if item_type:
+            candidates = {index for index in candidates if self.entries[index]["type"] == item_type}
+
+        scores: Dict[int, float] = {}
+        if candidates:
+            matches = process.extract(
+                normalized, {index: self._choices[index] for index in candidates},
+                scorer=fuzz.WRatio, processor=None, limit=None, score_cutoff=score_cutoff,
+            )
+            scores = {index: score for _, score, index in matches}
+        for index in prefix_hits & candidates:
+            scores[index] = max(scores.get(index, 0.0), self.PREFIX_MATCH_SCORE)
+        exact = self._ids.get(normalized)
+        if exact is not None and exact in candidates:
+            scores[exact] = 100.0
+
+        # 같은 점수(예: 접두어 일치)끼리는 ID나 제목이 질의와 더 비슷한(짧고 정확한) 항목을 앞에 둡니다.
+        def tie_break(index: int) -> float:
+            return max(fuzz.ratio(normalized, self._titles[index]), fuzz.ratio(normalized, self.entries[index]["id"].lower()))
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -tie_break(item[0]), self.entries[item[0]]["id"]))[:limit]
+        return [{**self.entries[index], "score": round(score, 1)} for index, score in ranked]
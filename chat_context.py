@@ -0,0 +1,117 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from conversation_store import ConversationStore
+from llm_utils import call_llm_api, parse_model_map
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = "You maintain a running summary of a conversation between a user and an AI assistant. Merge the new messages into the existing summary. Keep facts, names, numbers, decisions and open questions; drop greetings and repetition. Write the summary in Korean, at most 200 words, as plain text without any preamble."
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    토크나이저 없이 토큰 수를 대략 추정합니다.
+    영문·숫자는 약 4글자당 1토큰, 한글 등 비 ASCII 문자는 글자당 1토큰으로 계산합니다.
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + 4  # 메시지당 role/구분자 오버헤드
+
+
+class ContextWindowManager:
+    """
+    /chat 프롬프트를 모델별 토큰 예산 안으로 유지하는 관리자.
+    - 시스템 프롬프트와 최근 keep_turns 턴은 그대로 보냅니다.
+    - 그보다 오래된 턴은 요청 경로 밖의 백그라운드 작업이 롤링 요약으로 접어 두고, 요약만 시스템 프롬프트 뒤에 붙입니다.
+    - 요약이 아직 따라잡지 못한 턴은 예산이 허락하는 만큼 원문으로 포함합니다.
+    대화가 길어져도 프롬프트 크기가 예산으로 제한되므로 턴당 지연 시간이 일정하게 유지됩니다.
+    """
+
+    def __init__(self, default_budget: int = 3000, model_budgets: Dict[str, int] = None,
+                 keep_turns: int = 6, summary_model: Optional[str] = None):
+        self.default_budget = default_budget
+        self.model_budgets = dict(model_budgets or {})
+        self.keep_turns = keep_turns
+        self.summary_model = summary_model
+        self._tasks: set = set()
+
+    @classmethod
+    def from_env(cls) -> "ContextWindowManager":
+        return cls(
+            default_budget=int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000")),
+            model_budgets={model: int(budget) for model, budget in parse_model_map(os.getenv("CHAT_MODEL_TOKEN_BUDGETS", "")).items()},
+            keep_turns=int(os.getenv("CHAT_CONTEXT_KEEP_TURNS", "6")),
+            summary_model=os.getenv("CHAT_SUMMARY_MODEL") or None,
+        )
+
+    def budget_for(self, model_name: str) -> int:
+        return self.model_budgets.get(model_name, self.default_budget)
+
+    def build_messages(self, system_prompt: str, context: Dict, user_message: Dict[str, str], model_name: str) -> List[Dict[str, str]]:
+        """시스템 프롬프트(+요약), 예산 안의 최근 메시지, 이번 질문 순으로 프롬프트를 구성합니다."""
+        if context["summary"]:
+            system_prompt += f"\n\nSummary of the earlier conversation:\n{context['summary']}"
+        system_message = {"role": "system", "content": system_prompt}
+
+        remaining = self.budget_for(model_name) - estimate_tokens(system_prompt) - estimate_tokens(user_message["content"])
+        keep_messages = self.keep_turns * 2
+        history = context["messages"]
+        window: List[Dict[str, str]] = []
+        for offset in range(len(history) - 1, -1, -1):
+            absolute_index = context["first_index"] + offset
+            # 최근 keep_turns 턴을 넘어선 메시지는 아직 요약되지 않은 경우에만 포함합니다.
+            if len(window) >= keep_messages and absolute_index < context["summarized"]:
+                break
+            cost = estimate_tokens(history[offset]["content"])
+            if cost > remaining:
+                break
+            remaining -= cost
+            window.append(history[offset])
+        # 질문 없이 답변만 남는 일이 없도록 user 메시지부터 시작하게 맞춥니다.
+        while window and window[-1]["role"] != "user":
+            window.pop()
+        return [system_message] + window[::-1] + [user_message]
+
+    async def refresh_summary(self, store: ConversationStore, conversation_id: str, model_name: str):
+        """최근 keep_turns 턴보다 오래되었지만 아직 요약되지 않은 메시지를 기존 요약에 합칩니다."""
+        if not await store.acquire_summary_lock(conversation_id):
+            return
+        try:
+            context = await store.load_context(conversation_id)
+            total = context["first_index"] + len(context["messages"])
+            fold_until = total - self.keep_turns * 2
+            start = max(context["summarized"], context["first_index"])
+            if fold_until <= start:
+                return
+
+            new_messages = context["messages"][start - context["first_index"]:fold_until - context["first_index"]]
+            transcript = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in new_messages)
+            user_prompt = f"Existing summary:\n{context['summary'] or '(none)'}\n\nNew messages:\n{transcript}"
+            summary = await call_llm_api(SUMMARY_SYSTEM_PROMPT, user_prompt, self.summary_model or model_name)
+            if summary.startswith("(LLM Error"):
+                logger.warning(f"Skipping summary update for conversation {conversation_id}: {summary}")
+                return
+            await store.save_summary(conversation_id, summary, fold_until)
+            logger.info(f"Folded {len(new_messages)} messages into the summary of conversation {conversation_id}.")
+        except Exception as e:
+            logger.error(f"Failed to refresh summary for conversation {conversation_id}: {e}", exc_info=True)
+        finally:
+            await store.release_summary_lock(conversation_id)
+
+    def schedule_summary(self, store: ConversationStore, conversation_id: str, model_name: str) -> asyncio.Task:
+        """응답을 돌려준 뒤 백그라운드에서 요약을 갱신합니다 (요청 경로의 지연 시간에 영향 없음)."""
+        task = asyncio.create_task(self.refresh_summary(store, conversation_id, model_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+
+_window_manager: Optional[ContextWindowManager] = None
+
+def get_context_window_manager() -> ContextWindowManager:
+    global _window_manager
+    if _window_manager is None:
+        _window_manager = ContextWindowManager.from_env()
+    return _window_manager
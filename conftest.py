@@ -1,13 +1,16 @@
 import pytest
 import os
-import sqlite3
+import shutil
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 
 # main.py를 import하기 전에 환경변수를 설정해야 합니다.
 TEST_DB_PATH = "./test_evaluation_results.db"
 os.environ["EVALUATION_DB_PATH"] = TEST_DB_PATH
+TEST_DPO_SPOOL_DIR = "./test_dpo_spool"
+os.environ["DPO_SPOOL_DIR"] = TEST_DPO_SPOOL_DIR
 
+import main
 from main import app
 
 @pytest.fixture(scope="session")
@@ -16,20 +19,29 @@ def client():
     with TestClient(app) as c:
         yield c
 
+def _remove_test_db():
+    main.feedback_db_module.close_feedback_db()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(TEST_DB_PATH + suffix):
+            os.remove(TEST_DB_PATH + suffix)
+
 @pytest.fixture(scope="function", autouse=True)
 def setup_and_teardown_db():
     """
     각 테스트 함수 실행 전후로 테스트 데이터베이스를 초기화하고 삭제합니다.
     """
-    # 테스트 실행 전: 기존 테스트 DB 파일 삭제
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
+    # 테스트 실행 전: 열려 있는 DB 연결을 닫고 기존 테스트 DB 파일 삭제
+    # (main.py의 feedback_db와 evaluate_model.py의 init_db()가 이 경로에 DB를 새로 생성합니다.)
+    _remove_test_db()
+
+    dpo_spool = main.dpo_module.get_dpo_spool()
+    dpo_spool.take_batch()
+    shutil.rmtree(TEST_DPO_SPOOL_DIR, ignore_errors=True)
+    os.makedirs(TEST_DPO_SPOOL_DIR)
 
-    # main.py의 _init_feedback_db()와 evaluate_model.py의 init_db()가
-    # 이 경로에 DB를 생성하도록 유도합니다.
-    
     yield # 테스트 실행
 
-    # 테스트 실행 후: 테스트 DB 파일 삭제
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
\ No newline at end of file
+    # 테스트 실행 후: 테스트 DB 파일과 DPO 스풀 삭제
+    _remove_test_db()
+    dpo_spool.take_batch()
+    shutil.rmtree(TEST_DPO_SPOOL_DIR, ignore_errors=True)
\ No newline at end of file
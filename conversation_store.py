@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# 저장 공간을 줄이기 위해 role을 한 글자로 줄여 [role, content] 형태로 저장합니다.
+_ROLE_CODES = {"system": "s", "user": "u", "assistant": "a"}
+_ROLE_NAMES = {code: role for role, code in _ROLE_CODES.items()}
+
+
+def pack_message(message: Dict[str, str]) -> str:
+    role = message["role"]
+    return json.dumps([_ROLE_CODES.get(role, role), message["content"]], ensure_ascii=False, separators=(",", ":"))
+
+
+def unpack_message(entry: str) -> Dict[str, str]:
+    role, content = json.loads(entry)
+    return {"role": _ROLE_NAMES.get(role, role), "content": content}
+
+
+class ConversationStore:
+    """
+    /chat 대화 기록을 Redis 리스트에 저장하는 저장소.
+    - 대화마다 `chat:conv:{id}` 리스트 하나에 메시지를 packed JSON 항목으로 RPUSH합니다.
+    - LTRIM으로 최근 max_messages개만 유지하고, 마지막 대화 후 ttl_seconds가 지나면 만료됩니다.
+    - 시스템 프롬프트는 모든 대화에 공통이므로 저장하지 않고 호출 시점에 붙입니다.
+    - `chat:conv:{id}:meta` 해시에 지금까지 추가된 메시지 수(total)와 오래된 턴의 요약(summary,
+      summarized = 요약에 포함된 메시지 수)을 함께 보관합니다. 리스트가 잘려도 메시지의 절대 위치를 알 수 있습니다.
+    Redis에 저장되므로 여러 uvicorn 워커와 노드가 같은 대화를 이어갈 수 있습니다.
+    """
+
+    def __init__(self, redis_pool: redis.ConnectionPool, ttl_seconds: int = 604800,
+                 max_messages: int = 200, key_prefix: str = "chat:conv:"):
+        self.client = redis.Redis(connection_pool=redis_pool)
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def from_env(cls, redis_pool: redis.ConnectionPool) -> "ConversationStore":
+        return cls(
+            redis_pool,
+            ttl_seconds=int(os.getenv("CHAT_HISTORY_TTL_SECONDS", "604800")),
+            max_messages=int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "200")),
+        )
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}"
+
+    def _meta_key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}:meta"
+
+    async def exists(self, conversation_id: str) -> bool:
+        return bool(await self.client.exists(self._key(conversation_id)))
+
+    async def load(self, conversation_id: str) -> List[Dict[str, str]]:
+        entries = await self.client.lrange(self._key(conversation_id), 0, -1)
+        return [unpack_message(entry) for entry in entries]
+
+    async def load_context(self, conversation_id: str) -> Dict:
+        """
+        저장된 메시지와 요약 상태를 함께 읽습니다.
+        first_index는 messages[0]의 절대 위치(잘려 나간 메시지 수)입니다.
+        """
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.lrange(self._key(conversation_id), 0, -1)
+            pipe.hgetall(self._meta_key(conversation_id))
+            entries, meta = await pipe.execute()
+        messages = [unpack_message(entry) for entry in entries]
+        total = int(meta.get("total", len(messages)))
+        return {
+            "messages": messages,
+            "first_index": total - len(messages),
+            "summary": meta.get("summary", ""),
+            "summarized": int(meta.get("summarized", 0)),
+        }
+
+    async def append(self, conversation_id: str, messages: List[Dict[str, str]]):
+        """메시지를 추가하고, 길이 상한과 TTL을 한 번의 트랜잭션으로 갱신합니다."""
+        key, meta_key = self._key(conversation_id), self._meta_key(conversation_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *[pack_message(m) for m in messages])
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.hincrby(meta_key, "total", len(messages))
+            pipe.expire(key, self.ttl_seconds)
+            pipe.expire(meta_key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def save_summary(self, conversation_id: str, summary: str, summarized: int):
+        meta_key = self._meta_key(conversation_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(meta_key, mapping={"summary": summary, "summarized": summarized})
+            pipe.expire(meta_key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def acquire_summary_lock(self, conversation_id: str, ttl_seconds: int = 120) -> bool:
+        """여러 워커가 같은 대화를 동시에 요약하지 않도록 SET NX 잠금을 잡습니다."""
+        return bool(await self.client.set(f"{self._key(conversation_id)}:summarizing", "1", nx=True, ex=ttl_seconds))
+
+    async def release_summary_lock(self, conversation_id: str):
+        await self.client.delete(f"{self._key(conversation_id)}:summarizing")
+
+    async def delete(self, conversation_id: str) -> bool:
+        deleted = await self.client.delete(self._key(conversation_id))
+        await self.client.delete(self._meta_key(conversation_id))
+        return bool(deleted)
+
+
+# main.py의 lifespan에서 redis_pool과 함께 생성합니다.
+conversation_store: Optional[ConversationStore] = None
+
+def get_conversation_store() -> ConversationStore:
+    if conversation_store is None:
+        raise RuntimeError("Conversation store not initialized.")
+    return conversation_store
@@ -0,0 +1,156 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from agents import find_uo_block
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# /create_scaffold가 만든 워크플로 파일의 front matter 제목 또는 `## [WB030 ...]` 제목에서 워크플로 ID를 찾습니다.
+_WORKFLOW_ID_PATTERN = re.compile(r'^(?:title: "|## \\?\[)(W[A-Z]\d{3}) ', re.MULTILINE)
+
+
+def content_hash(text: str) -> str:
+    """클라이언트와 서버가 같은 방식으로 계산하는 문서 해시 (UTF-8 바이트의 SHA-256 hex)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentNotCached(Exception):
+    """해시만 보낸 요청의 문서가 캐시에 없을 때 발생합니다. main.py에서 409로 변환하여 전체 업로드를 요청합니다."""
+
+    status_code = 409
+
+    def __init__(self, document_hash: str):
+        super().__init__(f"Document '{document_hash}' is not cached; resend the full file_content.")
+        self.document_hash = document_hash
+
+
+class ParsedDocument:
+    """워크플로 마크다운과, 한 번 찾은 UO 블록을 기억하는 파싱 결과."""
+
+    def __init__(self, text: str, document_hash: Optional[str] = None):
+        self.text = text
+        self.hash = document_hash or content_hash(text)
+        self._blocks: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.text)
+
+    @property
+    def workflow_id(self) -> Optional[str]:
+        match = _WORKFLOW_ID_PATTERN.search(self.text)
+        return match.group(1) if match else None
+
+    def uo_block(self, uo_id: str) -> Optional[str]:
+        with self._lock:
+            if uo_id not in self._blocks:
+                self._blocks[uo_id] = find_uo_block(self.text, uo_id)
+            return self._blocks[uo_id]
+
+    def replace_block(self, uo_id: str, new_block: str) -> Optional["ParsedDocument"]:
+        """uo_id 블록만 new_block으로 바꾼 새 문서를 반환합니다 (블록이 없으면 None)."""
+        old_block = self.uo_block(uo_id)
+        if old_block is None:
+            return None
+        start = self.text.index(old_block)
+        return ParsedDocument(self.text[:start] + new_block + self.text[start + len(old_block):])
+
+
+class DocumentCache:
+    """
+    /populate_note, /record_preference에서 매번 전체 file_content를 올리고 정규식으로 다시 훑지 않도록,
+    파싱한 문서를 내용 해시로 보관하는 LRU 캐시.
+    - 클라이언트는 처음 한 번 전체 내용을 보내고, 이후에는 content_hash만(변경 없음) 또는 content_hash + 바뀐 UO 블록만 보냅니다.
+    - 블록만 보낸 경우 캐시된 문서에 블록을 끼워 넣은 새 문서를 새 해시로 저장하므로, 다음 요청도 해시만으로 처리됩니다.
+    - 문서 수(max_entries)와 전체 크기(max_chars) 두 가지 한도로 오래 쓰지 않은 문서부터 내보냅니다.
+    캐시는 프로세스별이므로 uvicorn 워커가 여럿이면 다른 워커에서 미스가 날 수 있고, 그때는 409로 전체 업로드를 요청합니다.
+    """
+
+    def __init__(self, max_entries: int = 128, max_chars: int = 64 * 1024 * 1024):
+        self.max_entries = max(1, max_entries)
+        self.max_chars = max_chars
+        self._documents: "OrderedDict[str, ParsedDocument]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "DocumentCache":
+        return cls(
+            max_entries=int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "128")),
+            max_chars=int(os.getenv("DOCUMENT_CACHE_MAX_CHARS", str(64 * 1024 * 1024))),
+        )
+
+    def get(self, document_hash: str) -> Optional[ParsedDocument]:
+        with self._lock:
+            document = self._documents.get(document_hash)
+            if document is None:
+                self.misses += 1
+            else:
+                self._documents.move_to_end(document_hash)
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache="document", result="miss" if document is None else "hit")
+        return document
+
+    def put(self, document: ParsedDocument) -> ParsedDocument:
+        if document.size > self.max_chars:
+            return document
+        with self._lock:
+            existing = self._documents.pop(document.hash, None)
+            if existing is not None:
+                self._chars -= existing.size
+                document = existing  # 이미 찾아 둔 블록을 유지
+            self._documents[document.hash] = document
+            self._chars += document.size
+            while len(self._documents) > self.max_entries or self._chars > self.max_chars:
+                _, evicted = self._documents.popitem(last=False)
+                self._chars -= evicted.size
+        return document
+
+    def add_text(self, text: str) -> ParsedDocument:
+        return self.put(ParsedDocument(text))
+
+    def resolve(self, uo_id: str, file_content: Optional[str] = None, document_hash: Optional[str] = None,
+                uo_block: Optional[str] = None) -> Tuple[Optional[str], Optional[ParsedDocument]]:
+        """
+        요청 필드로부터 (uo_id 블록, 현재 문서)를 구합니다. 블록을 찾지 못하면 블록 자리에 None을 반환합니다.
+        - file_content: 전체 업로드. 파싱 결과를 캐시합니다.
+        - document_hash + uo_block: 바뀐 블록만 업로드. 기준 문서가 캐시에 있으면 갱신한 문서를 새 해시로 저장합니다.
+          (블록만으로도 요청은 처리할 수 있으므로 기준 문서가 없어도 실패하지 않습니다.)
+        - document_hash만: 변경 없음. 캐시에 없으면 DocumentNotCached를 발생시킵니다.
+        """
+        if file_content is not None:
+            document = self.add_text(file_content)
+            return document.uo_block(uo_id), document
+        if not document_hash:
+            raise ValueError("Either file_content or content_hash is required.")
+        if uo_block is not None:
+            block = find_uo_block(uo_block, uo_id)
+            base = self.get(document_hash)
+            updated = base.replace_block(uo_id, uo_block) if base is not None and block is not None else None
+            return block, self.put(updated) if updated is not None else None
+        document = self.get(document_hash)
+        if document is None:
+            raise DocumentNotCached(document_hash)
+        return document.uo_block(uo_id), document
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"documents": len(self._documents), "chars": self._chars, "hits": self.hits, "misses": self.misses}
+
+
+_document_cache: Optional[DocumentCache] = None
+
+def get_document_cache() -> DocumentCache:
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache.from_env()
+    return _document_cache
@@ -0,0 +1,272 @@
+import os
+import re
+import gzip
+import shutil
+import json
+import uuid
+import hashlib
+import logging
+import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from rapidfuzz import fuzz
+
+logger = logging.getLogger(__name__)
+
+# DPO 저장소의 data/ 아래 레이아웃
+#   data/*.json                               : 레코드당 파일 하나 (기존 방식, "files" 모드)
+#   data/shards/YYYY/MM/dpo-YYYYMMDD.jsonl.gz : 날짜별 gzip JSONL 샤드 ("sharded" 모드, compaction 결과)
+#   data/manifest.json                        : 샤드 목록(레코드 수, sha256) — 바뀐 샤드의 새 레코드만 읽는 증분 로딩용
+#                                               (generation은 compaction으로 샤드를 다시 쓸 때마다 바뀝니다)
+SHARD_DIR = "shards"
+MANIFEST_FILE = "manifest.json"
+
+
+def record_timestamp(record: Dict) -> str:
+    return record.get("metadata", {}).get("timestamp_utc") or datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def shard_relpath(timestamp: str) -> str:
+    day = timestamp[:10].replace("-", "")
+    if not re.fullmatch(r"\d{8}", day):
+        day = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")
+    return f"{SHARD_DIR}/{day[:4]}/{day[4:6]}/dpo-{day}.jsonl.gz"
+
+
+def exact_key(record: Dict) -> str:
+    """prompt/chosen/rejected가 완전히 같은 쌍을 찾기 위한 키."""
+    payload = json.dumps([record.get("prompt"), record.get("chosen"), sorted(record.get("rejected", []))],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+# --- 쓰기 ---
+def append_to_shards(data_dir: Path, records: Iterable[Dict]) -> List[Path]:
+    """
+    레코드를 날짜별 gzip JSONL 샤드에 추가하고 manifest를 갱신합니다.
+    gzip은 여러 member를 이어 붙인 파일도 하나의 스트림으로 읽히므로, 기존 샤드를 다시 쓰지 않고 append합니다.
+    id가 있는 레코드는 샤드에 같은 id가 이미 있으면 건너뛰므로, 푸시 후 스풀 정리 전에 중단되어 같은 배치를 다시 보내도 중복되지 않습니다.
+    변경된 샤드와 manifest 경로를 반환합니다 (새로 추가한 레코드가 없으면 빈 목록).
+    """
+    by_shard: Dict[str, List[Dict]] = {}
+    for record in records:
+        by_shard.setdefault(shard_relpath(record_timestamp(record)), []).append(record)
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    changed = []
+    for relpath, shard_records in by_shard.items():
+        path = data_dir / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        existing_ids = {record.get("id") for record in iter_shard(path)} if path.exists() else set()
+        shard_records = [record for record in shard_records if record.get("id") is None or record["id"] not in existing_ids]
+        if not shard_records:
+            continue
+        with gzip.open(path, "ab") as f:
+            for record in shard_records:
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        changed.append(path)
+    if changed:
+        changed.append(update_manifest(data_dir, list(changed)))
+    return changed
+
+
+def _shard_entry(path: Path) -> Dict:
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    records = list(iter_shard(path))
+    timestamps = sorted(record_timestamp(r) for r in records)
+    return {
+        "records": len(records),
+        "bytes": path.stat().st_size,
+        "sha256": digest,
+        "first_timestamp": timestamps[0] if timestamps else None,
+        "last_timestamp": timestamps[-1] if timestamps else None,
+    }
+
+
+def load_manifest(data_dir: Path) -> Dict:
+    path = data_dir / MANIFEST_FILE
+    if not path.exists():
+        return {"version": 1, "generation": uuid.uuid4().hex, "shards": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_manifest(data_dir: Path, shard_paths: Optional[List[Path]] = None) -> Path:
+    """
+    주어진 샤드(없으면 전체 샤드)의 항목을 다시 계산하여 manifest.json에 기록합니다.
+    전체를 다시 계산하는 경우(compaction 후)에는 샤드 내용이 append가 아니라 새로 쓰인 것이므로 generation을 바꿉니다.
+    """
+    if shard_paths is not None:
+        manifest = load_manifest(data_dir)
+    else:
+        manifest = {"version": 1, "generation": uuid.uuid4().hex, "shards": {}}
+        shard_paths = sorted((data_dir / SHARD_DIR).glob("**/*.jsonl.gz"))
+    for path in shard_paths:
+        manifest["shards"][path.relative_to(data_dir).as_posix()] = _shard_entry(path)
+    manifest["shards"] = dict(sorted(manifest["shards"].items()))
+    manifest["total_records"] = sum(entry["records"] for entry in manifest["shards"].values())
+    manifest["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    path = data_dir / MANIFEST_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def changed_shards(previous: Dict, current: Dict) -> List[str]:
+    """이전에 읽은 manifest와 비교하여 새로 추가되었거나 내용이 바뀐 샤드만 반환합니다 (증분 로딩)."""
+    seen = previous.get("shards", {})
+    return [relpath for relpath, entry in current.get("shards", {}).items()
+            if seen.get(relpath, {}).get("sha256") != entry["sha256"]]
+
+
+def export_offsets(previous: Dict, current: Dict) -> Dict[str, int]:
+    """
+    증분 export에서 샤드별로 건너뛸 레코드 수를 구합니다. 샤드는 append만 되므로 이전 manifest의 레코드 수가 곧 offset입니다.
+    compaction으로 generation이 바뀌었으면 모든 샤드를 처음부터 내보내야 합니다 (이전 export는 새 파일로 교체).
+    """
+    if previous.get("generation") != current.get("generation"):
+        return {relpath: 0 for relpath in current.get("shards", {})}
+    seen = previous.get("shards", {})
+    offsets = {}
+    for relpath in changed_shards(previous, current):
+        offset = seen.get(relpath, {}).get("records", 0)
+        offsets[relpath] = offset if offset <= current["shards"][relpath]["records"] else 0
+    return offsets
+
+
+# --- 읽기 ---
+def iter_shard(path: Path) -> Iterator[Dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_legacy_files(data_dir: Path) -> Iterator[Tuple[Path, Dict]]:
+    for path in sorted(data_dir.glob("*.json")):
+        if path.name == MANIFEST_FILE:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            yield path, json.load(f)
+
+
+def iter_records(data_dir: Path) -> Iterator[Dict]:
+    """기존 개별 파일과 샤드의 모든 레코드를 읽습니다."""
+    for _, record in iter_legacy_files(data_dir):
+        yield record
+    for path in sorted((data_dir / SHARD_DIR).glob("**/*.jsonl.gz")):
+        yield from iter_shard(path)
+
+
+# --- 중복 제거 / compaction ---
+def deduplicate(records: Iterable[Dict], near_threshold: float = 95.0) -> Tuple[List[Dict], Dict]:
+    """
+    완전 중복과 근사 중복 쌍을 제거합니다. 같은 쌍이 여러 번 있으면 가장 최근 레코드를 남깁니다.
+    근사 중복: 공백/대소문자를 정규화한 prompt가 같고, chosen의 유사도(rapidfuzz ratio)가 near_threshold 이상인 쌍.
+    prompt별로 묶어서 비교하므로 전체 쌍을 비교하지 않습니다.
+    """
+    ordered = sorted(records, key=record_timestamp, reverse=True)
+    kept: List[Dict] = []
+    exact_seen = set()
+    by_prompt: Dict[str, List[str]] = {}
+    stats = {"input": 0, "exact_duplicates": 0, "near_duplicates": 0}
+    for record in ordered:
+        stats["input"] += 1
+        key = exact_key(record)
+        if key in exact_seen:
+            stats["exact_duplicates"] += 1
+            continue
+        exact_seen.add(key)
+        chosen = _normalize(record.get("chosen"))
+        group = by_prompt.setdefault(_normalize(record.get("prompt")), [])
+        if near_threshold < 100 and any(fuzz.ratio(chosen, other) >= near_threshold for other in group):
+            stats["near_duplicates"] += 1
+            continue
+        group.append(chosen)
+        kept.append(record)
+    kept.sort(key=record_timestamp)
+    stats["output"] = len(kept)
+    return kept, stats
+
+
+def compact(data_dir: Path, near_threshold: float = 95.0, delete_legacy: bool = True) -> Dict:
+    """
+    data/의 모든 레코드(개별 JSON 파일 + 샤드)를 읽어 중복을 제거한 뒤 날짜별 샤드로 다시 쓰고 manifest를 재생성합니다.
+    delete_legacy가 True이면 샤드로 옮긴 개별 JSON 파일을 삭제합니다.
+    """
+    shard_root = data_dir / SHARD_DIR
+    backup = data_dir / f".{SHARD_DIR}.previous"
+    if backup.exists():
+        if shard_root.exists():
+            shutil.rmtree(backup)  # 이전 실행이 교체를 마친 뒤 백업만 지우지 못한 경우
+        else:
+            os.replace(backup, shard_root)  # 이전 실행이 기존 샤드를 옮긴 직후 중단된 경우 복원
+            logger.warning(f"Restored shards left in {backup.name} by an interrupted compaction.")
+
+    legacy_paths = [path for path, _ in iter_legacy_files(data_dir)]
+    records, stats = deduplicate(iter_records(data_dir), near_threshold=near_threshold)
+
+    # 임시 디렉토리에 새 샤드를 만든 뒤, 기존 샤드를 백업 위치로 옮기고 새 샤드를 옮겨 오는 두 번의 rename으로 교체합니다.
+    # 어느 시점에 중단되어도 기존 샤드는 shards/ 또는 백업 위치에 온전히 남고, 다음 실행이 백업을 복원합니다.
+    staging = data_dir / f".{SHARD_DIR}.compacting"
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging_data = staging / "data"
+    (staging_data / SHARD_DIR).mkdir(parents=True)
+    append_to_shards(staging_data, records)
+    if shard_root.exists():
+        os.replace(shard_root, backup)
+    os.replace(staging_data / SHARD_DIR, shard_root)
+    shutil.rmtree(backup, ignore_errors=True)
+    shutil.rmtree(staging)
+    update_manifest(data_dir)
+
+    if delete_legacy:
+        for path in legacy_paths:
+            path.unlink()
+    stats["legacy_files"] = len(legacy_paths)
+    stats["shards"] = len(load_manifest(data_dir)["shards"])
+    return stats
+
+
+def iter_export_records(data_dir: Path, shard_offsets: Optional[Dict[str, int]] = None) -> Iterator[Dict]:
+    """shard_offsets(샤드 → 건너뛸 레코드 수)의 샤드에서 offset 이후 레코드만 읽습니다. None이면 manifest의 모든 샤드 전체."""
+    if shard_offsets is None:
+        shard_offsets = {relpath: 0 for relpath in load_manifest(data_dir)["shards"]}
+    for relpath, offset in shard_offsets.items():
+        for index, record in enumerate(iter_shard(data_dir / relpath)):
+            if index >= offset:
+                yield record
+
+
+def export_parquet(data_dir: Path, output_path: str, shard_offsets: Optional[Dict[str, int]] = None) -> int:
+    """
+    샤드를 학습용 Parquet 파일(prompt, chosen, rejected, + 주요 metadata 컬럼)로 내보냅니다.
+    shard_offsets(export_offsets 결과)를 주면 지난 export 이후 추가된 레코드만 내보냅니다.
+    pyarrow는 학습 환경(datasets)에만 필요한 선택 의존성입니다.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow).") from e
+
+    rows = []
+    for record in iter_export_records(data_dir, shard_offsets):
+        metadata = record.get("metadata", {})
+        rows.append({
+            "prompt": record.get("prompt"),
+            "chosen": record.get("chosen"),
+            "rejected": list(record.get("rejected", [])),
+            "unit_operation_id": metadata.get("unit_operation_id"),
+            "section": metadata.get("section"),
+            "timestamp_utc": metadata.get("timestamp_utc"),
+            "edit_distance_ratio": metadata.get("edit_distance_ratio"),
+        })
+    pq.write_table(pa.Table.from_pylist(rows), output_path, compression="zstd")
+    return len(rows)
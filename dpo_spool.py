@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import random
+import asyncio
+import datetime
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+import git
+
+import dpo_dataset
+from metrics import GIT_PUSH_DURATION
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    """
+    uvicorn 워커 프로세스 사이의 배타 잠금 (fcntl.flock). 같은 DPO_SPOOL_DIR을 쓰는 모든 프로세스가 공유합니다.
+    blocking=False이면 다른 프로세스가 잡고 있을 때 기다리지 않고 False를 돌려줍니다.
+    """
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class DPOSpool:
+    """
+    DPO 선호 데이터를 로컬 디스크에 먼저 기록하는 append-only 스풀.
+    - append()는 pending.jsonl에 한 줄을 쓰고 fsync까지 마친 뒤 반환하므로, 반환 시점에 레코드는 유실되지 않습니다.
+    - take_batch()는 pending.jsonl을 batch-*.jsonl로 원자적으로 이름을 바꿔 커밋 대상으로 떼어냅니다.
+    - 커밋에 성공한 배치 파일만 삭제하므로, 서버가 재시작되어도 남은 배치는 다시 커밋됩니다.
+    - append()와 take_batch()는 프로세스 간 파일 잠금을 잡으므로, 여러 uvicorn 워커가 같은 스풀을 써도 줄이 섞이지 않습니다.
+    - 파싱할 수 없는 줄(쓰다 끊긴 JSON 등)은 quarantine.jsonl로 옮겨, 배치 전체가 계속 실패하지 않도록 합니다.
+    """
+
+    PENDING_FILE = "pending.jsonl"
+    QUARANTINE_FILE = "quarantine.jsonl"
+    LOCK_FILE = ".spool.lock"
+
+    def __init__(self, spool_dir: str):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.pending_path = self.spool_dir / self.PENDING_FILE
+        self.quarantine_path = self.spool_dir / self.QUARANTINE_FILE
+        self.lock_path = self.spool_dir / self.LOCK_FILE
+        self._lock = threading.Lock()
+        self.pending_count = self._count_lines(self.pending_path)
+        self.oldest_pending_at: Optional[float] = time.monotonic() if self.pending_count else None
+
+    @staticmethod
+    def _count_lines(path: Path) -> int:
+        if not path.exists():
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            return sum(1 for line in f if line.strip())
+
+    def append(self, preference_data: Dict, subject: str) -> str:
+        record = {"id": str(uuid.uuid4()), "subject": subject, "data": preference_data}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, file_lock(self.lock_path):
+            with open(self.pending_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending_count += 1
+            if self.oldest_pending_at is None:
+                self.oldest_pending_at = time.monotonic()
+        return record["id"]
+
+    def pending_age(self) -> float:
+        with self._lock:
+            return time.monotonic() - self.oldest_pending_at if self.oldest_pending_at is not None else 0.0
+
+    def take_batch(self) -> Optional[Path]:
+        """대기 중인 레코드를 새 배치 파일로 떼어냅니다. 대기 레코드가 없으면 None을 반환합니다."""
+        with self._lock:
+            self.pending_count = 0
+            self.oldest_pending_at = None
+            if not self.pending_path.exists():
+                return None
+            with file_lock(self.lock_path):
+                # 파일명 순서 = 생성 순서가 되도록 나노초 타임스탬프를 사용합니다.
+                batch_path = self.spool_dir / f"batch-{time.time_ns():020d}.jsonl"
+                try:
+                    os.replace(self.pending_path, batch_path)
+                except FileNotFoundError:
+                    # 다른 워커 프로세스의 커미터가 방금 떼어 간 경우
+                    return None
+                return batch_path
+
+    def batch_files(self) -> List[Path]:
+        return sorted(self.spool_dir.glob("batch-*.jsonl"))
+
+    def read_batch(self, batch_path: Path) -> List[Dict]:
+        """배치 파일의 레코드를 읽습니다. 파싱할 수 없는 줄은 quarantine.jsonl로 옮기고 배치 파일에서 제거합니다."""
+        records, lines, bad_lines = [], [], []
+        with open(batch_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict) or "id" not in record or "data" not in record:
+                        raise ValueError("missing id/data")
+                except ValueError:
+                    bad_lines.append(line)
+                    continue
+                records.append(record)
+                lines.append(line)
+        if bad_lines:
+            logger.warning(f"Quarantining {len(bad_lines)} unparsable DPO spool line(s) from {batch_path.name} to {self.quarantine_path.name}.")
+            with open(self.quarantine_path, 'a', encoding='utf-8') as f:
+                for line in bad_lines:
+                    f.write(json.dumps({"batch": batch_path.name, "line": line.rstrip("\n")}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # 재시도할 때 같은 줄을 다시 격리하지 않도록 정상 레코드만 남긴 배치 파일로 교체합니다.
+            cleaned_path = batch_path.with_suffix(".tmp")
+            with open(cleaned_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(cleaned_path, batch_path)
+        return records
+
+
+class DPOBatchCommitter:
+    """
+    스풀에 쌓인 레코드를 묶어 한 번의 git 커밋/푸시로 보내는 백그라운드 커미터.
+    대기 레코드가 max_batch_size개 이상이거나 가장 오래된 레코드가 max_delay_s초를 넘기면 커밋하고,
+    실패하면 지수 백오프(+jitter)로 재시도합니다.
+    커밋은 스풀 디렉터리의 파일 잠금을 잡은 한 프로세스만 수행하므로, 여러 uvicorn 워커가 있어도 DPO 작업 저장소를 동시에 쓰지 않습니다.
+    """
+
+    COMMIT_LOCK_FILE = ".commit.lock"
+
+    def __init__(self, spool: DPOSpool, commit_fn: Callable[[List[Dict]], None], max_batch_size: int = 50,
+                 max_delay_s: float = 30.0, retry_base_delay_s: float = 5.0, retry_max_delay_s: float = 300.0):
+        self.spool = spool
+        self.commit_fn = commit_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay_s = max_delay_s
+        self.retry_base_delay_s = retry_base_delay_s
+        self.retry_max_delay_s = retry_max_delay_s
+        self._flush_lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.next_attempt_at = 0.0
+        self.batches_committed = 0
+        self.records_committed = 0
+        self.last_error: Optional[str] = None
+
+    def should_flush(self, now: float) -> bool:
+        if now < self.next_attempt_at:
+            return False
+        if self.spool.batch_files():
+            return True  # 이전에 실패했거나 재시작 전에 남은 배치
+        return self.spool.pending_count >= self.max_batch_size or (
+            self.spool.pending_count > 0 and self.spool.pending_age() >= self.max_delay_s
+        )
+
+    def flush(self) -> int:
+        """남은 배치와 대기 레코드를 모두 하나의 커밋으로 보냅니다. 커밋한 레코드 수를 반환합니다."""
+        with self._flush_lock, file_lock(self.spool.spool_dir / self.COMMIT_LOCK_FILE, blocking=False) as acquired:
+            if not acquired:
+                return 0  # 다른 워커 프로세스가 커밋 중이며, 이 프로세스의 레코드도 그 커미터가 함께 가져갑니다.
+            self.spool.take_batch()
+            batch_paths = self.spool.batch_files()
+            if not batch_paths:
+                return 0
+            records = [record for path in batch_paths for record in self.spool.read_batch(path)]
+            if not records:
+                for path in batch_paths:
+                    path.unlink()
+                return 0
+            try:
+                self.commit_fn(records)
+            except Exception as e:
+                self.consecutive_failures += 1
+                delay = random.uniform(0.5, 1.0) * min(self.retry_max_delay_s, self.retry_base_delay_s * 2 ** (self.consecutive_failures - 1))
+                self.next_attempt_at = time.monotonic() + delay
+                self.last_error = str(e)
+                logger.error(f"Failed to commit {len(records)} DPO records (attempt {self.consecutive_failures}). Retrying in {delay:.1f}s: {e}")
+                return 0
+            for path in batch_paths:
+                path.unlink()
+            self.consecutive_failures = 0
+            self.next_attempt_at = 0.0
+            self.batches_committed += 1
+            self.records_committed += len(records)
+            logger.info(f"Committed {len(records)} DPO records from {len(batch_paths)} spool batch(es).")
+            return len(records)
+
+    async def run_loop(self, interval: float = 1.0):
+        while True:
+            try:
+                if self.should_flush(time.monotonic()):
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                # 스풀 파일 오류 등으로 루프가 끝나면 이후 레코드가 영영 커밋되지 않으므로, 기록만 하고 계속 돕니다.
+                logger.error(f"DPO committer loop iteration failed: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> Dict:
+        return {
+            "pending_records": self.spool.pending_count,
+            "pending_age_s": round(self.spool.pending_age(), 1),
+            "unsent_batches": len(self.spool.batch_files()),
+            "batches_committed": self.batches_committed,
+            "records_committed": self.records_committed,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_s": round(max(0.0, self.next_attempt_at - time.monotonic()), 1) if self.consecutive_failures else None,
+            "last_error": self.last_error,
+        }
+
+
+def _batch_commit_message(records: List[Dict]) -> str:
+    if len(records) == 1:
+        return f"feat: Add DPO data for {records[0]['subject']}"
+    subjects = sorted({record["subject"] for record in records})
+    summary = ", ".join(subjects[:5]) + (f" and {len(subjects) - 5} more" if len(subjects) > 5 else "")
+    return f"feat: Add {len(records)} DPO records ({summary})"
+
+
+class DPOGitOptions:
+    """
+    DPO 작업 저장소(로컬 클론)를 만들고 동기화하는 방식.
+    - clone_mode: "blobless"(--filter=blob:none, 파일 내용은 체크아웃할 때만 받음), "shallow"(--depth), "full"(전체 클론)
+    - sparse: True이면 이번 커밋에서 쓰는 경로만 작업 트리에 체크아웃 (sparse checkout)
+    - fetch_depth: clone/fetch 깊이. 0이면 전체 히스토리를 받습니다 (full 모드는 항상 전체 히스토리).
+    """
+
+    CLONE_MODES = ("blobless", "shallow", "full")
+
+    def __init__(self, clone_mode: str = "blobless", sparse: bool = True, fetch_depth: int = 1, branch: str = "main"):
+        if clone_mode not in self.CLONE_MODES:
+            raise ValueError(f"Unknown DPO clone mode '{clone_mode}'. Expected one of {self.CLONE_MODES}.")
+        self.clone_mode = clone_mode
+        self.sparse = sparse
+        self.fetch_depth = max(0, fetch_depth)
+        self.branch = branch
+
+    @classmethod
+    def from_env(cls) -> "DPOGitOptions":
+        return cls(
+            clone_mode=os.getenv("DPO_GIT_CLONE_MODE", "blobless"),
+            sparse=os.getenv("DPO_GIT_SPARSE_CHECKOUT", "true").lower() in ("1", "true", "yes"),
+            fetch_depth=int(os.getenv("DPO_GIT_FETCH_DEPTH", "1")),
+        )
+
+
+def _sparse_patterns(records: List[Dict], write_mode: str) -> List[str]:
+    """
+    sparse checkout 패턴 (non-cone). 루트의 파일만 두고, sharded 모드에서는 이번에 append할 샤드와 manifest만 추가합니다.
+    files 모드는 새 파일만 추가하므로 data/의 기존 파일을 체크아웃할 필요가 없습니다.
+    """
+    patterns = ["/*", "!/*/"]
+    if write_mode == "sharded":
+        shards = {dpo_dataset.shard_relpath(dpo_dataset.record_timestamp(record["data"])) for record in records}
+        patterns.append(f"/data/{dpo_dataset.MANIFEST_FILE}")
+        patterns += [f"/data/{relpath}" for relpath in sorted(shards)]
+    return patterns
+
+
+class DPOGitWorkspace:
+    """
+    프로세스 안에서 재사용하는 DPO 저장소 작업 공간.
+    git.Repo 객체와 동기화 상태를 유지하여, 직전 푸시 이후 원격이 바뀌지 않았다면 fetch 없이 바로 커밋/푸시합니다.
+    (푸시가 non-fast-forward로 거절되면 그때 depth 제한 fetch 후 원격 기준으로 다시 씁니다.)
+    """
+
+    def __init__(self, local_path: Path, options: DPOGitOptions):
+        self.local_path = local_path
+        self.options = options
+        self.repo: Optional[git.Repo] = None
+        self.remote_url: Optional[str] = None
+        self.sparse_patterns: Optional[List[str]] = None
+        self.synced = False  # 로컬 브랜치가 마지막으로 확인한 원격 브랜치와 같은지
+
+    def open(self, repo_url_with_token: str) -> git.Repo:
+        if self.repo is None:
+            if self.local_path.exists():
+                self.repo = git.Repo(self.local_path)
+            else:
+                self.repo = self._clone(repo_url_with_token)
+                self.remote_url = repo_url_with_token
+        if self.remote_url != repo_url_with_token:
+            self.repo.remote(name='origin').set_url(repo_url_with_token)
+            self.remote_url = repo_url_with_token
+        return self.repo
+
+    def _clone(self, repo_url_with_token: str) -> git.Repo:
+        options = self.options
+        clone_kwargs = {"branch": options.branch, "no_checkout": True}
+        if options.clone_mode == "blobless":
+            clone_kwargs["filter"] = "blob:none"
+        if options.clone_mode == "shallow" or (options.clone_mode == "blobless" and options.fetch_depth):
+            clone_kwargs["depth"] = options.fetch_depth or 1
+        logger.info(f"Cloning DPO repository to {self.local_path} ({options.clone_mode} clone, sparse={options.sparse})...")
+        return git.Repo.clone_from(repo_url_with_token, self.local_path, **clone_kwargs)
+
+    def set_sparse_patterns(self, patterns: List[str]):
+        if not self.options.sparse or patterns == self.sparse_patterns:
+            return
+        self.repo.git.sparse_checkout('set', '--no-cone', *patterns)
+        self.sparse_patterns = patterns
+
+    def sync(self):
+        """원격 브랜치를 depth 제한 fetch로 가져와 로컬을 강제로 맞춥니다 (rebase 등 비정상 상태도 초기화)."""
+        repo, branch = self.repo, self.options.branch
+        self.synced = False
+        if "rebase" in repo.git.status():
+            logger.warning("Repository is in a rebase state. Aborting rebase...")
+            repo.git.rebase('--abort')  # 진행중인 rebase 중단
+
+        logger.info("Fetching latest changes from DPO repository...")
+        fetch_kwargs = {}
+        if self.options.clone_mode != "full" and self.options.fetch_depth:
+            fetch_kwargs["depth"] = self.options.fetch_depth
+        repo.remote(name='origin').fetch(branch, **fetch_kwargs)
+        repo.git.reset('--hard', f'origin/{branch}')
+        if self.options.sparse:
+            # 이전에 추가한 파일 중 sparse 패턴 밖에 있는 것을 작업 트리에서 정리
+            repo.git.sparse_checkout('reapply')
+        self.synced = True
+
+
+_workspaces: Dict[str, DPOGitWorkspace] = {}
+_workspaces_lock = threading.Lock()
+
+def get_workspace(local_path_str: str, options: DPOGitOptions) -> DPOGitWorkspace:
+    key = str(Path(local_path_str).resolve())
+    with _workspaces_lock:
+        workspace = _workspaces.get(key)
+        if workspace is None:
+            workspace = _workspaces[key] = DPOGitWorkspace(Path(local_path_str), options)
+        return workspace
+
+
+def _write_records(data_dir: Path, records: List[Dict], write_mode: str) -> List[str]:
+    data_dir.mkdir(parents=True, exist_ok=True)
+    if write_mode == "sharded":
+        # 날짜별 gzip JSONL 샤드에 추가하고 manifest 갱신
+        return [str(path.resolve()) for path in dpo_dataset.append_to_shards(
+            data_dir, [{"id": record["id"], **record["data"]} for record in records]
+        )]
+    # 레코드마다 JSON 파일 생성 (레코드 id를 파일명에 사용하여 재시도 시에도 중복 파일이 생기지 않음)
+    file_paths = []
+    for record in records:
+        timestamp = record["data"].get("metadata", {}).get("timestamp_utc", "")
+        prefix = timestamp[:19].replace("-", "").replace(":", "").replace("T", "_") or datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')
+        file_path = data_dir / f"{prefix}_{record['id']}.json"
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(record["data"], f, ensure_ascii=False, indent=2)
+        file_paths.append(str(file_path.resolve()))
+    return file_paths
+
+
+def _commit(repo: git.Repo, message: str) -> bool:
+    """
+    git CLI로 커밋합니다. GitPython의 index.commit은 인덱스 전체를 파이썬으로 읽어 트리를 다시 만들기 때문에
+    파일 수에 비례해 느려집니다. 작성자 정보는 index.commit과 같은 규칙(git 설정 → 환경 변수 → 기본값)으로 정합니다.
+    바뀐 내용이 없으면 (이미 푸시된 배치를 다시 보낸 경우) 커밋하지 않고 False를 반환합니다.
+    """
+    committer = git.Actor.committer(repo.config_reader())
+    identity = {"GIT_AUTHOR_NAME": str(committer.name), "GIT_AUTHOR_EMAIL": str(committer.email),
+                "GIT_COMMITTER_NAME": str(committer.name), "GIT_COMMITTER_EMAIL": str(committer.email)}
+    with repo.git.custom_environment(**identity):
+        try:
+            repo.git.commit('--no-verify', '-m', message)
+        except git.GitCommandError as e:
+            if "nothing to commit" in str(e) or "nothing added to commit" in str(e):
+                return False
+            raise
+    return True
+
+
+def push_preferences_to_git(token: str, repo_url: str, local_path_str: str, records: List[Dict], write_mode: str = "files",
+                            options: Optional[DPOGitOptions] = None):
+    """
+    스풀 레코드들을 DPO 저장소에 하나의 커밋으로 푸시하는 동기 함수
+    (원격 저장소 기준으로 로컬을 초기화하여 충돌을 방지)
+    write_mode: "files"(레코드당 JSON 파일) 또는 "sharded"(날짜별 gzip JSONL 샤드 + manifest)
+    options: 클론/sparse checkout/fetch 깊이 설정 (기본값: 환경 변수)
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        _push_preferences_to_git(token, repo_url, local_path_str, records, write_mode, options)
+        outcome = "ok"
+    finally:
+        GIT_PUSH_DURATION.observe(time.perf_counter() - started, outcome=outcome)
+
+
+def _push_preferences_to_git(token: str, repo_url: str, local_path_str: str, records: List[Dict], write_mode: str,
+                             options: Optional[DPOGitOptions]):
+    options = options or DPOGitOptions.from_env()
+    repo_url_with_token = repo_url.replace("https://", f"https://oauth2:{token}@")
+
+    # 1. 저장소 클론 또는 열기 (프로세스 내에서 작업 공간을 재사용)
+    workspace = get_workspace(local_path_str, options)
+    repo = workspace.open(repo_url_with_token)
+    origin = repo.remote(name='origin')
+    data_dir = workspace.local_path / "data"
+
+    for attempt in range(2):
+        # 2. 원격과 동기화되어 있지 않으면 (첫 사용, 이전 실패, 푸시 거절) depth 제한 fetch 후 origin 기준으로 초기화
+        workspace.set_sparse_patterns(_sparse_patterns(records, write_mode))
+        if not workspace.synced:
+            workspace.sync()
+        workspace.synced = False  # 푸시가 성공할 때까지는 로컬에 원격에 없는 변경이 있을 수 있음
+
+        # 3. DPO 데이터 기록
+        file_paths = _write_records(data_dir, records, write_mode)
+        logger.info(f"Saved {len(records)} DPO records to {data_dir} ({write_mode} mode)")
+
+        # 4. 변경사항을 하나의 커밋으로 푸시 (sparse checkout 밖의 새 파일도 추가되도록 --sparse 사용)
+        if file_paths:
+            repo.git.add('--sparse', '--', *file_paths)
+        if not file_paths or not _commit(repo, _batch_commit_message(records)):
+            # 이전 시도에서 이미 푸시되었지만 스풀 배치를 지우기 전에 중단된 경우 등, 저장소에 이미 있는 레코드만 남았으면 성공으로 처리
+            workspace.synced = True
+            logger.info("DPO records are already in the repository; nothing to commit.")
+            return
+
+        logger.info("Pushing DPO data to remote repository...")
+        push_infos = origin.push(options.branch)
+        rejected = any(info.flags & (info.REJECTED | info.REMOTE_REJECTED) for info in push_infos)
+        if rejected and attempt == 0:
+            logger.info("Push rejected because the remote has new commits. Fetching and retrying once...")
+            continue
+        push_infos.raise_if_error()
+        if rejected:
+            raise RuntimeError("Push to DPO repository was rejected twice.")
+        workspace.synced = True
+        logger.info("Successfully pushed DPO data to Git.")
+        return
+
+
+# main.py의 lifespan에서 생성합니다.
+dpo_spool: Optional[DPOSpool] = None
+dpo_committer: Optional[DPOBatchCommitter] = None
+
+def get_dpo_spool() -> DPOSpool:
+    global dpo_spool
+    if dpo_spool is None:
+        dpo_spool = DPOSpool(os.getenv("DPO_SPOOL_DIR", "./dpo_spool"))
+    return dpo_spool
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DRAFTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS pregenerated_drafts (
+        sop_version TEXT NOT NULL,
+        workflow_id TEXT NOT NULL,
+        uo_id TEXT NOT NULL,
+        section TEXT NOT NULL,
+        query TEXT NOT NULL,
+        options TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (sop_version, workflow_id, uo_id, section)
+    ) WITHOUT ROWID
+"""
+
+# 사전 생성 대상 섹션 (캐스케이드 정책이 따로 있는, 자주 채우는 섹션)
+DEFAULT_SECTIONS = ("Reagent", "Consumables", "Equipment", "Method")
+
+
+def pregeneration_query(workflow_id: str, workflow_name: str) -> str:
+    """사전 생성 시 에이전트 팀에 넘기는 실험 목표. 사용자 목표 대신 워크플로 설명을 사용합니다."""
+    return f"{workflow_id}: {workflow_name}"
+
+
+class DraftStore:
+    """
+    scripts/pregenerate_drafts.py가 오프피크에 미리 생성한 (워크플로, UO, 섹션)별 초안 저장소 (SQLite, WAL).
+    - 키에 SOP 인덱스 버전(rag_pipeline.compute_index_version)을 포함하므로, SOP가 바뀌면 이전 초안은 자동으로 쓰이지 않습니다.
+    - 조합 하나가 끝날 때마다 바로 커밋하므로 저장된 키 목록이 곧 재개용 체크포인트입니다.
+    /populate_note는 같은 조합의 초안이 있으면 에이전트 팀을 실행하지 않고 바로 시작 옵션으로 돌려줍니다.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(DRAFTS_TABLE_SQL)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DraftStore":
+        return cls(os.getenv("DRAFT_STORE_PATH", "./.cache/pregenerated_drafts.db"))
+
+    def put(self, sop_version: str, workflow_id: str, uo_id: str, section: str, query: str, options: List[str]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pregenerated_drafts (sop_version, workflow_id, uo_id, section, query, options, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sop_version, workflow_id, uo_id, section, query, json.dumps(options, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def get(self, sop_version: str, workflow_id: str, uo_id: str, section: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT query, options, created_at FROM pregenerated_drafts "
+                "WHERE sop_version = ? AND workflow_id = ? AND uo_id = ? AND section = ?",
+                (sop_version, workflow_id, uo_id, section),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"query": row[0], "options": json.loads(row[1]), "created_at": row[2]}
+
+    def completed_keys(self, sop_version: str) -> Set[Tuple[str, str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT workflow_id, uo_id, section FROM pregenerated_drafts WHERE sop_version = ?", (sop_version,)
+            ).fetchall()
+        return set(rows)
+
+    def delete_other_versions(self, sop_version: str) -> int:
+        """현재 SOP 버전이 아닌 초안을 지웁니다 (삭제한 개수 반환)."""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM pregenerated_drafts WHERE sop_version != ?", (sop_version,)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_draft_store: Optional[DraftStore] = None
+
+def get_draft_store() -> DraftStore:
+    global _draft_store
+    if _draft_store is None:
+        _draft_store = DraftStore.from_env()
+    return _draft_store
@@ -0,0 +1,437 @@
+import os
+import json
+import queue
+import base64
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from metrics import SQLITE_WRITE_DURATION
+
+logger = logging.getLogger(__name__)
+
+# scripts/evaluate_model.py의 init_db()도 같은 스키마를 사용합니다.
+EVALUATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS evaluations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        model_a_name TEXT NOT NULL,
+        model_b_name TEXT NOT NULL,
+        judge_model_name TEXT NOT NULL,
+        total_prompts INTEGER NOT NULL,
+        win_count_b INTEGER NOT NULL,
+        loss_count_b INTEGER NOT NULL,
+        tie_count INTEGER NOT NULL,
+        error_count INTEGER NOT NULL,
+        win_rate_b REAL NOT NULL,
+        evaluation_log_path TEXT
+    )
+"""
+
+FEEDBACK_METRICS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS feedback_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        uo_id TEXT NOT NULL,
+        section TEXT NOT NULL,
+        edit_distance_ratio REAL NOT NULL
+    )
+"""
+
+# 대시보드 집계용 시간별 rollup. edit_distance_ratio(0~1)를 0.01 폭의 bin으로 나눈 히스토그램과 합계를 저장하여
+# 원본 이벤트 수와 무관하게 bucket별 count/mean과 근사 p50/p90을 계산합니다. 트리거로 INSERT/DELETE 시 증분 갱신합니다.
+ROLLUP_BINS = 100
+
+FEEDBACK_ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS feedback_metrics_hourly (
+        hour TEXT NOT NULL,
+        uo_id TEXT NOT NULL,
+        section TEXT NOT NULL,
+        bin INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        sum_ratio REAL NOT NULL,
+        PRIMARY KEY (hour, uo_id, section, bin)
+    ) WITHOUT ROWID
+"""
+
+_ROLLUP_KEY = f"substr({{row}}.timestamp, 1, 13), {{row}}.uo_id, {{row}}.section, " \
+              f"MIN({ROLLUP_BINS - 1}, MAX(0, CAST({{row}}.edit_distance_ratio * {ROLLUP_BINS} AS INTEGER)))"
+
+FEEDBACK_ROLLUP_TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_metrics_rollup_insert AFTER INSERT ON feedback_metrics BEGIN
+        INSERT INTO feedback_metrics_hourly (hour, uo_id, section, bin, count, sum_ratio)
+        VALUES ({_ROLLUP_KEY.format(row="NEW")}, 1, NEW.edit_distance_ratio)
+        ON CONFLICT (hour, uo_id, section, bin)
+        DO UPDATE SET count = count + 1, sum_ratio = sum_ratio + excluded.sum_ratio;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS feedback_metrics_rollup_delete AFTER DELETE ON feedback_metrics BEGIN
+        UPDATE feedback_metrics_hourly SET count = count - 1, sum_ratio = sum_ratio - OLD.edit_distance_ratio
+        WHERE (hour, uo_id, section, bin) = ({_ROLLUP_KEY.format(row="OLD")});
+    END
+    """,
+]
+
+FEEDBACK_ROLLUP_BACKFILL_SQL = f"""
+    INSERT INTO feedback_metrics_hourly (hour, uo_id, section, bin, count, sum_ratio)
+    SELECT {_ROLLUP_KEY.format(row="feedback_metrics")}, COUNT(*), SUM(edit_distance_ratio)
+    FROM feedback_metrics GROUP BY 1, 2, 3, 4
+"""
+
+INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_evaluations_timestamp ON evaluations (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_feedback_metrics_timestamp ON feedback_metrics (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_feedback_metrics_uo_id ON feedback_metrics (uo_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_feedback_metrics_section ON feedback_metrics (section, timestamp)",
+]
+
+SCHEMA = [EVALUATIONS_TABLE_SQL, FEEDBACK_METRICS_TABLE_SQL, FEEDBACK_ROLLUP_TABLE_SQL, *FEEDBACK_ROLLUP_TRIGGERS_SQL, *INDEXES_SQL]
+
+# bucket 키 (UTC ISO-8601 timestamp 문자열 기준, week는 월요일 시작)
+BUCKET_EXPRESSIONS = {
+    "hour": "substr({column}, 1, 13) || ':00'",
+    "day": "substr({column}, 1, 10)",
+    "week": "date(substr({column}, 1, 10), '-6 days', 'weekday 1')",
+}
+FEEDBACK_GROUP_COLUMNS = ("uo_id", "section")
+EVALUATION_GROUP_COLUMNS = ("model_b_name", "judge_model_name")
+
+
+class FeedbackDatabase:
+    """
+    평가/피드백 지표 SQLite DB의 공유 접근 계층.
+    - 스키마는 start()에서 한 번만 초기화하고, WAL 모드로 읽기와 쓰기가 서로 막지 않게 합니다.
+    - 쓰기는 전용 writer 스레드가 큐에서 꺼내 처리하며, 그 사이 쌓인 쓰기를 하나의 트랜잭션으로 묶어 커밋합니다.
+      호출자는 자기 쓰기가 커밋될 때까지 기다리므로 응답 직후의 조회에서도 결과가 보입니다.
+    - 읽기는 읽기 전용 연결 풀에서 연결을 빌려 스레드에서 실행합니다 (이벤트 루프를 막지 않음).
+    """
+
+    def __init__(self, db_path: str, read_pool_size: int = 4, max_batch_size: int = 100):
+        self.db_path = db_path
+        self.read_pool_size = max(1, read_pool_size)
+        self.max_batch_size = max(1, max_batch_size)
+        self._write_queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._read_connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+
+    @classmethod
+    def from_env(cls) -> "FeedbackDatabase":
+        return cls(
+            db_path=os.getenv("EVALUATION_DB_PATH", "scripts/evaluation_results.db"),
+            read_pool_size=int(os.getenv("FEEDBACK_DB_READ_POOL_SIZE", "4")),
+        )
+
+    # --- 수명 주기 ---
+    def start(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._backfill_rollup(conn)
+            self._writer = threading.Thread(target=self._writer_loop, args=(conn,), name="feedback-db-writer", daemon=True)
+            self._writer.start()
+            logger.info(f"Feedback database initialized in '{self.db_path}' (WAL mode)")
+
+    @staticmethod
+    def _backfill_rollup(conn: sqlite3.Connection):
+        """rollup 테이블이 생기기 전에 쌓인 피드백이 있으면 한 번에 채웁니다 (이후로는 트리거가 유지)."""
+        has_rollup = conn.execute("SELECT 1 FROM feedback_metrics_hourly LIMIT 1").fetchone()
+        has_events = conn.execute("SELECT 1 FROM feedback_metrics LIMIT 1").fetchone()
+        if has_events and not has_rollup:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(FEEDBACK_ROLLUP_BACKFILL_SQL)
+            logger.info("Backfilled feedback_metrics_hourly rollup from existing feedback events.")
+
+    def close(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._write_queue.put(None)
+                writer.join()
+            for conn in self._read_connections:
+                conn.close()
+            self._read_connections = []
+            self._read_pool = queue.LifoQueue()
+
+    # --- 쓰기 ---
+    def _writer_loop(self, conn: sqlite3.Connection):
+        try:
+            while True:
+                item = self._write_queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                while len(batch) < self.max_batch_size:
+                    try:
+                        item = self._write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._write_queue.put(None)  # 현재 배치를 커밋한 뒤 종료
+                        break
+                    batch.append(item)
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: List[tuple]):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, params, future, _ in batch:
+                try:
+                    results.append((future, conn.execute(sql, params).lastrowid, None))
+                except sqlite3.Error as e:
+                    results.append((future, None, e))  # 실패한 문장만 오류를 돌려주고 나머지는 커밋
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to commit {len(batch)} feedback DB writes: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        committed_at = time.perf_counter()
+        for _, _, _, submitted_at in batch:
+            SQLITE_WRITE_DURATION.observe(committed_at - submitted_at)
+        for future, lastrowid, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(lastrowid)
+
+    def submit_write(self, sql: str, params: Sequence[Any] = ()) -> concurrent.futures.Future:
+        """쓰기를 writer 큐에 넣고, 커밋되면 lastrowid로 완료되는 Future를 반환합니다."""
+        if self._writer is None:
+            raise RuntimeError("Feedback database is not started.")
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._write_queue.put((sql, tuple(params), future, time.perf_counter()))
+        return future
+
+    async def write(self, sql: str, params: Sequence[Any] = ()) -> int:
+        return await asyncio.wrap_future(self.submit_write(sql, params))
+
+    # --- 읽기 ---
+    def _borrow_reader(self) -> sqlite3.Connection:
+        try:
+            return self._read_pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._read_connections) < self.read_pool_size:
+                conn = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True,
+                                       timeout=30, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                self._read_connections.append(conn)
+                return conn
+        return self._read_pool.get()  # 풀이 가득 찼으면 다른 요청이 반납할 때까지 대기
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict]:
+        conn = self._borrow_reader()
+        try:
+            return [dict(row) for row in conn.execute(sql, tuple(params)).fetchall()]
+        finally:
+            self._read_pool.put(conn)
+
+    async def fetch_all(self, sql: str, params: Sequence[Any] = ()) -> List[Dict]:
+        return await asyncio.to_thread(self.query, sql, params)
+
+    def iter_query(self, sql: str, params: Sequence[Any] = (), chunk_size: int = 500) -> Iterator[List[Dict]]:
+        """결과를 chunk_size개씩 나눠 읽는 제너레이터. 전체 결과를 메모리에 올리지 않으며, 닫힐 때 연결을 반납합니다."""
+        conn = self._borrow_reader()
+        cursor = None
+        try:
+            cursor = conn.execute(sql, tuple(params))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield [dict(row) for row in rows]
+        finally:
+            if cursor is not None:
+                cursor.close()
+            self._read_pool.put(conn)
+
+    def snapshot(self) -> Dict:
+        return {
+            "pending_writes": self._write_queue.qsize(),
+            "writes": self.writes,
+            "commits": self.commits,
+            "read_connections": len(self._read_connections),
+        }
+
+
+# --- 이력 조회 (keyset 페이지네이션) ---
+def encode_cursor(row: Dict) -> str:
+    """페이지의 마지막 행의 (timestamp, id)를 다음 페이지 조회용 불투명 커서로 만듭니다."""
+    payload = json.dumps([row["timestamp"], row["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(payload)
+        if not isinstance(timestamp, str) or not isinstance(row_id, int):
+            raise TypeError
+        return timestamp, row_id
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from e
+
+
+def history_query(table: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                  after: Optional[Tuple[str, int]] = None, limit: Optional[int] = None):
+    """
+    start_date/end_date(YYYY-MM-DD)로 timestamp를 필터링하는 원본 이력 조회 쿼리.
+    (timestamp, id) 순으로 정렬하며, after가 있으면 그 행 다음부터 조회합니다 (timestamp 인덱스 = (timestamp, rowid) 순서).
+    """
+    where, params = _time_range("timestamp", start_date, end_date, "T23:59:59.999999")
+    if after is not None:
+        where += (" AND " if where else " WHERE ") + "(timestamp, id) > (?, ?)"
+        params += list(after)
+    sql = f"SELECT * FROM {table}{where} ORDER BY timestamp ASC, id ASC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+# --- 대시보드 집계 ---
+def _time_range(column: str, start_date: Optional[str], end_date: Optional[str], end_suffix: str):
+    conditions, params = [], []
+    if start_date:
+        conditions.append(f"{column} >= ?")
+        params.append(start_date)
+    if end_date:
+        # 날짜의 끝까지 포함
+        conditions.append(f"{column} <= ?")
+        params.append(f"{end_date}{end_suffix}")
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def feedback_rollup_query(bucket: str, group_by: Optional[str], start_date: Optional[str] = None,
+                          end_date: Optional[str] = None):
+    """시간별 rollup에서 bucket(+group)별 히스토그램을 읽는 쿼리. 결과는 summarize_histograms()로 요약합니다."""
+    if bucket not in BUCKET_EXPRESSIONS:
+        raise ValueError(f"Unsupported bucket '{bucket}'. Expected one of {list(BUCKET_EXPRESSIONS)}.")
+    if group_by is not None and group_by not in FEEDBACK_GROUP_COLUMNS:
+        raise ValueError(f"Unsupported group_by '{group_by}'. Expected one of {list(FEEDBACK_GROUP_COLUMNS)}.")
+    where, params = _time_range("hour", start_date, end_date, "T23")
+    bucket_sql = BUCKET_EXPRESSIONS[bucket].format(column="hour")
+    group_sql = group_by or "NULL"
+    sql = (f"SELECT {bucket_sql} AS bucket, {group_sql} AS grp, bin, SUM(count) AS count, SUM(sum_ratio) AS sum_ratio "
+           f"FROM feedback_metrics_hourly{where} GROUP BY bucket, grp, bin HAVING SUM(count) > 0 ORDER BY bucket, grp, bin")
+    return sql, params
+
+
+def _histogram_percentile(bins: List[tuple], total: int, q: float) -> float:
+    target = q * total
+    cumulative = 0
+    for bin_index, count in bins:
+        cumulative += count
+        if cumulative >= target:
+            return round((bin_index + 0.5) / ROLLUP_BINS, 4)  # bin 중앙값 (오차 ±0.005)
+    return round((bins[-1][0] + 0.5) / ROLLUP_BINS, 4)
+
+
+def summarize_histograms(rows: List[Dict], group_by: Optional[str]) -> List[Dict]:
+    """feedback_rollup_query() 결과를 bucket(+group)별 count/mean/p50/p90으로 요약합니다."""
+    groups: Dict[tuple, Dict] = {}
+    for row in rows:
+        entry = groups.setdefault((row["bucket"], row["grp"]), {"bins": [], "count": 0, "sum": 0.0})
+        entry["bins"].append((row["bin"], row["count"]))
+        entry["count"] += row["count"]
+        entry["sum"] += row["sum_ratio"]
+    result = []
+    for (bucket, group), entry in groups.items():
+        item = {"bucket": bucket}
+        if group_by:
+            item[group_by] = group
+        item.update({
+            "count": entry["count"],
+            "mean": round(entry["sum"] / entry["count"], 4),
+            "p50": _histogram_percentile(entry["bins"], entry["count"], 0.5),
+            "p90": _histogram_percentile(entry["bins"], entry["count"], 0.9),
+        })
+        result.append(item)
+    return result
+
+
+def evaluation_bucket_query(bucket: str, group_by: Optional[str], start_date: Optional[str] = None,
+                            end_date: Optional[str] = None):
+    """평가 이력은 평가 실행당 한 행이라 양이 적으므로 인덱스 범위 조회 후 summarize_values()로 요약합니다."""
+    if bucket not in BUCKET_EXPRESSIONS:
+        raise ValueError(f"Unsupported bucket '{bucket}'. Expected one of {list(BUCKET_EXPRESSIONS)}.")
+    if group_by is not None and group_by not in EVALUATION_GROUP_COLUMNS:
+        raise ValueError(f"Unsupported group_by '{group_by}'. Expected one of {list(EVALUATION_GROUP_COLUMNS)}.")
+    where, params = _time_range("timestamp", start_date, end_date, "T23:59:59.999999")
+    sql = (f"SELECT {BUCKET_EXPRESSIONS[bucket].format(column='timestamp')} AS bucket, {group_by or 'NULL'} AS grp, "
+           f"win_rate_b AS value FROM evaluations{where} ORDER BY bucket, grp")
+    return sql, params
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = q * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_values(rows: List[Dict], group_by: Optional[str]) -> List[Dict]:
+    groups: Dict[tuple, List[float]] = {}
+    for row in rows:
+        groups.setdefault((row["bucket"], row["grp"]), []).append(row["value"])
+    result = []
+    for (bucket, group), values in groups.items():
+        values.sort()
+        item = {"bucket": bucket}
+        if group_by:
+            item[group_by] = group
+        item.update({
+            "count": len(values),
+            "mean": round(sum(values) / len(values), 4),
+            "p50": round(_percentile(values, 0.5), 4),
+            "p90": round(_percentile(values, 0.9), 4),
+        })
+        result.append(item)
+    return result
+
+
+# main.py의 lifespan에서 시작하고 종료합니다.
+feedback_db: Optional[FeedbackDatabase] = None
+
+def get_feedback_db() -> FeedbackDatabase:
+    global feedback_db
+    if feedback_db is None:
+        feedback_db = FeedbackDatabase.from_env()
+        feedback_db.start()
+    return feedback_db
+
+def close_feedback_db():
+    global feedback_db
+    if feedback_db is not None:
+        feedback_db.close()
+        feedback_db = None
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueue:
+    """
+    오래 걸리는 에이전트 작업(/populate_note 등)을 API 프로세스 밖의 워커(worker.py)로 넘기기 위한 Redis 작업 큐.
+    - `job:{id}` 해시에 kind, status(queued → running → succeeded/failed/cancelled), payload, result, error와 시각을 저장합니다.
+    - 대기 중인 job id는 kind별 `jobs:queue:{kind}` 리스트에 LPUSH하고, 워커가 BRPOP으로 가져갑니다.
+    - 멱등성 키(`job:idem:{kind}:{key}`)가 같으면 새 작업을 만들지 않고 기존 job id를 돌려줍니다.
+    - 끝난 작업은 result_ttl_seconds, 대기/실행 중인 작업은 pending_ttl_seconds 후에 만료됩니다.
+    API 노드와 GPU 워커가 Redis만 공유하므로 서로 독립적으로 확장할 수 있습니다.
+    """
+
+    def __init__(self, redis_pool: redis.ConnectionPool, result_ttl_seconds: int = 3600,
+                 pending_ttl_seconds: int = 86400, key_prefix: str = "job:"):
+        self.client = redis.Redis(connection_pool=redis_pool)
+        self.result_ttl_seconds = result_ttl_seconds
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def from_env(cls, redis_pool: redis.ConnectionPool) -> "JobQueue":
+        return cls(
+            redis_pool,
+            result_ttl_seconds=int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600")),
+            pending_ttl_seconds=int(os.getenv("JOB_PENDING_TTL_SECONDS", "86400")),
+        )
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.key_prefix}{job_id}"
+
+    def _idempotency_key(self, kind: str, idempotency_key: str) -> str:
+        return f"{self.key_prefix}idem:{kind}:{idempotency_key}"
+
+    @staticmethod
+    def queue_key(kind: str) -> str:
+        return f"jobs:queue:{kind}"
+
+    # --- API 측 ---
+    async def submit(self, kind: str, payload: Dict, idempotency_key: Optional[str] = None) -> Tuple[str, bool]:
+        """작업을 큐에 넣고 (job_id, 새로 생성했는지)를 반환합니다."""
+        job_id = uuid.uuid4().hex
+        if idempotency_key:
+            idem_key = self._idempotency_key(kind, idempotency_key)
+            # 키를 먼저 잡은 요청이 아직 job 해시를 쓰기 전일 수 있으므로, 해시가 없더라도 키가 살아 있는 동안은 그 작업을 돌려주고
+            # 키를 덮어쓰지 않습니다. 끝나거나 취소된 작업의 키는 해시와 함께 만료되므로 그 뒤에는 SET NX가 다시 성공합니다.
+            while not await self.client.set(idem_key, job_id, nx=True, ex=self.pending_ttl_seconds):
+                existing = await self.client.get(idem_key)
+                if existing:
+                    return existing, False
+                # SET NX와 GET 사이에 키가 만료되었으면 다시 시도
+
+        key = self._key(job_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                "kind": kind,
+                "status": "queued",
+                "payload": json.dumps(payload, ensure_ascii=False),
+                "idempotency_key": idempotency_key or "",
+                "created_at": time.time(),
+            })
+            pipe.expire(key, self.pending_ttl_seconds)
+            pipe.lpush(self.queue_key(kind), job_id)
+            await pipe.execute()
+        logger.info(f"Queued {kind} job {job_id}.")
+        return job_id, True
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        data = await self.client.hgetall(self._key(job_id))
+        if not data:
+            return None
+        job = {
+            "job_id": job_id,
+            "kind": data.get("kind"),
+            "status": data.get("status"),
+            "created_at": float(data["created_at"]) if data.get("created_at") else None,
+            "started_at": float(data["started_at"]) if data.get("started_at") else None,
+            "finished_at": float(data["finished_at"]) if data.get("finished_at") else None,
+            "result": json.loads(data["result"]) if data.get("result") else None,
+            "error": data.get("error") or None,
+        }
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[str]:
+        """
+        작업 취소를 요청하고 현재 상태를 반환합니다 (없으면 None).
+        대기 중이면 바로 cancelled가 되고, 실행 중이면 워커가 cancel_requested를 보고 실행을 중단합니다.
+        """
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job["status"] if job else None
+        key = self._key(job_id)
+        idempotency_key = await self.client.hget(key, "idempotency_key")
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"cancel_requested": "1"})
+            if job["status"] == "queued":
+                pipe.hset(key, mapping={"status": "cancelled", "finished_at": time.time()})
+                pipe.expire(key, self.result_ttl_seconds)
+                if idempotency_key:
+                    pipe.expire(self._idempotency_key(job["kind"], idempotency_key), self.result_ttl_seconds)
+            await pipe.execute()
+        logger.info(f"Cancellation requested for job {job_id} ({job['status']}).")
+        return "cancelled" if job["status"] == "queued" else job["status"]
+
+    async def events(self, job_id: str, poll_interval: float = 0.5) -> AsyncIterator[Dict]:
+        """상태가 바뀔 때마다 작업 정보를 내보내고, 끝나거나 만료되면 종료합니다 (SSE용)."""
+        last_status = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(poll_interval)
+
+    # --- 워커 측 ---
+    async def dequeue(self, kinds: List[str], timeout: int = 5) -> Optional[str]:
+        item = await self.client.brpop([self.queue_key(kind) for kind in kinds], timeout=timeout)
+        return item[1] if item else None
+
+    async def claim(self, job_id: str) -> Optional[Dict]:
+        """대기 중인 작업을 running으로 바꾸고 payload를 포함한 작업 정보를 반환합니다. 취소·만료된 작업이면 None."""
+        key = self._key(job_id)
+        data = await self.client.hgetall(key)
+        if not data or data.get("status") != "queued" or data.get("cancel_requested") == "1":
+            return None
+        await self.client.hset(key, mapping={"status": "running", "started_at": time.time()})
+        return {"job_id": job_id, "kind": data["kind"], "payload": json.loads(data["payload"])}
+
+    async def requeue(self, job_id: str, kind: str):
+        """워커 종료 등으로 끝내지 못한 작업을 큐의 맨 앞으로 되돌립니다."""
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={"status": "queued", "started_at": ""})
+            pipe.rpush(self.queue_key(kind), job_id)
+            await pipe.execute()
+
+    async def is_cancel_requested(self, job_id: str) -> bool:
+        return await self.client.hget(self._key(job_id), "cancel_requested") == "1"
+
+    async def finish(self, job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        key = self._key(job_id)
+        mapping = {"status": status, "finished_at": time.time()}
+        if result is not None:
+            mapping["result"] = json.dumps(result, ensure_ascii=False)
+        if error is not None:
+            mapping["error"] = error
+        idempotency_key = await self.client.hget(key, "idempotency_key")
+        kind = await self.client.hget(key, "kind")
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.result_ttl_seconds)
+            if idempotency_key:
+                pipe.expire(self._idempotency_key(kind, idempotency_key), self.result_ttl_seconds)
+            await pipe.execute()
+
+
+# main.py의 lifespan 또는 worker.py에서 생성합니다.
+job_queue: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise RuntimeError("Job queue not initialized.")
+    return job_queue
@@ -1,12 +1,689 @@
 import os
 import re
+import json
+import time
+import random
+import asyncio
+import hashlib
 import logging
+import threading
+import contextvars
+import concurrent.futures
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
 import ollama
 from dotenv import load_dotenv
 
+from metrics import CACHE_REQUESTS, LLM_CALL_DURATION, LLM_TOKENS
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+
+# --- Ollama 멀티 호스트 풀 ---
+class OllamaHost:
+    """풀에 등록된 단일 Ollama 엔드포인트의 상태."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.resident_models: set = set()
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_error: Optional[str] = None
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def snapshot(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.is_available(time.monotonic()),
+            "in_flight": self.in_flight,
+            "resident_models": sorted(self.resident_models),
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaHostPool:
+    """
+    여러 Ollama 호스트에 LLM 호출을 분산하는 풀.
+    - 모델이 이미 적재된(/api/ps) 호스트를 우선 선택하여 VRAM 재적재를 피합니다.
+    - 적재된 호스트가 없으면 처리 중인 요청 수가 가장 적은 호스트로 보냅니다.
+    - 연속 실패가 임계값을 넘은 호스트는 일정 시간 동안 풀에서 제외(ejection)됩니다.
+
+    /populate_note 요청마다 별도의 이벤트 루프(스레드)에서 호출되므로 상태는 threading.Lock으로 보호합니다.
+    """
+
+    def __init__(self, urls: List[str], failure_threshold: int = 3, eject_seconds: float = 30.0):
+        if not urls:
+            raise ValueError("At least one Ollama base URL is required.")
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "OllamaHostPool":
+        urls_str = os.getenv("OLLAMA_BASE_URLS") or os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434"
+        urls = [url.strip() for url in urls_str.split(",") if url.strip()]
+        return cls(
+            urls,
+            failure_threshold=int(os.getenv("OLLAMA_HOST_FAILURE_THRESHOLD", "3")),
+            eject_seconds=float(os.getenv("OLLAMA_HOST_EJECT_SECONDS", "30")),
+        )
+
+    def acquire(self, model_name: str) -> OllamaHost:
+        """model_name을 처리할 호스트를 선택하고 in_flight 카운트를 올립니다."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [h for h in self.hosts if h.is_available(now)]
+            if not candidates:
+                # 모든 호스트가 제외된 상태라면 가장 먼저 복귀할 호스트로 시도합니다.
+                candidates = [min(self.hosts, key=lambda h: h.ejected_until)]
+
+            resident = [h for h in candidates if model_name in h.resident_models]
+            host = min(resident or candidates, key=lambda h: h.in_flight)
+
+            host.in_flight += 1
+            # 선택된 호스트에 모델이 적재될 것이므로, 다음 호출도 같은 호스트로 가도록 미리 기록합니다.
+            host.resident_models.add(model_name)
+            return host
+
+    def release(self, host: OllamaHost, error: Optional[Exception] = None):
+        """호출 종료 후 in_flight를 내리고, 연결 오류인 경우 실패 횟수를 누적합니다."""
+        with self._lock:
+            host.in_flight = max(0, host.in_flight - 1)
+            if error is None or isinstance(error, ollama.ResponseError):
+                # ResponseError(모델 없음 등)는 호스트 자체의 장애가 아니므로 헬스 판정에서 제외합니다.
+                host.consecutive_failures = 0
+                return
+            host.consecutive_failures += 1
+            host.last_error = str(error)
+            if host.consecutive_failures >= self.failure_threshold:
+                host.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"[OllamaPool] Ejecting host {host.url} for {self.eject_seconds}s after {host.consecutive_failures} consecutive failures.")
+
+    def forget_resident(self, host: OllamaHost, model_name: str):
+        with self._lock:
+            host.resident_models.discard(model_name)
+
+    async def refresh(self):
+        """각 호스트의 /api/ps를 조회하여 적재된 모델 목록과 헬스 상태를 갱신합니다."""
+        async def _probe(host: OllamaHost):
+            try:
+                response = await ollama.AsyncClient(host=host.url).ps()
+                models = {m.get('model') or m.get('name') for m in response.get('models', [])}
+                with self._lock:
+                    host.resident_models = {m for m in models if m}
+                    if host.consecutive_failures or host.ejected_until:
+                        logger.info(f"[OllamaPool] Host {host.url} is healthy again.")
+                    host.consecutive_failures = 0
+                    host.ejected_until = 0.0
+                    host.last_error = None
+            except Exception as e:
+                self._mark_probe_failure(host, e)
+
+        await asyncio.gather(*[_probe(host) for host in self.hosts])
+
+    def _mark_probe_failure(self, host: OllamaHost, error: Exception):
+        with self._lock:
+            host.consecutive_failures += 1
+            host.last_error = str(error)
+            host.resident_models = set()
+            if host.consecutive_failures >= self.failure_threshold:
+                host.ejected_until = time.monotonic() + self.eject_seconds
+        logger.warning(f"[OllamaPool] Health probe failed for {host.url}: {error}")
+
+    async def run_refresh_loop(self, interval: float = 15.0):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [host.snapshot() for host in self.hosts]
+
+
+_ollama_pool: Optional[OllamaHostPool] = None
+
+def get_ollama_pool() -> OllamaHostPool:
+    global _ollama_pool
+    if _ollama_pool is None:
+        _ollama_pool = OllamaHostPool.from_env()
+    return _ollama_pool
+
+
+@asynccontextmanager
+async def ollama_client_for(model_name: str):
+    """model_name을 처리할 호스트의 AsyncClient를 반환하고, 종료 시 풀 상태를 갱신합니다."""
+    pool = get_ollama_pool()
+    host = pool.acquire(model_name)
+    error = None
+    try:
+        yield ollama.AsyncClient(host=host.url)
+    except BaseException as e:
+        error = e if isinstance(e, Exception) else None
+        raise
+    finally:
+        pool.release(host, error)
+
+
+# --- 동일 요청 병합 (single-flight) ---
+class _LeaderCancelled(Exception):
+    """leader가 취소되었음을 follower에게 알리는 신호. follower는 이 경우 직접 다시 호출합니다."""
+
+
+class SingleFlight:
+    """
+    동시에 진행 중인 동일한 호출을 하나로 합치는 single-flight 그룹.
+    첫 호출(leader)만 실제로 실행되고, 같은 키로 들어온 호출(follower)은 그 결과를 공유합니다.
+    /populate_note는 요청마다 별도의 이벤트 루프에서 실행되므로, 루프에 묶이지 않는
+    concurrent.futures.Future를 공유 지점으로 사용합니다.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, concurrent.futures.Future] = {}
+        self.executed_calls = 0
+        self.coalesced_calls = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _join(self, key: str):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced_calls += 1
+                CACHE_REQUESTS.inc(cache=f"{self.name}_single_flight", result="hit")
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            self.executed_calls += 1
+            CACHE_REQUESTS.inc(cache=f"{self.name}_single_flight", result="miss")
+            return future, True
+
+    def _finish(self, key: str, future: concurrent.futures.Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future, is_leader = self._join(key)
+        if not is_leader:
+            # follower가 취소되더라도 공유 future(다른 호출자들의 결과)는 취소되지 않도록 shield 처리
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                # leader만 취소된 것이므로 follower는 취소하지 않고, 같은 키로 다시 합류하거나 새 leader가 되어 실행합니다.
+                return await self.do(key, fn)
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                # 공유 future를 취소하면 취소되지 않은 follower까지 CancelledError로 끝나므로, 키를 먼저 비운 뒤 재실행을 알립니다.
+                self._finish(key, future)
+                future.set_exception(_LeaderCancelled())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    def do_sync(self, key: str, fn: Callable[[], Any]) -> Any:
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed_calls": self.executed_calls,
+                "coalesced_calls": self.coalesced_calls,
+            }
+
+
+llm_single_flight = SingleFlight("llm")
+
+
+# --- 모델 상주(residency) 관리 ---
+class ModelStats:
+    """모델별 트래픽과 첫 토큰까지의 시간(TTFT) 통계."""
+
+    def __init__(self):
+        self.requests = 0
+        self.last_request_at = 0.0
+        self.last_warmed_at = 0.0
+        self.ttft_count = 0
+        self.ttft_total_s = 0.0
+        self.last_ttft_s: Optional[float] = None
+        self.cold_loads = 0
+        self.cold_load_total_s = 0.0
+        self.released = 0
+
+    def snapshot(self, now: float) -> Dict:
+        return {
+            "requests": self.requests,
+            "idle_seconds": round(now - self.last_request_at, 1) if self.last_request_at else None,
+            "last_ttft_s": self.last_ttft_s,
+            "mean_ttft_s": self.ttft_total_s / self.ttft_count if self.ttft_count else None,
+            "cold_loads": self.cold_loads,
+            "mean_cold_load_s": self.cold_load_total_s / self.cold_loads if self.cold_loads else None,
+            "released": self.released,
+        }
+
+
+class ModelResidencyManager:
+    """
+    실제 요청에 Ollama keep_alive를 실어 모델 상주 시간을 트래픽에 맞게 조절하는 관리자.
+    - 최근 active_window_s 안에 요청이 있었던 모델은 active_keep_alive로 길게 유지합니다.
+    - /populate_note 등 버스트가 시작되면 관련 모델을 미리 적재(pre-warm)합니다.
+    - release_after_s 동안 요청이 없는 모델은 keep_alive=0으로 내려 GPU를 비웁니다.
+    - 응답의 load_duration/prompt_eval_duration으로 모델별 TTFT와 콜드 로드 비용을 기록합니다.
+    """
+
+    COLD_LOAD_THRESHOLD_S = 1.0
+
+    def __init__(self, models: List[str], embedding_models: List[str] = None,
+                 active_keep_alive: str = "30m", idle_keep_alive: str = "5m",
+                 active_window_s: float = 600.0, release_after_s: float = 1800.0):
+        self.embedding_models = set(embedding_models or [])
+        self.active_keep_alive = active_keep_alive
+        self.idle_keep_alive = idle_keep_alive
+        self.active_window_s = active_window_s
+        self.release_after_s = release_after_s
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ModelStats] = {model: ModelStats() for model in list(models) + list(self.embedding_models)}
+        self._warming: set = set()
+        self._prewarm_tasks: set = set()
+
+    @classmethod
+    def from_env(cls) -> "ModelResidencyManager":
+        models = os.getenv("RESIDENCY_MODELS", "biollama3,mixtral,llama3:70b")
+        embedding_model = os.getenv("EMBEDDING_MODEL")
+        return cls(
+            [m.strip() for m in models.split(",") if m.strip()],
+            embedding_models=[embedding_model] if embedding_model else [],
+            active_keep_alive=os.getenv("RESIDENCY_ACTIVE_KEEP_ALIVE", "30m"),
+            idle_keep_alive=os.getenv("RESIDENCY_IDLE_KEEP_ALIVE", "5m"),
+            active_window_s=float(os.getenv("RESIDENCY_ACTIVE_WINDOW_SECONDS", "600")),
+            release_after_s=float(os.getenv("RESIDENCY_RELEASE_AFTER_SECONDS", "1800")),
+        )
+
+    def _get(self, model_name: str) -> ModelStats:
+        if model_name not in self._stats:
+            self._stats[model_name] = ModelStats()
+        return self._stats[model_name]
+
+    def record_request(self, model_name: str):
+        with self._lock:
+            stats = self._get(model_name)
+            stats.requests += 1
+            stats.last_request_at = time.monotonic()
+
+    def keep_alive_for(self, model_name: str) -> str:
+        """최근 트래픽이 있는 모델은 길게, 그렇지 않으면 기본 시간만 상주하도록 keep_alive 값을 정합니다."""
+        with self._lock:
+            stats = self._get(model_name)
+            active = stats.last_request_at and time.monotonic() - stats.last_request_at < self.active_window_s
+            return self.active_keep_alive if active else self.idle_keep_alive
+
+    def record_response(self, model_name: str, response) -> None:
+        """비스트리밍 응답의 load_duration + prompt_eval_duration(ns)을 TTFT로 기록합니다."""
+        load_s = (response.get('load_duration') or 0) / 1e9
+        prompt_eval_s = (response.get('prompt_eval_duration') or 0) / 1e9
+        self.record_ttft(model_name, load_s + prompt_eval_s, load_s)
+
+    def record_ttft(self, model_name: str, ttft_s: float, load_s: float = 0.0):
+        with self._lock:
+            stats = self._get(model_name)
+            stats.ttft_count += 1
+            stats.ttft_total_s += ttft_s
+            stats.last_ttft_s = ttft_s
+            stats.last_warmed_at = time.monotonic()
+            cold = load_s >= self.COLD_LOAD_THRESHOLD_S
+            if cold:
+                stats.cold_loads += 1
+                stats.cold_load_total_s += load_s
+                logger.info(f"[Residency] Cold load of {model_name} took {load_s:.1f}s.")
+        CACHE_REQUESTS.inc(cache="model_residency", result="miss" if cold else "hit")
+
+    def is_warm(self, model_name: str) -> bool:
+        with self._lock:
+            stats = self._get(model_name)
+            last_activity = max(stats.last_request_at, stats.last_warmed_at)
+        if last_activity and time.monotonic() - last_activity < self.active_window_s:
+            return True
+        return any(model_name in host["resident_models"] for host in get_ollama_pool().snapshot() if host["healthy"])
+
+    def note_burst(self, model_names: List[str]):
+        """버스트가 시작될 때 아직 적재되지 않은 모델들을 백그라운드에서 미리 적재합니다."""
+        for model_name in model_names:
+            if not self.is_warm(model_name):
+                # 참조가 없는 태스크는 실행 도중 가비지 컬렉션될 수 있으므로 끝날 때까지 보관합니다.
+                task = asyncio.create_task(self.prewarm(model_name))
+                self._prewarm_tasks.add(task)
+                task.add_done_callback(self._prewarm_tasks.discard)
+
+    async def prewarm(self, model_name: str):
+        with self._lock:
+            if model_name in self._warming:
+                return
+            self._warming.add(model_name)
+        try:
+            logger.info(f"[Residency] Pre-warming {model_name}...")
+            started = time.monotonic()
+            async with ollama_client_for(model_name) as client:
+                if model_name in self.embedding_models:
+                    await client.embed(model=model_name, input="warm up", keep_alive=self.active_keep_alive)
+                else:
+                    # 빈 프롬프트의 generate 요청은 토큰을 생성하지 않고 모델만 적재합니다.
+                    await client.generate(model=model_name, prompt="", keep_alive=self.active_keep_alive)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                stats = self._get(model_name)
+                stats.last_warmed_at = time.monotonic()
+                if elapsed >= self.COLD_LOAD_THRESHOLD_S:
+                    stats.cold_loads += 1
+                    stats.cold_load_total_s += elapsed
+            logger.info(f"[Residency] {model_name} is warm ({elapsed:.1f}s).")
+        except Exception as e:
+            logger.error(f"[Residency] Failed to pre-warm {model_name}: {e}")
+        finally:
+            with self._lock:
+                self._warming.discard(model_name)
+
+    async def release_idle(self):
+        """
+        이 프로세스에서 요청한 적이 있지만 release_after_s 동안 요청이 없는 모델을 적재된 호스트에서 내립니다.
+        한 번도 요청하지 않은 모델은 다른 프로세스(다른 uvicorn 워커, job 워커)가 사용 중일 수 있으므로 내리지 않습니다.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle_models = [
+                model for model, stats in self._stats.items()
+                if stats.last_request_at and now - max(stats.last_request_at, stats.last_warmed_at) >= self.release_after_s
+            ]
+        pool = get_ollama_pool()
+        for host in pool.hosts:
+            for model_name in idle_models:
+                if model_name not in host.resident_models:
+                    continue
+                try:
+                    client = ollama.AsyncClient(host=host.url)
+                    if model_name in self.embedding_models:
+                        await client.embed(model=model_name, input="", keep_alive=0)
+                    else:
+                        await client.generate(model=model_name, prompt="", keep_alive=0)
+                    pool.forget_resident(host, model_name)
+                    with self._lock:
+                        self._get(model_name).released += 1
+                    logger.info(f"[Residency] Released idle model {model_name} from {host.url}.")
+                except Exception as e:
+                    logger.warning(f"[Residency] Failed to release {model_name} from {host.url}: {e}")
+
+    async def run_loop(self, interval: float = 60.0):
+        while True:
+            await asyncio.sleep(interval)
+            await self.release_idle()
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            return {model: stats.snapshot(now) for model, stats in self._stats.items()}
+
+
+_residency_manager: Optional[ModelResidencyManager] = None
+
+def get_residency_manager() -> ModelResidencyManager:
+    global _residency_manager
+    if _residency_manager is None:
+        _residency_manager = ModelResidencyManager.from_env()
+    return _residency_manager
+
+
+# --- 모델별 타임아웃 / 재시도 / 서킷 브레이커 ---
+def parse_model_map(value: str) -> Dict[str, float]:
+    """"llama3:70b=300,biollama3=60" 형식의 모델별 설정을 dict로 변환합니다."""
+    result = {}
+    for item in value.split(","):
+        model, sep, number = item.strip().rpartition("=")
+        if sep and model:
+            result[model.strip()] = float(number)
+    return result
+
+
+class LLMCallPolicy:
+    """모델별 요청 타임아웃과 일시적 오류에 대한 재시도(지수 백오프 + full jitter) 정책."""
+
+    def __init__(self, default_timeout_s: float = 120.0, model_timeouts: Dict[str, float] = None,
+                 max_retries: int = 2, retry_base_delay_s: float = 0.5, retry_max_delay_s: float = 8.0):
+        self.default_timeout_s = default_timeout_s
+        self.model_timeouts = dict(model_timeouts or {})
+        self.max_retries = max_retries
+        self.retry_base_delay_s = retry_base_delay_s
+        self.retry_max_delay_s = retry_max_delay_s
+
+    @classmethod
+    def from_env(cls) -> "LLMCallPolicy":
+        return cls(
+            default_timeout_s=float(os.getenv("LLM_TIMEOUT_SECONDS", "120")),
+            model_timeouts=parse_model_map(os.getenv("LLM_MODEL_TIMEOUTS", "")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+            retry_base_delay_s=float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5")),
+        )
+
+    def timeout_for(self, model_name: str) -> float:
+        return self.model_timeouts.get(model_name, self.default_timeout_s)
+
+    def retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.retry_max_delay_s, self.retry_base_delay_s * (2 ** attempt)))
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """타임아웃, 연결 오류, 서버 측(5xx)/과부하(429) 응답만 재시도 대상으로 봅니다."""
+        if isinstance(error, ollama.ResponseError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, (asyncio.TimeoutError, httpx.TransportError, ConnectionError))
+
+
+class CircuitBreaker:
+    """
+    단일 모델의 서킷 브레이커.
+    closed: 정상 호출 / open: failure_threshold번 연속 실패 후 reset_seconds 동안 호출 차단 /
+    half_open: 차단 시간이 지나면 한 번의 시험 호출만 허용하고, 성공하면 closed로 복귀합니다.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected_calls = 0
+        self.probe_in_flight = False
+        self.last_error: Optional[str] = None
+
+    def is_available(self, now: float) -> bool:
+        if self.state == "open":
+            return now - self.opened_at >= self.reset_seconds
+        if self.state == "half_open":
+            return not self.probe_in_flight
+        return True
+
+    def allow(self, now: float) -> bool:
+        if not self.is_available(now):
+            self.rejected_calls += 1
+            return False
+        if self.state != "closed":
+            self.state = "half_open"
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def record_cancelled(self):
+        """결과 없이 취소된 호출은 성공/실패로 세지 않고 시험 호출 기회만 돌려놓습니다."""
+        self.probe_in_flight = False
+
+    def record_failure(self, error: Exception, now: float):
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = now
+
+    def snapshot(self, now: float) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected_calls": self.rejected_calls,
+            "retry_in_s": round(max(0.0, self.reset_seconds - (now - self.opened_at)), 1) if self.state == "open" else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelCircuitBreakers:
+    """모델 이름별 CircuitBreaker 모음. 요청마다 이벤트 루프가 다르므로 threading.Lock으로 보호합니다."""
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelCircuitBreakers":
+        return cls(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "3")),
+            reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "60")),
+        )
+
+    def _get(self, model_name: str) -> CircuitBreaker:
+        if model_name not in self._breakers:
+            self._breakers[model_name] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return self._breakers[model_name]
+
+    def allow(self, model_name: str) -> bool:
+        with self._lock:
+            return self._get(model_name).allow(time.monotonic())
+
+    def record_success(self, model_name: str):
+        with self._lock:
+            self._get(model_name).record_success()
+
+    def record_cancelled(self, model_name: str):
+        with self._lock:
+            self._get(model_name).record_cancelled()
+
+    def record_failure(self, model_name: str, error: Exception):
+        with self._lock:
+            breaker = self._get(model_name)
+            was_open = breaker.state == "open"
+            breaker.record_failure(error, time.monotonic())
+            if breaker.state == "open" and not was_open:
+                logger.warning(f"Circuit breaker opened for model '{model_name}' after {breaker.consecutive_failures} failures: {error}")
+
+    def is_available(self, model_name: str) -> bool:
+        with self._lock:
+            return self._get(model_name).is_available(time.monotonic())
+
+    def available_models(self, models: List[str]) -> List[str]:
+        """차단되지 않은 모델만 순서를 유지하여 반환합니다."""
+        return [model for model in models if self.is_available(model)]
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            return {model: breaker.snapshot(now) for model, breaker in self._breakers.items()}
+
+
+_call_policy: Optional[LLMCallPolicy] = None
+_circuit_breakers: Optional[ModelCircuitBreakers] = None
+
+def get_call_policy() -> LLMCallPolicy:
+    global _call_policy
+    if _call_policy is None:
+        _call_policy = LLMCallPolicy.from_env()
+    return _call_policy
+
+def get_circuit_breakers() -> ModelCircuitBreakers:
+    global _circuit_breakers
+    if _circuit_breakers is None:
+        _circuit_breakers = ModelCircuitBreakers.from_env()
+    return _circuit_breakers
+
+
+# --- 호출 단위 GPU 사용량 집계 ---
+_usage_scope: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("llm_usage_scope", default=None)
+
+@contextmanager
+def track_llm_usage():
+    """
+    with 블록 안에서 발생한 LLM 호출의 GPU 시간(total_duration)과 토큰 수를 모델별로 집계합니다.
+    asyncio.gather로 생성된 하위 태스크도 같은 집계 dict를 공유합니다.
+    """
+    usage = {"calls": 0, "gpu_seconds": 0.0, "by_model": {}}
+    token = _usage_scope.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage_scope.reset(token)
+
+def _record_usage(model_name: str, response) -> None:
+    LLM_TOKENS.inc(response.get('prompt_eval_count') or 0, model=model_name, kind="prompt")
+    LLM_TOKENS.inc(response.get('eval_count') or 0, model=model_name, kind="completion")
+    usage = _usage_scope.get()
+    if usage is None:
+        return
+    gpu_seconds = (response.get('total_duration') or 0) / 1e9
+    model_usage = usage["by_model"].setdefault(model_name, {"calls": 0, "gpu_seconds": 0.0, "eval_tokens": 0})
+    model_usage["calls"] += 1
+    model_usage["gpu_seconds"] += gpu_seconds
+    model_usage["eval_tokens"] += response.get('eval_count') or 0
+    usage["calls"] += 1
+    usage["gpu_seconds"] += gpu_seconds
+
+
+def get_llm_metrics() -> Dict:
+    """LLM 호출 계층의 운영 지표를 반환합니다."""
+    return {
+        "ollama_hosts": get_ollama_pool().snapshot(),
+        "single_flight": llm_single_flight.snapshot(),
+        "model_residency": get_residency_manager().snapshot(),
+        "circuit_breakers": get_circuit_breakers().snapshot(),
+    }
+
+
 def _post_process_content(content: str) -> str:
     """
     LLM 응답에서 불필요한 접두사, 제목, 마크다운 블록을 제거하는 후처리 함수.
@@ -18,34 +695,245 @@ def _post_process_content(content: str) -> str:
     if content.startswith("```") and "```" in content[3:]:
         content = re.sub(r'^```[a-zA-Z]*\n', '', content)
         content = re.sub(r'\n```$', '', content)
-        
+
     return content.strip()
 
 
+_PREFIX_PATTERN = re.compile(r'^(the\s*answer\s*is:|equipment:|method:)\s*', flags=re.IGNORECASE)
+_OPENING_FENCE_PATTERN = re.compile(r'```[a-zA-Z]*\n')
+_CLOSING_FENCE_PARTIALS = ("\n```", "\n``", "\n`")
+
+
+class StreamingPostProcessor:
+    """
+    _post_process_content를 토큰 스트림에 점진적으로 적용하는 상태 머신.
+    feed()는 지금 내보내도 안전한 텍스트만 돌려주고, 판단이 필요한 앞부분(접두사·여는 코드 블록)과
+    끝부분(공백·닫는 코드 블록 후보)은 잡아 두었다가 finish()에서 정리합니다.
+
+    상태: head(접두사 판별) → fence(여는 코드 블록 판별) → body
+    비스트리밍 후처리와 달리, 여는 코드 블록은 닫는 블록이 도착하기 전에 제거합니다.
+    """
+    HEAD_CHARS = 32
+
+    def __init__(self):
+        self.state = "head"
+        self.fenced = False
+        self._buffer = ""
+        self._strip_leading = True
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if self.state == "head":
+            head = self._buffer.lstrip()
+            if len(head) < self.HEAD_CHARS:
+                self._buffer = head
+                return ""
+            self._buffer = self._strip_prefix(head)
+            self.state = "fence"
+        if self.state == "fence" and not self._resolve_fence(final=False):
+            return ""
+        return self._drain_body()
+
+    def finish(self) -> str:
+        if self.state == "head":
+            self._buffer = self._strip_prefix(self._buffer.lstrip())
+            self.state = "fence"
+        if self.state == "fence":
+            self._resolve_fence(final=True)
+        tail = self._buffer.lstrip() if self._strip_leading else self._buffer
+        tail = tail.rstrip()
+        if self.fenced and tail.endswith("\n```"):
+            tail = tail[:-4].rstrip()
+        self._buffer = ""
+        return tail
+
+    @staticmethod
+    def _strip_prefix(text: str) -> str:
+        match = _PREFIX_PATTERN.match(text)
+        return text[match.end():].lstrip() if match else text
+
+    def _resolve_fence(self, final: bool) -> bool:
+        """여는 코드 블록 여부가 결정되면 body 상태로 넘어가고 True를 반환합니다."""
+        text = self._buffer
+        if not text.startswith("```"):
+            if not final and "```".startswith(text):
+                return False
+            self.state = "body"
+            return True
+        match = _OPENING_FENCE_PATTERN.match(text)
+        if match:
+            self.fenced = True
+            self._buffer = text[match.end():]
+        elif not final and re.fullmatch(r'```[a-zA-Z]*', text):
+            return False
+        self.state = "body"
+        return True
+
+    def _drain_body(self) -> str:
+        text = self._buffer
+        if self._strip_leading:
+            text = text.lstrip()
+            self._strip_leading = not text
+        # 뒤쪽 공백과 (코드 블록 안이라면) 닫는 펜스 후보는 다음 청크가 올 때까지 보류합니다.
+        emit = text.rstrip()
+        if self.fenced:
+            for partial in _CLOSING_FENCE_PARTIALS:
+                if emit.endswith(partial):
+                    emit = emit[:-len(partial)]
+                    break
+        self._buffer = text[len(emit):]
+        return emit
+
+
 async def call_llm_api(system_prompt: str, user_prompt: str, model_name: str = None):
-    """LLM API를 호출하는 범용 비동기 함수."""
+    """LLM API를 호출하는 범용 비동기 함수. 동시에 들어온 동일한 호출은 하나로 병합됩니다."""
     if model_name is None:
         model_name = os.getenv("LLM_MODEL", "biollama3")
 
+    options = {'temperature': 0.1, 'top_p': 0.8}
+    key = SingleFlight.make_key(model_name, system_prompt, user_prompt, options)
+    return await llm_single_flight.do(
+        key, lambda: _call_llm_api_uncoalesced(system_prompt, user_prompt, model_name, options)
+    )
+
+
+async def _call_llm_api_uncoalesced(system_prompt: str, user_prompt: str, model_name: str, options: Dict) -> str:
+    breakers = get_circuit_breakers()
+    if not breakers.allow(model_name):
+        logger.warning(f"Skipping LLM call: circuit breaker is open for model '{model_name}'.")
+        return f"(LLM Error: Could not generate content due to: circuit breaker open for model '{model_name}')"
+
     logger.info(f"Calling LLM: {model_name} for a specific task.")
+    policy = get_call_policy()
+    residency = get_residency_manager()
+    attempt = 0
+    while True:
+        # 직전 요청 이후 경과 시간으로 keep_alive를 정한 뒤 이번 요청을 트래픽으로 기록합니다.
+        keep_alive = residency.keep_alive_for(model_name)
+        residency.record_request(model_name)
+        started = time.perf_counter()
+        try:
+            async with ollama_client_for(model_name) as client:
+                response = await asyncio.wait_for(
+                    client.chat(
+                        model=model_name,
+                        messages=[
+                            {'role': 'system', 'content': system_prompt},
+                            {'role': 'user', 'content': user_prompt}
+                        ],
+                        options=options,
+                        keep_alive=keep_alive
+                    ),
+                    timeout=policy.timeout_for(model_name),
+                )
+        except Exception as e:
+            LLM_CALL_DURATION.observe(time.perf_counter() - started, model=model_name, outcome="error")
+            if policy.is_transient(e) and attempt < policy.max_retries:
+                delay = policy.retry_delay(attempt)
+                attempt += 1
+                logger.warning(f"Transient LLM error from {model_name} ({type(e).__name__}: {e}). Retry {attempt}/{policy.max_retries} in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+                continue
+            breakers.record_failure(model_name, e)
+            logger.error(f"LLM API call failed: {e!r}", exc_info=True)
+            return f"(LLM Error: Could not generate content due to: {str(e) or type(e).__name__})"
+        except BaseException:
+            breakers.record_cancelled(model_name)
+            raise
+        break
+
+    LLM_CALL_DURATION.observe(time.perf_counter() - started, model=model_name, outcome="ok")
+    breakers.record_success(model_name)
+    residency.record_response(model_name, response)
+    _record_usage(model_name, response)
+    content = response['message']['content'].strip()
+
+    # 후처리 함수 호출
+    processed_content = _post_process_content(content)
+    return processed_content
+
+
+class CircuitOpenError(Exception):
+    """서킷 브레이커가 열려 있어 호출하지 않은 모델."""
+
+    def __init__(self, model_name: str):
+        super().__init__(f"circuit breaker open for model '{model_name}'")
+        self.model_name = model_name
+
+
+async def stream_chat(messages: List[Dict[str, str]], model_name: str, options: Dict,
+                      processor: Optional[StreamingPostProcessor] = None, max_chars: Optional[int] = None):
+    """
+    Ollama chat(stream=True)의 텍스트 조각을 생성되는 대로 yield하는 스트리밍 기본 함수.
+    processor가 주어지면 후처리를 점진적으로 적용하고, max_chars를 넘기면 생성을 조기 종료합니다.
+    소비자가 반복을 중단하거나 태스크가 취소되면 업스트림 스트림을 닫아 Ollama의 생성도 함께 중단됩니다.
+    실패 시 예외를 그대로 전파합니다 (서킷 브레이커가 열려 있으면 CircuitOpenError).
+    """
+    breakers = get_circuit_breakers()
+    if not breakers.allow(model_name):
+        raise CircuitOpenError(model_name)
+
+    logger.info(f"Streaming LLM: {model_name}.")
+    residency = get_residency_manager()
+    keep_alive = residency.keep_alive_for(model_name)
+    residency.record_request(model_name)
+    emitted = 0
+    started = time.perf_counter()
     try:
-        ollama_base_url = os.getenv("OLLAMA_BASE_URL")
-        client = ollama.AsyncClient(host=ollama_base_url)
-
-        response = await client.chat(
-            model=model_name,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            options={'temperature': 0.1, 'top_p': 0.8}
-        )
-        content = response['message']['content'].strip()
-        
-        # 후처리 함수 호출
-        processed_content = _post_process_content(content)
-        return processed_content
+        async with ollama_client_for(model_name) as client:
+            stream = await client.chat(model=model_name, messages=messages, options=options,
+                                       keep_alive=keep_alive, stream=True)
+            try:
+                async for part in stream:
+                    if part.get('done'):
+                        residency.record_response(model_name, part)
+                        _record_usage(model_name, part)
+                    text = part['message']['content']
+                    if processor is not None:
+                        text = processor.feed(text)
+                    if text:
+                        emitted += len(text)
+                        yield text
+                    if max_chars is not None and emitted >= max_chars:
+                        logger.info(f"Stopping {model_name} stream early after {emitted} chars (budget {max_chars}).")
+                        break
+            finally:
+                # 조기 종료·취소 시 HTTP 스트림을 닫아 서버 측 생성을 중단시킵니다.
+                await stream.aclose()
+    except Exception as e:
+        LLM_CALL_DURATION.observe(time.perf_counter() - started, model=model_name, outcome="error")
+        breakers.record_failure(model_name, e)
+        logger.error(f"LLM streaming call failed: {e}", exc_info=True)
+        raise
+    except BaseException:
+        LLM_CALL_DURATION.observe(time.perf_counter() - started, model=model_name, outcome="cancelled")
+        breakers.record_cancelled(model_name)
+        raise
+
+    LLM_CALL_DURATION.observe(time.perf_counter() - started, model=model_name, outcome="ok")
+    breakers.record_success(model_name)
+    if processor is not None:
+        tail = processor.finish()
+        if tail:
+            yield tail
+
 
+async def stream_llm_api(system_prompt: str, user_prompt: str, model_name: str = None,
+                         max_chars: Optional[int] = None):
+    """
+    call_llm_api의 스트리밍 버전. 후처리가 적용된 텍스트 조각을 생성되는 대로 yield합니다.
+    call_llm_api와 마찬가지로 실패하면 "(LLM Error: ...)" 문자열을 yield합니다.
+    """
+    if model_name is None:
+        model_name = os.getenv("LLM_MODEL", "biollama3")
+
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    try:
+        async for text in stream_chat(messages, model_name, {'temperature': 0.1, 'top_p': 0.8},
+                                      processor=StreamingPostProcessor(), max_chars=max_chars):
+            yield text
     except Exception as e:
-        logger.error(f"LLM API call failed: {e}", exc_info=True)
-        return f"(LLM Error: Could not generate content due to: {e})"
\ No newline at end of file
+        yield f"(LLM Error: Could not generate content due to: {e})"
@@ -3,29 +3,40 @@
 import os
 import logging
 import datetime
+import time
 import uuid
 import re
 import asyncio
 import json
+import hashlib
 import redis.asyncio as redis
-import sqlite3, datetime
-import ollama
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pathlib import Path
 from rapidfuzz import fuzz
-import git
 from fastapi.middleware.cors import CORSMiddleware 
 
 # Local imports
 import rag_pipeline as rag_module
-from agents import run_agent_team
-from llm_utils import call_llm_api
+import conversation_store as conversation_module
+import dpo_spool as dpo_module
+import feedback_db as feedback_db_module
+import job_queue as job_queue_module
+import catalog_embeddings as catalog_embeddings_module
+from admission import AdmissionRejected, get_admission_controller
+from catalog_search import CatalogSearchIndex
+from document_cache import DocumentNotCached, ParsedDocument, get_document_cache
+from draft_store import get_draft_store
+from chat_context import get_context_window_manager
+from agents import run_agent_team, get_cascade_policy, get_cascade_metrics, select_judge_model
+from metrics import REGISTRY, InstrumentedRoute, CACHE_REQUESTS, ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED
+from llm_utils import call_llm_api, stream_chat, ollama_client_for, get_ollama_pool, get_residency_manager, get_llm_metrics
 
 # embedding
 from rag_pipeline import get_embeddings
@@ -205,26 +216,13 @@ def _precompute_data():
 
 ALL_UOS_DATA, ALL_WORKFLOWS_DATA = _precompute_data()
 
-# --- Redis 연결 관리 (RAG 파이프라인 전용) ---
-redis_pool = None
+# 카탈로그는 프로세스 수명 동안 바뀌지 않으므로 /constants 응답 바이트와 ETag, 검색 인덱스를 한 번만 만듭니다.
+CONSTANTS_BODY = json.dumps({"ALL_WORKFLOWS": ALL_WORKFLOWS_DATA, "ALL_UOS": ALL_UOS_DATA}, ensure_ascii=False).encode("utf-8")
+CONSTANTS_ETAG = f'"{hashlib.sha256(CONSTANTS_BODY).hexdigest()[:32]}"'
+CATALOG_INDEX = CatalogSearchIndex({"workflow": ALL_WORKFLOWS_DATA, "unit_operation": ALL_UOS_DATA})
 
-async def keep_gpu_warm():
-    """5분(300초)마다 임베딩 연산을 수행하여 GPU를 활성 상태로 유지합니다."""
-    while True:
-        # ⭐️ 개선점: 가장 크고 중요한 llama3:70b 모델을 메모리에 유지하도록 변경합니다.
-        # 이렇게 하면 모델을 계속해서 로드/언로드하는 것을 방지할 수 있습니다.
-        try:
-            logger.info("[Keep-Alive] Running scheduled GPU health check...")
-            await ollama.AsyncClient().chat(
-                model='llama3:70b',
-                messages=[{'role': 'user', 'content': 'Health check. Respond with "OK".'}],
-                options={'num_predict': 1} # 최소한의 작업만 수행
-            )
-            logger.info("[Keep-Alive] Successfully kept llama3:70b model warm.")
-        except Exception as e:
-            logger.error(f"[Keep-Alive] Error during GPU health check: {e}", exc_info=True)
-        
-        await asyncio.sleep(300)
+# --- Redis 연결 관리 (RAG 파이프라인, /chat 대화 기록) ---
+redis_pool = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -239,9 +237,47 @@ async def lifespan(app: FastAPI):
     rag_module.rag_pipeline = rag_module.RAGPipeline()
     
     redis_pool = redis.ConnectionPool.from_url(redis_url, decode_responses=True)
-    logger.info("Starting background task to keep GPU warm...")
-    asyncio.create_task(keep_gpu_warm())
+    conversation_module.conversation_store = conversation_module.ConversationStore.from_env(redis_pool)
+    job_queue_module.job_queue = job_queue_module.JobQueue.from_env(redis_pool)
+    logger.info("Building catalog embedding index in the background...")
+    catalog_embedding_task = asyncio.create_task(asyncio.to_thread(
+        catalog_embeddings_module.init_catalog_embedding_index,
+        rag_module.get_embeddings(), {"unit_operation": ALL_UOS_DATA, "workflow": ALL_WORKFLOWS_DATA},
+    ))
+    logger.info("Initializing feedback metrics database...")
+    feedback_db_module.get_feedback_db()
+    REGISTRY.configure(os.getenv("METRICS_MULTIPROC_DIR"))
+    metrics_flush_task = asyncio.create_task(REGISTRY.run_flush_loop(float(os.getenv("METRICS_FLUSH_SECONDS", "5"))))
+    logger.info("Starting background task to manage model residency...")
+    residency_task = asyncio.create_task(
+        get_residency_manager().run_loop(float(os.getenv("RESIDENCY_CHECK_INTERVAL_SECONDS", "60")))
+    )
+    logger.info("Starting background task to track Ollama host residency...")
+    pool_refresh_task = asyncio.create_task(
+        get_ollama_pool().run_refresh_loop(float(os.getenv("OLLAMA_POOL_REFRESH_SECONDS", "15")))
+    )
+    dpo_commit_task = None
+    repo_url, token = os.getenv("DPO_TRAINER_REPO_URL"), os.getenv("GIT_AUTH_TOKEN")
+    if repo_url and token:
+        logger.info("Starting background DPO batch committer...")
+        local_path_str = os.getenv("DPO_REPO_LOCAL_PATH", "./labnote-dpo-trainer-data")
+        write_mode = os.getenv("DPO_WRITE_MODE", "files")
+        dpo_module.dpo_committer = dpo_module.DPOBatchCommitter(
+            dpo_module.get_dpo_spool(),
+            lambda records: dpo_module.push_preferences_to_git(token, repo_url, local_path_str, records, write_mode),
+            max_batch_size=int(os.getenv("DPO_COMMIT_MAX_BATCH", "50")),
+            max_delay_s=float(os.getenv("DPO_COMMIT_MAX_DELAY_SECONDS", "30")),
+        )
+        dpo_commit_task = asyncio.create_task(dpo_module.dpo_committer.run_loop())
     yield
+    # 스풀에 남은 레코드는 디스크에 보존되며 다음 시작 시 커밋됩니다.
+    if dpo_commit_task:
+        dpo_commit_task.cancel()
+    catalog_embedding_task.cancel()
+    pool_refresh_task.cancel()
+    residency_task.cancel()
+    metrics_flush_task.cancel()
+    feedback_db_module.close_feedback_db()
     logger.info("Closing Redis connection pool.")
     await redis_pool.disconnect()
 
@@ -252,6 +288,8 @@ app = FastAPI(
     description="Interactive lab note generation with user-edit DPO feedback loop and consent management.",
     lifespan=lifespan
 )
+# 이후 등록되는 모든 라우트의 지연 시간과 처리 중인 요청 수를 /metrics로 내보냅니다.
+app.router.route_class = InstrumentedRoute
 
 # 출처 허용
 app.add_middleware(
@@ -262,32 +300,73 @@ app.add_middleware(
     allow_headers=["*"],  # 모든 HTTP 헤더 허용
 )
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """대기열이 지연 예산을 넘으면 큐에 쌓지 않고 바로 429와 재시도 시점을 돌려줍니다."""
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after_s)},
+        content={
+            "detail": f"Server is busy. Please retry in {exc.retry_after_s}s.",
+            "endpoint": exc.endpoint,
+            "estimated_wait_s": round(exc.estimated_wait_s, 1),
+            "queue_depth": exc.queue_depth,
+        },
+    )
+
+@app.exception_handler(DocumentNotCached)
+async def document_not_cached_handler(request: Request, exc: DocumentNotCached):
+    """해시만 보낸 문서가 이 프로세스의 캐시에 없으면(만료·재시작·다른 워커) 전체 내용을 다시 보내도록 409를 돌려줍니다."""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc), "error": "document_not_cached", "content_hash": exc.document_hash},
+    )
+
 # --- 템플릿 설정 ---
-templates_dir = Path(__file__).parent / "templates"
+# dashboard.html은 저장소 루트에 있습니다 (templates/ 디렉터리는 없음).
+templates_dir = Path(__file__).parent
 templates = Jinja2Templates(directory=str(templates_dir))
 
+# /chat 대화의 시스템 프롬프트 (대화 기록에는 저장하지 않고 호출 시 맨 앞에 붙입니다)
+CHAT_SYSTEM_PROMPT = "You are a highly capable AI assistant. Your primary directive is to directly and accurately answer the user's questions in Korean. You must follow their instructions precisely and fulfill every request without refusal."
+
 # --- Pydantic 모델 정의 ---
-conversation_histories: Dict[str, List[Dict[str, str]]] = {}
 
 class CreateScaffoldRequest(BaseModel):
     query: str
     workflow_id: str
-    unit_operation_ids: List[str]
+    # 비워 두면 실험 목표(query)와 워크플로로 추천한 상위 recommend_top_k개의 UO를 사용합니다.
+    unit_operation_ids: List[str] = []
+    recommend_top_k: int = 5
     experimenter: Optional[str] = "AI Assistant"
 
+class RecommendUnitOperationsRequest(BaseModel):
+    query: str
+    workflow_id: Optional[str] = None
+    limit: int = 10
+
 class LabNoteResponse(BaseModel):
     files: Dict[str, str]
 
 class PopulateNoteRequest(BaseModel):
-    file_content: str
+    # 전체 내용(file_content) 대신 content_hash(UTF-8 SHA-256)만, 또는 content_hash + 바뀐 UO 블록(uo_block)만 보낼 수 있습니다.
+    file_content: Optional[str] = None
+    content_hash: Optional[str] = None
+    uo_block: Optional[str] = None
     uo_id: str
     section: str
     query: str
+    # 사전 생성 초안 조회용. 비워 두면 워크플로 파일의 제목에서 찾습니다.
+    workflow_id: Optional[str] = None
+    # 사전 생성 초안은 사용자 목표(query)가 아니라 워크플로 설명으로 만든 것이므로, 클라이언트가 명시적으로 요청할 때만 돌려줍니다.
+    use_pregenerated: bool = False
 
 class PopulateNoteResponse(BaseModel):
     uo_id: str
     section: str
     options: List[str]
+    # True이면 scripts/pregenerate_drafts.py가 미리 만든 초안입니다 (use_pregenerated 없이 다시 요청하면 query에 맞춰 새로 생성).
+    pregenerated: bool = False
 
 class GitFeedbackRequest(BaseModel):
     prompt: str
@@ -302,7 +381,9 @@ class PreferenceRequest(BaseModel):
     chosen_edited: str
     rejected: List[str]
     query: str
-    file_content: str
+    file_content: Optional[str] = None
+    content_hash: Optional[str] = None
+    uo_block: Optional[str] = None
     file_path: str
     supervisor_evaluations: List[Dict]
 
@@ -358,30 +439,59 @@ def _extract_section_content(uo_block: str, section_name: str) -> str:
         return content if content and not content.startswith('(') else "(not specified)"
     return "(not specified)"
 
-def _init_feedback_db():
+def _resolve_uo_block(request, response: Optional[Response] = None) -> Tuple[Optional[str], Optional[ParsedDocument]]:
+    """요청의 file_content 또는 content_hash(+uo_block)로 UO 블록을 찾습니다. 현재 문서 해시는 X-Content-Hash 헤더로 돌려줍니다."""
+    try:
+        uo_block, document = get_document_cache().resolve(
+            request.uo_id, request.file_content, request.content_hash, request.uo_block)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if response is not None and document is not None:
+        response.headers["X-Content-Hash"] = document.hash
+    return uo_block, document
+
+def _is_placeholder_section(uo_block: str, section_name: str) -> bool:
+    content = _extract_section_content(uo_block, section_name)
+    return content == "(not specified)" or content.lstrip("- ").startswith("(")
+
+async def _find_pregenerated_draft(request: PopulateNoteRequest, uo_block: str, document: Optional[ParsedDocument]) -> Optional[Dict]:
     """
-    피드백 지표를 저장하기 위한 SQLite 데이터베이스와 테이블을 초기화합니다.
-    이 함수는 서버 시작 시 또는 첫 피드백 기록 시 호출될 수 있습니다.
+    현재 SOP 인덱스 버전으로 미리 생성된 (워크플로, UO, 섹션) 초안을 찾습니다.
+    사전 생성은 Input/Output이 비어 있는 템플릿 블록을 기준으로 했으므로, 사용자가 이 섹션들을 채운 블록에는 쓰지 않습니다.
     """
-    db_path = os.getenv("EVALUATION_DB_PATH", "scripts/evaluation_results.db")
-    # scripts 디렉토리가 없으면 생성
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS feedback_metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                uo_id TEXT NOT NULL,
-                section TEXT NOT NULL,
-                edit_distance_ratio REAL NOT NULL
-            )
-        """)
-        logger.info(f"Feedback metrics table initialized in '{db_path}'")
-
+    workflow_id = request.workflow_id or (document.workflow_id if document is not None else None)
+    if not request.use_pregenerated or not workflow_id:
+        return None
+    if not all(_is_placeholder_section(uo_block, section) for section in ("Input", "Output")):
+        return None
+    try:
+        sop_version = rag_module.get_sop_index_version()
+    except RuntimeError:
+        return None
+    draft = await asyncio.to_thread(get_draft_store().get, sop_version, workflow_id, request.uo_id, request.section)
+    CACHE_REQUESTS.inc(cache="pregenerated_draft", result="miss" if draft is None else "hit")
+    return draft
 
 # --- API 엔드포인트 ---
 
+async def _recommend_unit_operations(query: str, workflow_id: Optional[str], limit: int) -> Dict[str, List[Dict]]:
+    try:
+        index = catalog_embeddings_module.get_catalog_embedding_index()
+    except RuntimeError:
+        raise HTTPException(status_code=503, detail="Unit operation recommendation is not available yet.")
+    if workflow_id and workflow_id not in ALL_WORKFLOWS_DATA:
+        raise HTTPException(status_code=404, detail=f"Workflow '{workflow_id}' not found.")
+    return await index.arecommend(query, workflow_id, max(1, min(limit, 50)))
+
+@app.post("/recommend_unit_operations", summary="Recommend Unit Operations for an Experiment Goal")
+async def recommend_unit_operations(request: RecommendUnitOperationsRequest):
+    """
+    실험 목표와 카탈로그 임베딩의 코사인 유사도로 UO를 추천합니다 (LLM 호출 없음, 질의 임베딩 1회).
+    workflow_id를 주면 해당 워크플로와의 유사도를 함께 반영해 재순위하고, 목표와 가까운 워크플로 상위 3개도 함께 반환합니다.
+    """
+    return {"query": request.query, "workflow_id": request.workflow_id,
+            **await _recommend_unit_operations(request.query, request.workflow_id, request.limit)}
+
 @app.post("/create_scaffold", response_model=LabNoteResponse)
 async def create_scaffold(request: CreateScaffoldRequest):
     logger.info(f"Corrected multi-file scaffold generation for WF: {request.workflow_id}")
@@ -396,8 +506,14 @@ async def create_scaffold(request: CreateScaffoldRequest):
         
         workflow_file_name = f"001_{wf_id}_{wf_name.replace(' ', '_')}.md"
 
+        unit_operation_ids = request.unit_operation_ids
+        if not unit_operation_ids:
+            recommendations = await _recommend_unit_operations(request.query, wf_id, request.recommend_top_k)
+            unit_operation_ids = [item["id"] for item in recommendations["unit_operations"]]
+            logger.info(f"Using recommended unit operations for {wf_id}: {unit_operation_ids}")
+
         unit_operation_blocks = []
-        for uo_id in request.unit_operation_ids:
+        for uo_id in unit_operation_ids:
             uo_name = ALL_UOS_DATA.get(uo_id, "Unknown Operation")
             unit_operation_blocks.append(create_unit_operation_template(uo_id, uo_name, experimenter))
         
@@ -445,106 +561,108 @@ experiment_type: labnote
 
         return LabNoteResponse(files=files_to_create)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during multi-file scaffold creation: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error creating scaffold: {e}")
 
 @app.post("/populate_note", response_model=PopulateNoteResponse)
-async def populate_note(request: PopulateNoteRequest):
+async def populate_note(request: PopulateNoteRequest, response: Response):
     logger.info(f"Phase 2: Populating section '{request.section}' for UO '{request.uo_id}'")
-    try:
-        pattern = re.compile(
-            r"(### \\?\[" + re.escape(request.uo_id) + r".*?\\?\]\n.*?)(?=### \\?\[U[A-Z]{2,3}\d{3}|\Z)",
-            re.DOTALL
-        )
-        match = pattern.search(request.file_content)
-        if not match:
-            logger.error(f"Could not find UO block for ID '{request.uo_id}'. Searched content snippet: \n---\n{request.file_content[:500]}\n---")
-            raise HTTPException(status_code=404, detail=f"Unit Operation block for ID '{request.uo_id}' not found.")
-        
-        uo_block = match.group(1)
-        agent_result = await asyncio.to_thread(run_agent_team, request.query, uo_block, request.section)
+    uo_block, document = _resolve_uo_block(request, response)
+    if uo_block is None:
+        logger.error(f"Could not find UO block for ID '{request.uo_id}'. Searched content snippet: \n---\n{(request.file_content or request.uo_block or '')[:500]}\n---")
+        raise HTTPException(status_code=404, detail=f"Unit Operation block for ID '{request.uo_id}' not found.")
+    draft = await _find_pregenerated_draft(request, uo_block, document)
+    if draft is not None:
+        logger.info(f"Serving pre-generated draft for '{request.uo_id}/{request.section}'.")
+        return PopulateNoteResponse(uo_id=request.uo_id, section=request.section, options=draft["options"], pregenerated=True)
+    async with get_admission_controller().admit("populate_note"):
+        try:
+            # populate 버스트가 시작되면 캐스케이드 첫 단계 모델과 채점 모델을 미리 적재합니다.
+            get_residency_manager().note_burst(get_cascade_policy(request.section)["tiers"][0] + [select_judge_model()])
+            agent_result = await asyncio.to_thread(run_agent_team, request.query, uo_block, request.section)
         
-        if not agent_result or not agent_result.get("options"):
-            raise HTTPException(status_code=500, detail="Agent team failed to generate options.")
+            if not agent_result or not agent_result.get("options"):
+                raise HTTPException(status_code=500, detail="Agent team failed to generate options.")
         
-        return PopulateNoteResponse(**agent_result)
-    except Exception as e:
-        logger.error(f"Error populating note: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error populating note: {e}")
+            return PopulateNoteResponse(**agent_result)
+        except Exception as e:
+            logger.error(f"Error populating note: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Error populating note: {e}")
 
-# Git 작업을 처리할 새로운 동기 함수
-def _run_git_operations(token: str, repo_url: str, local_path_str: str, preference_data: dict, commit_message: str):
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    created: bool
+
+@app.post("/jobs/populate_note", status_code=202, response_model=JobSubmitResponse)
+async def submit_populate_note_job(request: PopulateNoteRequest, idempotency_key: Optional[str] = Header(None)):
     """
-    Git 작업을 안정적으로 처리하는 동기 헬퍼 함수
-    (원격 저장소 기준으로 로컬을 초기화하여 충돌을 방지)
+    /populate_note를 비동기 작업으로 제출합니다. 에이전트 팀은 별도의 워커 프로세스(worker.py)에서 실행되며,
+    GET /jobs/{job_id} 또는 GET /jobs/{job_id}/events(SSE)로 상태와 결과를 확인합니다.
+    같은 Idempotency-Key 헤더로 다시 제출하면 기존 작업을 돌려줍니다.
     """
-    local_path = Path(local_path_str)
-    repo_url_with_token = repo_url.replace("https://", f"https://oauth2:{token}@")
-
-    # 1. 저장소 클론 또는 열기
-    if local_path.exists():
-        repo = git.Repo(local_path)
-    else:
-        logger.info(f"Cloning DPO repository to {local_path}...")
-        repo = git.Repo.clone_from(repo_url_with_token, local_path)
-
-    origin = repo.remote(name='origin')
-    origin.set_url(repo_url_with_token)
-    
-    # 2. Rebase 등 비정상 상태일 경우 초기화
-    if repo.is_dirty() or "rebase" in repo.git.status():
-        logger.warning("Repository is in a dirty or rebase state. Resetting to origin/main...")
-        repo.git.rebase('--abort') # 진행중인 rebase 중단
-        repo.git.reset('--hard', 'origin/main')
-        
-    # 3. 원격 저장소의 최신 변경 사항을 가져옴
-    logger.info("Fetching latest changes from DPO repository...")
-    origin.fetch()
-
-    # 4. 로컬 main 브랜치를 원격 main 브랜치와 강제로 동기화
-    logger.info("Resetting local branch to match the remote branch...")
-    repo.git.reset('--hard', 'origin/main') # 또는 origin/master
-
-    # 5. 새로운 DPO 데이터 파일 생성
-    data_dir = local_path / "data"
-    data_dir.mkdir(exist_ok=True)
-    file_name = f"{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}.json"
-    file_path = data_dir / file_name
-    
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(preference_data, f, ensure_ascii=False, indent=2)
-    logger.info(f"DPO data saved to {file_path}")
-
-    # 6. 변경사항 커밋 및 푸시
-    repo.index.add([str(file_path.resolve())])
-    repo.index.commit(commit_message)
-    
-    logger.info("Pushing DPO data to remote repository...")
-    origin.push()
-    logger.info("Successfully pushed DPO data to Git.")
+    uo_block, _ = _resolve_uo_block(request)
+    if uo_block is None:
+        raise HTTPException(status_code=404, detail=f"Unit Operation block for ID '{request.uo_id}' not found.")
+    # 워커에는 전체 문서 대신 찾은 UO 블록만 넘깁니다 (워커의 find_uo_block은 블록 자체에서도 같은 결과를 냅니다).
+    payload = {"file_content": uo_block, "uo_id": request.uo_id, "section": request.section, "query": request.query}
+    queue = job_queue_module.get_job_queue()
+    job_id, created = await queue.submit("populate_note", payload, idempotency_key)
+    job = await queue.get(job_id)
+    return JobSubmitResponse(job_id=job_id, status=job["status"] if job else "queued", created=created)
+
+@app.get("/jobs/{job_id}", summary="Get Job Status and Result")
+async def get_job(job_id: str):
+    job = await job_queue_module.get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired.")
+    return job
+
+@app.get("/jobs/{job_id}/events", summary="Stream Job Status Changes (SSE)")
+async def stream_job_events(job_id: str, http_request: Request):
+    """작업 상태가 바뀔 때마다 `event: status`를 보내고, 작업이 끝나면 스트림을 닫습니다."""
+    queue = job_queue_module.get_job_queue()
+    if await queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired.")
+
+    async def event_stream():
+        async for job in queue.events(job_id):
+            if await http_request.is_disconnected():
+                return
+            yield _sse_event(job, event="status")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.delete("/jobs/{job_id}", summary="Cancel Job")
+async def cancel_job(job_id: str):
+    status = await job_queue_module.get_job_queue().cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired.")
+    return {"job_id": job_id, "status": status}
 
+# Git 작업을 처리할 새로운 동기 함수
 @app.post("/record_preference", status_code=204)
 async def record_preference(request: PreferenceRequest):
-    logger.info(f"Recording DPO data for UO '{request.uo_id}' to Git repository.")
+    logger.info(f"Recording DPO data for UO '{request.uo_id}' to the DPO spool.")
 
     repo_url = os.getenv("DPO_TRAINER_REPO_URL")
     token = os.getenv("GIT_AUTH_TOKEN")
-    local_path_str = os.getenv("DPO_REPO_LOCAL_PATH", "./labnote-dpo-trainer-data")
-    
-    # 디버깅 로그 추가
-    logger.info(f"DEBUG: Attempting to use GIT_AUTH_TOKEN: '{token[:4]}...{token[-4:] if token else 'None'}'")
 
     if not repo_url or not token:
         logger.error("Git repository URL or auth token is not configured in .env file.")
         raise HTTPException(status_code=500, detail="DPO Git repository is not configured on the server.")
 
+    uo_block_content = _resolve_uo_block(request)[0] or ""
     try:
         # preference_data 생성 로직 (기존과 동일)
         uo_name = ALL_UOS_DATA.get(request.uo_id, "Unknown Operation")
-        uo_block_pattern = re.compile(r"(### \\?\[" + re.escape(request.uo_id) + r".*?\\?\]\n.*?)(?=### \\?\[U[A-Z]{2,3}\d{3}|\Z)", re.DOTALL)
-        uo_match = uo_block_pattern.search(request.file_content)
-        uo_block_content = uo_match.group(1) if uo_match else ""
         input_context = _extract_section_content(uo_block_content, "Input")
         output_context = _extract_section_content(uo_block_content, "Output")
         
@@ -575,41 +693,32 @@ async def record_preference(request: PreferenceRequest):
             }
         }
 
-        # DB 저장 로직 (기존과 동일)
+        # DB 저장 로직 (writer 스레드가 다른 요청의 쓰기와 묶어 커밋)
         try:
-            _init_feedback_db()
-            db_path = os.getenv("EVALUATION_DB_PATH", "scripts/evaluation_results.db")
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
-                    (preference_data["metadata"]["timestamp_utc"], request.uo_id, request.section, edit_distance_ratio)
-                )
+            await feedback_db_module.get_feedback_db().write(
+                "INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+                (preference_data["metadata"]["timestamp_utc"], request.uo_id, request.section, edit_distance_ratio)
+            )
             logger.info(f"Saved edit_distance_ratio ({edit_distance_ratio:.2f}) to DB for {request.uo_id}/{request.section}")
         except Exception as db_error:
             logger.error(f"Failed to save feedback metric to DB: {db_error}", exc_info=True)
 
-        commit_message = f"feat: Add DPO data for {request.uo_id}/{request.section}"
-        
-        # 수정: asyncio.to_thread를 사용하여 동기 함수를 별도 스레드에서 실행
-        await asyncio.to_thread(
-            _run_git_operations,
-            token,
-            repo_url,
-            local_path_str,
-            preference_data,
-            commit_message
-        )
+        # 로컬 스풀에 fsync까지 마치면 바로 응답합니다. Git 커밋/푸시는 백그라운드 커미터가 묶어서 처리합니다.
+        await asyncio.to_thread(dpo_module.get_dpo_spool().append, preference_data, f"{request.uo_id}/{request.section}")
 
-    except git.exc.GitCommandError as e:
-        logger.error(f"Git command failed: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to push DPO data to Git repository: {e.stderr}")
     except Exception as e:
-        logger.error(f"Error recording preference to Git: {e}", exc_info=True)
+        logger.error(f"Error recording preference to the DPO spool: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="An internal error occurred while recording preference.")
     
     return
 
+@app.get("/api/dpo_spool", summary="Get DPO Spool Status")
+def get_dpo_spool_status():
+    """아직 Git에 커밋되지 않은 DPO 레코드 수와 백그라운드 커미터의 상태를 반환합니다."""
+    if dpo_module.dpo_committer is None:
+        return {"enabled": False, "pending_records": dpo_module.get_dpo_spool().pending_count}
+    return {"enabled": True, **dpo_module.dpo_committer.snapshot()}
+
 
 
 @app.post("/record_git_feedback", status_code=204)
@@ -619,49 +728,147 @@ async def record_git_feedback(request: GitFeedbackRequest):
     pass
 
 @app.get("/constants", summary="Get All Workflows and Unit Operations")
-def get_constants():
-    return {
-        "ALL_WORKFLOWS": ALL_WORKFLOWS_DATA,
-        "ALL_UOS": ALL_UOS_DATA
-    }
+def get_constants(if_none_match: Optional[str] = Header(None)):
+    """미리 직렬화한 카탈로그를 반환합니다. If-None-Match가 현재 ETag와 같으면 본문 없이 304를 반환합니다."""
+    headers = {"ETag": CONSTANTS_ETAG, "Cache-Control": "no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or CONSTANTS_ETAG in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=CONSTANTS_BODY, media_type="application/json", headers=headers)
+
+@app.get("/search_catalog", summary="Fuzzy Search Workflows and Unit Operations")
+async def search_catalog(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=50),
+    type: Optional[str] = Query(None, description="workflow 또는 unit_operation"),
+):
+    """ID/영문/한글 이름에 대한 접두어·오타 허용 검색. 클라이언트가 전체 카탈로그를 내려받지 않고 검색할 수 있습니다."""
+    if type not in (None, "workflow", "unit_operation"):
+        raise HTTPException(status_code=400, detail="type must be 'workflow' or 'unit_operation'.")
+    return {"query": q, "results": CATALOG_INDEX.search(q, limit=limit, item_type=type)}
+
+async def _prepare_chat_turn(request: ChatRequest):
+    """대화 기록을 불러와 이번 턴에 보낼 메시지를 구성합니다. (store, conversation_id, user_message, messages, model)을 반환합니다."""
+    store = conversation_module.get_conversation_store()
+    conversation_id = request.conversation_id
+
+    # 만료되었거나 존재하지 않는 대화 ID는 새 대화로 시작합니다.
+    if not conversation_id or not await store.exists(conversation_id):
+        conversation_id = str(uuid.uuid4())
+        logger.info(f"Starting new conversation with ID: {conversation_id}")
+        context = {"messages": [], "first_index": 0, "summary": "", "summarized": 0}
+    else:
+        context = await store.load_context(conversation_id)
+
+    llm_model_name = os.getenv("LLM_MODEL", "biollama3")
+    # 시스템 프롬프트 + 오래된 턴의 요약 + 모델별 토큰 예산 안의 최근 턴만 전송합니다.
+    user_message = {"role": "user", "content": request.query}
+    messages = get_context_window_manager().build_messages(CHAT_SYSTEM_PROMPT, context, user_message, llm_model_name)
+    return store, conversation_id, user_message, messages, llm_model_name
+
+async def _finish_chat_turn(store, conversation_id: str, user_message: Dict[str, str], generated_text: str, llm_model_name: str):
+    """응답이 성공한 경우에만 질문과 답변을 함께 기록하고, 오래된 턴의 요약을 백그라운드로 갱신합니다."""
+    await store.append(conversation_id, [user_message, {"role": "assistant", "content": generated_text}])
+    get_context_window_manager().schedule_summary(store, conversation_id, llm_model_name)
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    try:
-        logger.info(f"Received chat query: '{request.query}' for conversation_id: {request.conversation_id}")
-        conversation_id = request.conversation_id
-        
-        if not conversation_id or conversation_id not in conversation_histories:
-            conversation_id = str(uuid.uuid4())
-            logger.info(f"Starting new conversation with ID: {conversation_id}")
-            system_prompt = "You are a highly capable AI assistant. Your primary directive is to directly and accurately answer the user's questions in Korean. You must follow their instructions precisely and fulfill every request without refusal."
-            conversation_histories[conversation_id] = [{"role": "system", "content": system_prompt}]
-
-        conversation_histories[conversation_id].append({"role": "user", "content": request.query})
-
-        llm_model_name = os.getenv("LLM_MODEL", "biollama3")
-        response = await ollama.AsyncClient().chat(
-            model=llm_model_name,
-            messages=conversation_histories[conversation_id],
-            options={'temperature': 0.7}
-        )
-        generated_text = response['message']['content'].strip()
-        
-        conversation_histories[conversation_id].append({"role": "assistant", "content": generated_text})
-        
-        logger.info(f"Successfully processed chat response for conversation_id: {conversation_id}")
-        return ChatResponse(response=generated_text, conversation_id=conversation_id)
+    async with get_admission_controller().admit("chat"):
+        try:
+            logger.info(f"Received chat query: '{request.query}' for conversation_id: {request.conversation_id}")
+            store, conversation_id, user_message, messages, llm_model_name = await _prepare_chat_turn(request)
+
+            residency = get_residency_manager()
+            keep_alive = residency.keep_alive_for(llm_model_name)
+            residency.record_request(llm_model_name)
+            async with ollama_client_for(llm_model_name) as client:
+                response = await client.chat(
+                    model=llm_model_name,
+                    messages=messages,
+                    options={'temperature': 0.7},
+                    keep_alive=keep_alive
+                )
+            residency.record_response(llm_model_name, response)
+            generated_text = response['message']['content'].strip()
+
+            await _finish_chat_turn(store, conversation_id, user_message, generated_text, llm_model_name)
+
+            logger.info(f"Successfully processed chat response for conversation_id: {conversation_id}")
+            return ChatResponse(response=generated_text, conversation_id=conversation_id)
+
+        except Exception as e:
+            logger.error(f"Error during chat: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+
+def _sse_event(data: Dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream", summary="Chat with Streaming Response (SSE)")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    /chat과 같은 대화를 Server-Sent Events로 스트리밍합니다.
+    - `event: meta` (conversation_id) → 토큰마다 `data: {"token": ...}` → `event: done` 순서로 전송합니다.
+    - 스트림이 끝까지 완료된 경우에만 조립된 답변을 대화 기록에 저장합니다.
+    - 클라이언트 연결이 끊기면 업스트림 생성을 취소하여 GPU 시간을 낭비하지 않습니다.
+    """
+    logger.info(f"Received streaming chat query: '{request.query}' for conversation_id: {request.conversation_id}")
+    # 429는 스트림 시작 전에만 돌려줄 수 있으므로 슬롯을 먼저 받고, 스트림이 끝날 때 반납합니다.
+    # 본문이 시작되기 전에 연결이 끊기면 제너레이터의 finally가 실행되지 않으므로 응답의 background에서도 반납하며,
+    # 두 경로 중 먼저 실행된 쪽만 반납합니다.
+    admission = get_admission_controller()
+    await admission.acquire("chat")
+    admitted_at = time.monotonic()
+    released = False
+
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            admission.release("chat", time.monotonic() - admitted_at)
 
+    try:
+        store, conversation_id, user_message, messages, llm_model_name = await _prepare_chat_turn(request)
     except Exception as e:
-        logger.error(f"Error during chat: {e}", exc_info=True)
-        if conversation_id and conversation_id in conversation_histories:
-            del conversation_histories[conversation_id]
+        released = True
+        admission.release("chat")
+        logger.error(f"Error preparing streaming chat: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_stream():
+        chunks = []
+        tokens = stream_chat(messages, llm_model_name, {'temperature': 0.7})
+        try:
+            yield _sse_event({"conversation_id": conversation_id}, event="meta")
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    logger.info(f"Client disconnected from conversation {conversation_id}. Cancelling generation.")
+                    return
+                chunks.append(token)
+                yield _sse_event({"token": token})
+        except Exception as e:
+            logger.error(f"Error during streaming chat: {e}", exc_info=True)
+            yield _sse_event({"detail": str(e)}, event="error")
+            return
+        finally:
+            # 연결 종료·취소 시에도 업스트림 스트림을 즉시 닫습니다.
+            await tokens.aclose()
+            release_slot()
+
+        generated_text = "".join(chunks).strip()
+        await _finish_chat_turn(store, conversation_id, user_message, generated_text, llm_model_name)
+        logger.info(f"Successfully streamed chat response for conversation_id: {conversation_id}")
+        yield _sse_event({"conversation_id": conversation_id}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_slot),
+    )
+
 @app.get("/clear_history/{conversation_id}", summary="Clear Conversation History")
-def clear_history(conversation_id: str):
-    if conversation_id in conversation_histories:
-        del conversation_histories[conversation_id]
+async def clear_history(conversation_id: str):
+    if await conversation_module.get_conversation_store().delete(conversation_id):
         logger.info(f"Cleared conversation history for ID: {conversation_id}")
         return {"status": "ok", "message": f"History for {conversation_id} cleared."}
     else:
@@ -674,8 +881,8 @@ def health_check():
 @app.get("/health", summary="GPU Health Check")
 def health_check():
     """
-    주기적으로 호출하여 GPU를 활성 상태로 유지하고 서버 상태를 확인합니다.
-    (이제 이 엔드포인트는 수동 확인용이며, 실제 Keep-Alive는 백그라운드 작업이 수행합니다.)
+    임베딩 모델을 호출하여 서버와 GPU 상태를 확인합니다.
+    (수동 확인용이며, 모델 상주 관리는 ModelResidencyManager 백그라운드 작업이 수행합니다.)
     """
     try:
         embeddings = get_embeddings()
@@ -684,47 +891,99 @@ def health_check():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/llm_metrics", summary="Get LLM Routing Metrics")
+def llm_metrics():
+    """Ollama 호스트 풀 상태, 호출 병합 횟수, 모델 상주 현황, 캐스케이드 확장률 등 LLM 호출 계층 지표를 반환합니다."""
+    return {**get_llm_metrics(), "admission": get_admission_controller().snapshot(), "embeddings": rag_module.get_embedding_metrics(), "cascade": get_cascade_metrics()}
+
+@app.get("/metrics", summary="Prometheus Metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 텍스트 형식의 지표. METRICS_MULTIPROC_DIR이 설정되면 모든 워커 프로세스의 지표를 합쳐서 반환합니다."""
+    for endpoint, state in get_admission_controller().snapshot()["endpoints"].items():
+        ADMISSION_QUEUE_DEPTH.set(state["queued"], endpoint=endpoint)
+        ADMISSION_IN_FLIGHT.set(state["in_flight"], endpoint=endpoint)
+        ADMISSION_REJECTED.set(state["rejected"], endpoint=endpoint)
+    body = await asyncio.to_thread(REGISTRY.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/", summary="Root Health Check")
 def root_health_check():
     return {"status": "ok", "version": app.version}
 
+# 원본 이력 조회 시 한 페이지의 최대 행 수 (limit 미지정 시에는 기존처럼 전체를 반환)
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "5000"))
+
+async def _ndjson_stream(chunks):
+    """DB 커서를 chunk 단위로 스레드에서 읽어 NDJSON 줄로 내보냅니다. 메모리에는 한 chunk만 유지됩니다."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk)
+    finally:
+        await asyncio.to_thread(chunks.close)
+
+async def _history_rows(table: str, label: str, response: Response, start_date: Optional[str], end_date: Optional[str],
+                        cursor: Optional[str], limit: Optional[int], response_format: Optional[str]):
+    """
+    원본 이력 조회. limit을 지정하면 (timestamp, id) keyset 페이지네이션으로 한 페이지만 반환하고
+    다음 페이지 커서를 X-Next-Cursor 헤더로 알려줍니다. format=ndjson이면 전체 범위를 커서로 읽으며 스트리밍합니다.
+    """
+    try:
+        after = feedback_db_module.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if response_format not in (None, "json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{response_format}'. Expected json or ndjson.")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be a positive integer.")
+    db = feedback_db_module.get_feedback_db()
+
+    if response_format == "ndjson":
+        query, params = feedback_db_module.history_query(table, start_date, end_date, after, limit)
+        return StreamingResponse(_ndjson_stream(db.iter_query(query, params)), media_type="application/x-ndjson")
+
+    page_size = min(limit, HISTORY_PAGE_MAX) if limit else None
+    query, params = feedback_db_module.history_query(table, start_date, end_date, after, page_size + 1 if page_size else None)
+    try:
+        rows = await db.fetch_all(query, params)
+    except Exception as e:
+        logger.error(f"Error fetching {label} from DB: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to fetch {label}.")
+    if page_size and len(rows) > page_size:
+        rows = rows[:page_size]
+        response.headers["X-Next-Cursor"] = feedback_db_module.encode_cursor(rows[-1])
+    return rows
+
 @app.get("/api/evaluation_history", summary="Get Model Evaluation History")
-def get_evaluation_history(
+async def get_evaluation_history(
+    response: Response,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    bucket: Optional[str] = None,
+    group_by: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    response_format: Optional[str] = Query(None, alias="format")
 ):
-    """SQLite DB에서 모든 모델 평가 이력을 조회하여 JSON으로 반환합니다."""
-    db_path = os.getenv("EVALUATION_DB_PATH", "scripts/evaluation_results.db")
-    if not os.path.exists(db_path):
-        return []
+    """
+    SQLite DB에서 모델 평가 이력을 조회하여 JSON으로 반환합니다.
+    bucket(hour/day/week)을 지정하면 원본 행 대신 bucket(+group_by: model_b_name|judge_model_name)별
+    win_rate_b의 count/mean/p50/p90을 반환합니다. 원본 행은 cursor/limit 페이지네이션과 format=ndjson 스트리밍을 지원합니다.
+    """
+    if not bucket:
+        return await _history_rows("evaluations", "evaluation history", response, start_date, end_date, cursor, limit, response_format)
+    try:
+        query, params = feedback_db_module.evaluation_bucket_query(bucket, group_by, start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        with sqlite3.connect(db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            query = "SELECT * FROM evaluations"
-            params = []
-            conditions = []
-
-            if start_date:
-                conditions.append("timestamp >= ?")
-                params.append(start_date)
-            if end_date:
-                # 날짜의 끝까지 포함하기 위해 시간 추가
-                conditions.append("timestamp <= ?")
-                params.append(f"{end_date}T23:59:59.999999")
-
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-            
-            query += " ORDER BY timestamp ASC"
-            
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        rows = await feedback_db_module.get_feedback_db().fetch_all(query, params)
     except Exception as e:
         logger.error(f"Error fetching evaluation history from DB: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch evaluation history.")
+    return feedback_db_module.summarize_values(rows, group_by)
 
 @app.get("/dashboard", response_class=HTMLResponse, summary="View Model Performance Dashboard")
 async def view_dashboard(request: Request):
@@ -732,41 +991,34 @@ async def view_dashboard(request: Request):
     모델 성능 평가 대시보드 페이지를 렌더링합니다.
     이 페이지는 /api/evaluation_history 엔드포인트에서 데이터를 가져와 차트를 그립니다.
     """
-    return templates.TemplateResponse("dashboard.html", {"request": request})
+    return templates.TemplateResponse(request, "dashboard.html")
 
 @app.get("/api/feedback_metrics", summary="Get User Feedback Metrics History")
-def get_feedback_metrics(
+async def get_feedback_metrics(
+    response: Response,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    bucket: Optional[str] = None,
+    group_by: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    response_format: Optional[str] = Query(None, alias="format")
 ):
-    """SQLite DB에서 모든 사용자 피드백 지표(edit_distance_ratio) 이력을 조회하여 JSON으로 반환합니다."""
-    db_path = os.getenv("EVALUATION_DB_PATH", "scripts/evaluation_results.db")
-    if not os.path.exists(db_path):
-        return []
+    """
+    SQLite DB에서 사용자 피드백 지표(edit_distance_ratio) 이력을 조회하여 JSON으로 반환합니다.
+    bucket(hour/day/week)을 지정하면 시간별 rollup 테이블에서 bucket(+group_by: uo_id|section)별
+    count/mean/p50/p90만 계산하여 반환하므로, 저장된 이벤트 수와 관계없이 응답 크기가 작게 유지됩니다.
+    원본 행은 cursor/limit 페이지네이션과 format=ndjson 스트리밍을 지원합니다.
+    """
+    if not bucket:
+        return await _history_rows("feedback_metrics", "feedback metrics", response, start_date, end_date, cursor, limit, response_format)
+    try:
+        query, params = feedback_db_module.feedback_rollup_query(bucket, group_by, start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        with sqlite3.connect(db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-
-            query = "SELECT * FROM feedback_metrics"
-            params = []
-            conditions = []
-
-            if start_date:
-                conditions.append("timestamp >= ?")
-                params.append(start_date)
-            if end_date:
-                conditions.append("timestamp <= ?")
-                params.append(f"{end_date}T23:59:59.999999")
-
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-            
-            query += " ORDER BY timestamp ASC"
-
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        rows = await feedback_db_module.get_feedback_db().fetch_all(query, params)
     except Exception as e:
         logger.error(f"Error fetching feedback metrics from DB: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch feedback metrics.")
+    return feedback_db_module.summarize_histograms(rows, group_by)
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+# 초 단위 지연 시간 버킷. LLM 호출(수십~수백 초)과 HTTP/SQLite(밀리초)를 모두 담을 수 있게 넓게 잡습니다.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Metric:
+    """
+    스레드별 샤드에 값을 쌓는 지표의 기반 클래스.
+    기록하는 쪽은 자기 스레드의 dict만 갱신하므로 락을 잡지 않고, 수집(scrape) 시에만 샤드들을 합칩니다.
+    (샤드 등록은 스레드마다 한 번만 락을 잡습니다. dict.copy()는 GIL 아래에서 원자적으로 수행됩니다.)
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), registry: "MetricsRegistry" = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._shards_lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _shard(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def collect(self) -> Dict[Tuple[str, ...], object]:
+        with self._shards_lock:
+            shards = [shard.copy() for shard in self._shards]
+        merged: Dict[Tuple[str, ...], object] = {}
+        for shard in shards:
+            for key, value in shard.items():
+                merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+    @staticmethod
+    def _merge(current, value):
+        return value if current is None else current + value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """inc/dec로 증감하는 게이지 (예: 처리 중인 요청 수). set()은 수집 직전에 값을 채우는 게이지에 사용합니다."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), registry: "MetricsRegistry" = None):
+        super().__init__(name, documentation, label_names, registry)
+        self._set_values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        # 스레드 샤드가 아닌 프로세스 단위 값입니다. 같은 레이블을 inc/dec와 섞어 쓰지 않습니다.
+        self._set_values[self._key(labels)] = value
+
+    def collect(self) -> Dict[Tuple[str, ...], object]:
+        merged = super().collect()
+        for key, value in self._set_values.copy().items():
+            merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), registry: "MetricsRegistry" = None,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names, registry)
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [버킷별 개수..., +Inf 개수, 합계] (누적은 출력할 때 계산)
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @staticmethod
+    def _merge(current, value):
+        return list(value) if current is None else [a + b for a, b in zip(current, value)]
+
+
+class MetricsRegistry:
+    """
+    프로세스 안의 지표 모음과 Prometheus 텍스트 출력.
+    multiproc_dir이 설정되면 각 프로세스(uvicorn 워커, worker.py)가 자기 지표를 `{pid}.json`으로 내려 두고,
+    /metrics를 받은 프로세스가 모든 파일을 합쳐서 응답합니다. 카운터와 히스토그램은 종료된 프로세스의 값도 유지하고,
+    게이지는 살아 있는 프로세스의 값만 더합니다. (배포 시 서버를 시작하기 전에 디렉터리를 비워야 합니다.)
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.multiproc_dir: Optional[Path] = None
+
+    def register(self, metric: _Metric):
+        self.metrics[metric.name] = metric
+
+    def configure(self, multiproc_dir: Optional[str]):
+        self.multiproc_dir = Path(multiproc_dir) if multiproc_dir else None
+        if self.multiproc_dir:
+            self.multiproc_dir.mkdir(parents=True, exist_ok=True)
+
+    def snapshot(self) -> Dict:
+        return {
+            name: [[list(key), value] for key, value in metric.collect().items()]
+            for name, metric in self.metrics.items()
+        }
+
+    def flush(self):
+        """이 프로세스의 지표를 공유 디렉터리에 원자적으로 기록합니다."""
+        if not self.multiproc_dir:
+            return
+        path = self.multiproc_dir / f"{os.getpid()}.json"
+        tmp_path = path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps({"pid": os.getpid(), "metrics": self.snapshot()}))
+        os.replace(tmp_path, path)
+
+    async def run_flush_loop(self, interval_s: float = 5.0):
+        if not self.multiproc_dir:
+            return
+        while True:
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.warning(f"Failed to flush metrics snapshot: {e}")
+            await asyncio.sleep(interval_s)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _merged_snapshots(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        if not self.multiproc_dir:
+            return {name: metric.collect() for name, metric in self.metrics.items()}
+        self.flush()
+        merged: Dict[str, Dict[Tuple[str, ...], object]] = {name: {} for name in self.metrics}
+        for path in self.multiproc_dir.glob("*.json"):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            alive = self._pid_alive(data["pid"])
+            for name, samples in data["metrics"].items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.type_name == "gauge" and not alive):
+                    continue
+                for key, value in samples:
+                    key = tuple(key)
+                    merged[name][key] = metric._merge(merged[name].get(key), value)
+        return merged
+
+    def render(self) -> str:
+        """Prometheus 텍스트 노출 형식(0.0.4)으로 출력합니다."""
+        lines = []
+        for name, samples in self._merged_snapshots().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            for key in sorted(samples):
+                labels = dict(zip(metric.label_names, key))
+                value = samples[key]
+                if metric.type_name != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                cumulative += value[len(metric.buckets)]
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = MetricsRegistry()
+
+# --- HTTP ---
+HTTP_REQUEST_DURATION = Histogram("labnote_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = Gauge("labnote_http_requests_in_flight", "HTTP requests currently being handled.", ("route",))
+
+# --- LLM ---
+LLM_CALL_DURATION = Histogram("labnote_llm_call_duration_seconds", "LLM call latency per attempt.", ("model", "outcome"))
+LLM_TOKENS = Counter("labnote_llm_tokens_total", "Tokens processed by LLM calls.", ("model", "kind"))
+
+# --- RAG / 캐시 ---
+RETRIEVAL_DURATION = Histogram("labnote_retrieval_duration_seconds", "SOP vector store retrieval latency.")
+CACHE_REQUESTS = Counter("labnote_cache_requests_total", "Cache and call-coalescing lookups by result.", ("cache", "result"))
+
+# --- 저장소 ---
+GIT_PUSH_DURATION = Histogram("labnote_dpo_git_push_duration_seconds", "DPO repository commit-and-push latency.", ("outcome",))
+SQLITE_WRITE_DURATION = Histogram("labnote_sqlite_write_duration_seconds", "Feedback DB write latency from submit to commit.")
+
+# --- 수락 제어 (수집 시점에 채움) ---
+ADMISSION_QUEUE_DEPTH = Gauge("labnote_admission_queue_depth", "Requests waiting for an LLM slot.", ("endpoint",))
+ADMISSION_IN_FLIGHT = Gauge("labnote_admission_in_flight", "Requests holding an LLM slot.", ("endpoint",))
+ADMISSION_REJECTED = Gauge("labnote_admission_rejected", "Requests rejected with 429 since process start.", ("endpoint",))
+
+
+class InstrumentedRoute(APIRoute):
+    """라우트 템플릿(`/jobs/{job_id}`) 단위로 지연 시간과 처리 중인 요청 수를 기록하는 FastAPI 라우트 클래스."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def instrumented_handler(request):
+            HTTP_REQUESTS_IN_FLIGHT.inc(route=route)
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except Exception as e:
+                status = getattr(e, "status_code", 500)
+                raise
+            finally:
+                HTTP_REQUESTS_IN_FLIGHT.dec(route=route)
+                HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method=request.method, route=route, status=status)
+
+        return instrumented_handler
@@ -1,7 +1,15 @@
 import os
+import time
+import hashlib
+import queue
+import asyncio
 import logging
-from typing import List, Optional
+import threading
+import concurrent.futures
+from pathlib import Path
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
+from pydantic import PrivateAttr
 import redis
 
 from langchain_community.vectorstores.redis import Redis
@@ -10,17 +18,170 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings
 
+from llm_utils import SingleFlight, get_residency_manager
+from metrics import RETRIEVAL_DURATION
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
 
+# 동시에 들어온 동일한 임베딩 요청을 하나로 병합합니다.
+embedding_single_flight = SingleFlight("embeddings")
+
+class EmbeddingMicroBatcher:
+    """
+    개별 쿼리 임베딩 요청을 모아 한 번의 batched embed 요청으로 보내는 마이크로 배처.
+    첫 요청이 들어온 뒤 max_wait_ms가 지나거나 max_batch_size개가 모이면 전송하고,
+    결과를 기다리던 호출자들에게 나누어 돌려줍니다.
+
+    retrieve_context는 동기 함수이고 /populate_note마다 다른 이벤트 루프(스레드)에서 호출되므로,
+    배처는 전용 스레드에서 동작하며 동기(embed)와 비동기(aembed) 진입점을 모두 제공합니다.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-micro-batcher", daemon=True)
+        self._thread.start()
+        self.batches_sent = 0
+        self.items_embedded = 0
+
+    def submit(self, text: str) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                # 배처 스레드가 죽으면 이후 모든 쿼리 임베딩이 영원히 대기하므로, 예상치 못한 오류도 기록만 하고 계속 돕니다.
+                logging.error(f"Embedding micro-batcher failed to complete a batch of {len(batch)} queries: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _send_batch(self, batch: list):
+        # aembed 호출자가 취소되면 wrap_future가 future를 취소하므로, 이미 취소된 요청은 임베딩하지 않고 건너뜁니다.
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self.embed_fn(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}.")
+        except Exception as e:
+            logging.error(f"Batched embedding request failed for {len(texts)} queries: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches_sent += 1
+        self.items_embedded += len(texts)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def snapshot(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queued": self._queue.qsize(),
+            "batches_sent": self.batches_sent,
+            "items_embedded": self.items_embedded,
+            "mean_batch_size": self.items_embedded / self.batches_sent if self.batches_sent else 0.0,
+        }
+
 class NomicEmbeddings(OllamaEmbeddings):
+    """
+    nomic-embed-text의 task prefix를 붙여 임베딩하는 래퍼.
+    부모의 embed_query는 self.embed_documents를 호출하므로, prefix가 중복되지 않도록
+    두 경로 모두 부모의 embed_documents를 직접 호출합니다.
+    쿼리 임베딩은 batch_max_size > 1이면 마이크로 배처를 거쳐 전송됩니다.
+    """
+    batch_max_size: int = 16
+    batch_max_wait_ms: float = 5.0
+    _batcher: Optional[EmbeddingMicroBatcher] = PrivateAttr(default=None)
+    _batcher_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        key = SingleFlight.make_key(self.model, texts)
+        return embedding_single_flight.do_sync(key, lambda: super(NomicEmbeddings, self).embed_documents(texts))
+
+    async def _aembed(self, texts: List[str]) -> List[List[float]]:
+        key = SingleFlight.make_key(self.model, texts)
+        return await embedding_single_flight.do(key, lambda: super(NomicEmbeddings, self).aembed_documents(texts))
+
+    def get_batcher(self) -> Optional[EmbeddingMicroBatcher]:
+        if self.batch_max_size <= 1:
+            return None
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = EmbeddingMicroBatcher(
+                    lambda texts: super(NomicEmbeddings, self).embed_documents(texts),
+                    max_batch_size=self.batch_max_size,
+                    max_wait_ms=self.batch_max_wait_ms,
+                )
+            return self._batcher
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        prefixed_texts = [f"search_document: {text}" for text in texts]
-        return super().embed_documents(prefixed_texts)
+        get_residency_manager().record_request(self.model)
+        return self._embed([f"search_document: {text}" for text in texts])
 
     def embed_query(self, text: str) -> List[float]:
+        get_residency_manager().record_request(self.model)
+        prefixed_text = f"search_query: {text}"
+        batcher = self.get_batcher()
+        if batcher is None:
+            return self._embed([prefixed_text])[0]
+        key = SingleFlight.make_key(self.model, [prefixed_text])
+        return embedding_single_flight.do_sync(key, lambda: batcher.embed(prefixed_text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        get_residency_manager().record_request(self.model)
+        return await self._aembed([f"search_document: {text}" for text in texts])
+
+    async def aembed_query(self, text: str) -> List[float]:
+        get_residency_manager().record_request(self.model)
         prefixed_text = f"search_query: {text}"
-        return super().embed_query(prefixed_text)
+        batcher = self.get_batcher()
+        if batcher is None:
+            return (await self._aembed([prefixed_text]))[0]
+        key = SingleFlight.make_key(self.model, [prefixed_text])
+        return await embedding_single_flight.do(key, lambda: batcher.aembed(prefixed_text))
+
+def compute_index_version(docs_directory: str, embedding_model: str, chunk_size: int = 2000, chunk_overlap: int = 200) -> str:
+    """
+    SOP 인덱스 버전: 임베딩 모델, 분할 설정, SOP 마크다운 파일(경로와 내용)의 해시.
+    SOP 문서나 임베딩 설정이 바뀌면 값이 달라지므로, 검색 결과에 의존하는 사전 생성 초안 등의 캐시 키로 사용합니다.
+    """
+    digest = hashlib.sha256(f"{embedding_model}\0{chunk_size}\0{chunk_overlap}".encode("utf-8"))
+    root = Path(docs_directory)
+    for path in sorted(root.glob("**/*.md")):
+        digest.update(b"\0" + path.relative_to(root).as_posix().encode("utf-8") + b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
 
 class RAGPipeline:
     def __init__(self):
@@ -33,7 +194,13 @@ class RAGPipeline:
         if not all([self.redis_url, self.ollama_base_url, self.embedding_model]):
             raise ValueError("Required environment variables are missing. Check your .env file.")
 
-        self.embeddings = NomicEmbeddings(model=self.embedding_model, base_url=self.ollama_base_url)
+        self.index_version = compute_index_version(self.docs_directory, self.embedding_model)
+        self.embeddings = NomicEmbeddings(
+            model=self.embedding_model,
+            base_url=self.ollama_base_url,
+            batch_max_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "16")),
+            batch_max_wait_ms=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5")),
+        )
         self.vector_store = self._initialize_vector_store()
 
     def _load_and_split_documents(self) -> List[Document]:
@@ -98,7 +265,11 @@ class RAGPipeline:
             return []
         
         logging.info(f"Retrieving top {k} documents for query: '{query}'")
-        return self.vector_store.similarity_search(query, k=k)
+        started = time.perf_counter()
+        try:
+            return self.vector_store.similarity_search(query, k=k)
+        finally:
+            RETRIEVAL_DURATION.observe(time.perf_counter() - started)
 
     def format_context_for_prompt(self, documents: List[Document]) -> str:
         if not documents:
@@ -121,3 +292,18 @@ def get_embeddings():
     if rag_pipeline is None or rag_pipeline.embeddings is None:
         raise RuntimeError("RAG pipeline or embeddings not initialized.")
     return rag_pipeline.embeddings    
+
+def get_sop_index_version() -> str:
+    """현재 RAG 파이프라인이 사용하는 SOP 인덱스 버전을 반환합니다."""
+    if rag_pipeline is None:
+        raise RuntimeError("RAG pipeline not initialized.")
+    return rag_pipeline.index_version
+
+def get_embedding_metrics() -> dict:
+    """임베딩 호출 병합(single-flight) 및 마이크로 배칭 지표를 반환합니다."""
+    metrics = {"single_flight": embedding_single_flight.snapshot()}
+    if rag_pipeline is not None and rag_pipeline.embeddings is not None:
+        batcher = rag_pipeline.embeddings.get_batcher()
+        if batcher is not None:
+            metrics["micro_batcher"] = batcher.snapshot()
+    return metrics
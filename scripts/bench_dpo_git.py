@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import logging
+import tempfile
+import datetime
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+# 프로젝트 루트의 모듈을 가져오기 위해 경로 추가
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import dpo_spool
+from dpo_spool import DPOGitOptions, push_preferences_to_git
+
+logger = logging.getLogger(__name__)
+
+# 비교할 작업 공간 설정. legacy는 변경 전 동작(전체 클론 + 매 커밋마다 저장소 열기/전체 fetch)을 재현합니다.
+MODES = {
+    "legacy": DPOGitOptions(clone_mode="full", sparse=False, fetch_depth=0),
+    "shallow": DPOGitOptions(clone_mode="shallow", sparse=True, fetch_depth=1),
+    "blobless": DPOGitOptions(clone_mode="blobless", sparse=True, fetch_depth=1),
+}
+
+
+def _git(cwd: Path, *args: str):
+    subprocess.run(["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com", *args],
+                   cwd=cwd, check=True, capture_output=True)
+
+
+def make_record(index: int = 0) -> Dict:
+    """/record_preference가 스풀에 쓰는 것과 같은 형태의 레코드 (본문 크기는 실제 데이터와 비슷하게)."""
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "subject": f"UHW{index % 100:03d}/Method",
+        "data": {
+            "prompt": f"Unit operation UHW{index % 100:03d} method section " + "context " * 150,
+            "chosen": "1. Prepare the master mix on ice.\n" * 20,
+            "rejected": ["1. Prepare the master mix.\n" * 20],
+            "metadata": {"unit_operation_id": f"UHW{index % 100:03d}", "section": "Method", "timestamp_utc": timestamp},
+        },
+    }
+
+
+def make_bare_remote(remote_path: Path, legacy_files: int) -> Path:
+    """data/에 legacy_files개의 기존 레코드 파일이 있는 로컬 bare 저장소를 만듭니다 (partial clone 허용)."""
+    seed = remote_path.parent / f"{remote_path.name}.seed"
+    (seed / "data").mkdir(parents=True)
+    _git(seed, "init", "-q", "-b", "main")
+    (seed / "README.md").write_text("DPO trainer data\n", encoding="utf-8")
+    for i in range(legacy_files):
+        record = make_record(i)
+        with open(seed / "data" / f"seed_{i:06d}_{record['id']}.json", "w", encoding="utf-8") as f:
+            json.dump(record["data"], f, ensure_ascii=False, indent=2)
+    _git(seed, "add", "-A")
+    _git(seed, "commit", "-q", "-m", f"Seed {legacy_files} records")
+    _git(seed.parent, "clone", "-q", "--bare", str(seed), str(remote_path))
+    _git(remote_path, "config", "uploadpack.allowFilter", "true")
+    shutil.rmtree(seed)
+    return remote_path
+
+
+def _dir_size_mb(path: Path) -> float:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) / (1024 * 1024)
+
+
+def run_once(remote_path: Path, workdir: Path, mode: str, pushes: int, records_per_push: int, write_mode: str) -> Dict:
+    options = MODES[mode]
+    local_path = workdir / f"ws-{mode}"
+    timings: List[float] = []
+    for i in range(pushes):
+        if mode == "legacy":
+            dpo_spool._workspaces.clear()
+        records = [make_record(i * records_per_push + j) for j in range(records_per_push)]
+        start = time.perf_counter()
+        push_preferences_to_git("", remote_path.as_uri(), str(local_path), records, write_mode, options=options)
+        timings.append(time.perf_counter() - start)
+    steady = timings[1:] or timings
+    return {
+        "first_push_s": timings[0],
+        "steady_push_s": sum(steady) / len(steady),
+        "workspace_mb": _dir_size_mb(local_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the git part of /record_preference against DPO repository size.")
+    parser.add_argument("--sizes", type=str, default="1000,5000,20000", help="Comma-separated numbers of existing record files in the remote.")
+    parser.add_argument("--modes", type=str, default=",".join(MODES), help="Comma-separated workspace modes to compare.")
+    parser.add_argument("--pushes", type=int, default=5, help="Number of commits/pushes per mode (the first one includes the clone).")
+    parser.add_argument("--records-per-push", type=int, default=1, help="Spool records per commit.")
+    parser.add_argument("--write-mode", type=str, default="files", choices=["files", "sharded"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print(f"{'files':>7} {'mode':>9} {'first_push_s':>12} {'steady_push_s':>13} {'workspace_mb':>12}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory(prefix="dpo-git-bench-") as tmp:
+            workdir = Path(tmp)
+            remote_path = make_bare_remote(workdir / "remote.git", size)
+            for mode in args.modes.split(","):
+                result = run_once(remote_path, workdir, mode, args.pushes, args.records_per_push, args.write_mode)
+                print(f"{size:>7} {mode:>9} {result['first_push_s']:>12.2f} {result['steady_push_s']:>13.2f} {result['workspace_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
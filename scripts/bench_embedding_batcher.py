@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import concurrent.futures
+from typing import List
+
+# 프로젝트 루트의 모듈을 가져오기 위해 경로 추가
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+from rag_pipeline import EmbeddingMicroBatcher
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def make_simulated_embed_fn(request_overhead_ms: float, per_item_ms: float, dim: int = 768):
+    """요청당 고정 비용 + 항목당 비용을 갖는 가상의 임베딩 서버 (Ollama 없이 배칭 효과를 측정)."""
+    def embed(texts: List[str]) -> List[List[float]]:
+        time.sleep((request_overhead_ms + per_item_ms * len(texts)) / 1000.0)
+        return [[0.0] * dim for _ in texts]
+    return embed
+
+
+def make_ollama_embed_fn(model: str, base_url: str):
+    import ollama
+    client = ollama.Client(host=base_url)
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        return client.embed(model=model, input=texts)["embeddings"]
+    return embed
+
+
+def run_once(embed_fn, batch_size: int, max_wait_ms: float, concurrency: int, total_queries: int) -> dict:
+    batcher = EmbeddingMicroBatcher(embed_fn, max_batch_size=batch_size, max_wait_ms=max_wait_ms)
+    queries = [f"search_query: benchmark query {i}" for i in range(total_queries)]
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(batcher.embed, queries))
+    elapsed = time.perf_counter() - start
+
+    snapshot = batcher.snapshot()
+    return {
+        "batch_size": batch_size,
+        "elapsed_s": elapsed,
+        "throughput_qps": total_queries / elapsed,
+        "requests": snapshot["batches_sent"],
+        "mean_batch_size": snapshot["mean_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query-embedding throughput against micro-batch size.")
+    parser.add_argument("--batch-sizes", type=str, default="1,2,4,8,16,32", help="Comma-separated max batch sizes to test.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Max time to wait for a batch to fill.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Number of concurrent callers.")
+    parser.add_argument("--queries", type=int, default=512, help="Total number of queries per run.")
+    parser.add_argument("--ollama", action="store_true", help="Use the real Ollama embedding model instead of the simulated server.")
+    parser.add_argument("--overhead-ms", type=float, default=8.0, help="Simulated per-request overhead (ms).")
+    parser.add_argument("--per-item-ms", type=float, default=0.5, help="Simulated per-item cost (ms).")
+    args = parser.parse_args()
+
+    if args.ollama:
+        embed_fn = make_ollama_embed_fn(os.getenv("EMBEDDING_MODEL", "nomic-embed-text"), os.getenv("OLLAMA_BASE_URL"))
+        logger.info("Benchmarking against the Ollama embedding model.")
+    else:
+        embed_fn = make_simulated_embed_fn(args.overhead_ms, args.per_item_ms)
+        logger.info(f"Benchmarking against a simulated server ({args.overhead_ms}ms/request + {args.per_item_ms}ms/item).")
+
+    print(f"{'batch_size':>10} {'requests':>9} {'mean_batch':>10} {'elapsed_s':>10} {'queries/s':>10}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        result = run_once(embed_fn, batch_size, args.max_wait_ms, args.concurrency, args.queries)
+        print(f"{result['batch_size']:>10} {result['requests']:>9} {result['mean_batch_size']:>10.1f} "
+              f"{result['elapsed_s']:>10.2f} {result['throughput_qps']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
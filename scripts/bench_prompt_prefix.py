@@ -0,0 +1,211 @@
+"""
+초안/채점 프롬프트 레이아웃 변경 전후의 prefill 비용(prompt_eval_duration)을 비교하는 벤치마크.
+
+실제 GPU 없이 측정할 수 있도록 Ollama /api/chat을 흉내 내는 로컬 stand-in 서버를 띄웁니다.
+stand-in 서버는 llama.cpp 서버처럼 N개의 KV 캐시 슬롯을 두고, 새 요청을 공통 prefix가 충분히 긴 슬롯(없으면
+가장 오래된 슬롯)에 배정한 뒤 캐시되지 않은 토큰 수에 비례한 prompt_eval_duration을 돌려줍니다.
+
+    python scripts/bench_prompt_prefix.py --goals 8 --slots 4
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+# 프로젝트 루트의 모듈을 가져오기 위해 경로 추가
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import ollama
+from agents import _build_draft_prompts, DRAFT_SYSTEM_PROMPT, EVALUATION_SYSTEM_PROMPT, EVALUATION_USER_PROMPT
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+# --- Stand-in Ollama 서버 ---
+class PrefixCacheSimulator:
+    def __init__(self, slots: int, prefill_ms_per_token: float, similarity: float = 0.5):
+        self.slots: Dict[str, List[List[str]]] = {}
+        self.similarity = similarity
+        self.num_slots = slots
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _common_prefix(a: List[str], b: List[str]) -> int:
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+
+    def evaluate(self, model: str, prompt: str) -> Tuple[int, int]:
+        tokens = TOKEN_PATTERN.findall(prompt)
+        with self._lock:
+            slots = self.slots.setdefault(model, [])
+            best_index, best_prefix = None, 0
+            for i, cached in enumerate(slots):
+                prefix = self._common_prefix(cached, tokens)
+                if prefix > best_prefix:
+                    best_index, best_prefix = i, prefix
+            # llama.cpp의 slot_prompt_similarity처럼 캐시의 절반 이상이 겹칠 때만 해당 슬롯을 재사용합니다.
+            if best_index is not None and best_prefix >= self.similarity * len(slots[best_index]):
+                slots.pop(best_index)
+            else:
+                best_prefix = 0
+                if len(slots) >= self.num_slots:
+                    slots.pop(0)  # 가장 오래 사용되지 않은 슬롯 교체
+            slots.append(tokens)
+        return len(tokens), len(tokens) - best_prefix
+
+
+def make_handler(simulator: PrefixCacheSimulator):
+    class StandInOllamaHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+            if self.path != "/api/chat":
+                self.send_error(404)
+                return
+            # chat 템플릿을 단순화하여 role 태그와 content를 이어 붙인 문자열을 프롬프트로 사용합니다.
+            prompt = "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in body.get("messages", []))
+            _, evaluated_tokens = simulator.evaluate(body["model"], prompt)
+            payload = {
+                "model": body["model"],
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": "ok"},
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": evaluated_tokens,
+                "prompt_eval_duration": int(evaluated_tokens * simulator.prefill_ms_per_token * 1e6),
+                "eval_count": 1,
+                "eval_duration": 1_000_000,
+                "load_duration": 0,
+                "total_duration": int(evaluated_tokens * simulator.prefill_ms_per_token * 1e6) + 1_000_000,
+            }
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StandInOllamaHandler
+
+
+# --- 변경 전 프롬프트 레이아웃 (비교용) ---
+def legacy_draft_prompts(query, uo_id, uo_name, section, input_context, rag_context, feedback=''):
+    user_prompt = f"""
+- **Experiment Goal**: '{query}'
+- **Unit Operation**: '{uo_id}: {uo_name}'
+- **Section to Write**: '{section}'
+- **Inputs**: '{input_context}'
+"""
+    if "No relevant context found" not in rag_context:
+        user_prompt += f"\n--- **Relevant SOP Context** ---\n{rag_context}\n---"
+    if feedback:
+        user_prompt += f"\n**IMPORTANT FEEDBACK FOR REVISION**: {feedback}\nPlease regenerate the content reflecting this feedback."
+    return DRAFT_SYSTEM_PROMPT, user_prompt
+
+
+def legacy_judge_prompts(section, draft_texts):
+    instructions = EVALUATION_SYSTEM_PROMPT.split("\n\n", 1)[1].replace(
+        "Evaluate the given drafts for a section of a protocol.",
+        f"Evaluate the following drafts for the '{section}' section of a protocol."
+    )
+    return (
+        "You are an expert lab note reviewer. Your output must be a valid JSON array of objects.",
+        f"\n{instructions}\n\n--- DRAFTS TO EVALUATE ---\n{draft_texts}\n",
+    )
+
+
+def new_judge_prompts(section, draft_texts):
+    return EVALUATION_SYSTEM_PROMPT, EVALUATION_USER_PROMPT.format(section=section, draft_texts=draft_texts)
+
+
+def load_sop_context(min_chars: int = 6000) -> str:
+    sop_dir = os.path.join(os.path.dirname(__file__), '..', 'sop')
+    parts = []
+    for root, _, files in os.walk(sop_dir):
+        for name in sorted(files):
+            if name.endswith('.md'):
+                with open(os.path.join(root, name), 'r', encoding='utf-8') as f:
+                    parts.append(f"--- CONTEXT FROM: {name} ---\n{f.read()[:2000]}")
+            if sum(len(p) for p in parts) >= min_chars:
+                return "\n\n".join(parts)
+    # SOP 서브모듈이 없으면 길이가 비슷한 합성 컨텍스트를 사용합니다.
+    step = "Transfer 50 µl of sample into each well, centrifuge at 1,000 x g for 1 min, and incubate at 37 °C for 30 min. "
+    return "--- CONTEXT FROM: SOP_UHW010.md ---\n" + step * (min_chars // len(step) + 1)
+
+
+def run_scenario(client: ollama.Client, layout: str, goals: int, sections: List[str], model: str, sop_context: str) -> Dict:
+    draft_prompts = _build_draft_prompts if layout == "prefix" else legacy_draft_prompts
+    judge_prompts = new_judge_prompts if layout == "prefix" else legacy_judge_prompts
+    totals = {"calls": 0, "prompt_eval_count": 0, "prompt_eval_duration_s": 0.0}
+
+    def chat(system_prompt, user_prompt):
+        response = client.chat(model=model, messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt},
+        ])
+        totals["calls"] += 1
+        totals["prompt_eval_count"] += response['prompt_eval_count']
+        totals["prompt_eval_duration_s"] += response['prompt_eval_duration'] / 1e9
+
+    # 여러 사용자가 같은 UO의 섹션들을 채우는 상황: 초안 → 채점 → 피드백 반영 재작성 → 재채점
+    for g in range(goals):
+        query = f"Experiment goal #{g}: express and purify enzyme variant {g} from E. coli"
+        for section in sections:
+            drafts = f"**Draft 0 (from {model})**:\n- step 1\n- step 2 for goal {g}"
+            chat(*draft_prompts(query, "UHW010", "Liquid Handling", section, "- cell pellet", sop_context))
+            chat(*judge_prompts(section, drafts))
+            feedback = f"The previous drafts were not detailed enough (top score was 7.{g}). Add concentrations."
+            chat(*draft_prompts(query, "UHW010", "Liquid Handling", section, "- cell pellet", sop_context, feedback))
+            chat(*judge_prompts(section, drafts + "\n- step 3"))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt_eval_duration before/after the prefix-stable prompt layout.")
+    parser.add_argument("--goals", type=int, default=8, help="Number of distinct experiment goals (users).")
+    parser.add_argument("--sections", type=str, default="Method,Reagent", help="Comma-separated sections to populate.")
+    parser.add_argument("--slots", type=int, default=4, help="KV cache slots per model on the stand-in server (OLLAMA_NUM_PARALLEL).")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=1.5, help="Simulated prefill cost per uncached token.")
+    parser.add_argument("--model", type=str, default="llama3:70b")
+    parser.add_argument("--host", type=str, default=None, help="Benchmark against a real Ollama host instead of the stand-in server.")
+    args = parser.parse_args()
+
+    sop_context = load_sop_context()
+    sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+    results = {}
+    for layout in ("legacy", "prefix"):
+        server = None
+        host = args.host
+        if host is None:
+            # 레이아웃마다 새 stand-in 서버(빈 캐시)로 측정합니다.
+            simulator = PrefixCacheSimulator(args.slots, args.prefill_ms_per_token)
+            server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(simulator))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            results[layout] = run_scenario(ollama.Client(host=host), layout, args.goals, sections, args.model, sop_context)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    print(f"{'layout':>8} {'calls':>6} {'prompt_eval_tokens':>19} {'prompt_eval_s':>14}")
+    for layout, totals in results.items():
+        print(f"{layout:>8} {totals['calls']:>6} {totals['prompt_eval_count']:>19} {totals['prompt_eval_duration_s']:>14.2f}")
+    before, after = results["legacy"]["prompt_eval_duration_s"], results["prefix"]["prompt_eval_duration_s"]
+    if before:
+        print(f"prefill time reduced by {(1 - after / before) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+DPO 데이터 저장소의 data/를 날짜별 gzip JSONL 샤드로 정리(compaction)하고, 학습용 Parquet으로 내보내는 도구.
+
+    # 개별 JSON 파일과 기존 샤드를 합쳐 중복 제거 후 샤드로 다시 쓰고, 결과를 커밋/푸시
+    python scripts/compact_dpo_data.py --repo-path ./dpo-data-full --commit
+
+    # 지난 export 이후 샤드에 추가된 레코드만 Parquet으로 내보내기 (증분 로딩)
+    python scripts/compact_dpo_data.py --repo-path ./dpo-data-full --no-compact --parquet new.parquet --since-manifest last_manifest.json
+
+--repo-path는 전체 작업 트리가 있는 클론이어야 합니다. API 서버가 쓰는 DPO_REPO_LOCAL_PATH는 기본적으로
+sparse checkout 작업 공간이라 data/의 기존 파일이 작업 트리에 없으므로, 그대로 compaction하면 데이터가 사라진 것처럼 보입니다.
+sparse checkout 저장소에서는 실행을 거부하므로 별도로 전체 클론한 뒤 사용하세요:
+
+    git clone https://github.com/sblabkribb/labnote-dpo-trainer.git ./dpo-data-full
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import logging
+from pathlib import Path
+
+# 프로젝트 루트의 모듈을 가져오기 위해 경로 추가
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+import dpo_dataset
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def is_sparse_checkout(repo_path: str) -> bool:
+    """repo_path가 git 저장소이고 core.sparseCheckout이 켜져 있으면 True."""
+    import git
+    try:
+        repo = git.Repo(repo_path)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        return False
+    return bool(repo.config_reader().get_value("core", "sparseCheckout", False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the DPO data repository into date-sharded JSONL and export Parquet.")
+    parser.add_argument("--repo-path", type=str, required=True,
+                        help="Full (non-sparse) clone of the DPO data repository. Not the server's DPO_REPO_LOCAL_PATH workspace.")
+    parser.add_argument("--near-threshold", type=float, default=95.0,
+                        help="Similarity (0-100) of 'chosen' above which pairs with the same prompt are near-duplicates. 100 disables.")
+    parser.add_argument("--no-compact", action="store_true", help="Skip compaction (export only).")
+    parser.add_argument("--keep-legacy", action="store_true", help="Keep the per-record JSON files after compaction.")
+    parser.add_argument("--parquet", type=str, default=None, help="Write a Parquet file for training (requires pyarrow).")
+    parser.add_argument("--since-manifest", type=str, default=None,
+                        help="Previously exported manifest; only records appended since then are exported. Updated after export.")
+    parser.add_argument("--commit", action="store_true", help="Commit and push the compacted data/ directory.")
+    args = parser.parse_args()
+
+    if is_sparse_checkout(args.repo_path):
+        logger.error(f"'{args.repo_path}' is a sparse checkout (such as the server's DPO_REPO_LOCAL_PATH workspace), so data/ is "
+                     f"incomplete. Run this tool on a full clone of the DPO data repository instead.")
+        sys.exit(1)
+
+    data_dir = Path(args.repo_path) / "data"
+    if not data_dir.is_dir():
+        logger.error(f"'{data_dir}' does not exist.")
+        sys.exit(1)
+
+    if not args.no_compact:
+        stats = dpo_dataset.compact(data_dir, near_threshold=args.near_threshold, delete_legacy=not args.keep_legacy)
+        logger.info(f"Compaction: {json.dumps(stats)}")
+        if args.commit:
+            import git
+            repo = git.Repo(args.repo_path)
+            repo.git.add("--all", "data")
+            repo.index.commit(f"chore: Compact DPO data into {stats['shards']} shards ({stats['output']} records, "
+                              f"{stats['exact_duplicates']} exact / {stats['near_duplicates']} near duplicates removed)")
+            repo.remote(name="origin").push().raise_if_error()
+            logger.info("Pushed compacted DPO data.")
+
+    if args.parquet:
+        manifest = dpo_dataset.load_manifest(data_dir)
+        shard_offsets = None
+        if args.since_manifest and os.path.exists(args.since_manifest):
+            with open(args.since_manifest, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+            shard_offsets = dpo_dataset.export_offsets(previous, manifest)
+            if previous.get("generation") != manifest.get("generation"):
+                logger.warning("Shards were rewritten by compaction since the last export; exporting everything. "
+                               "Replace the previous Parquet files instead of adding this one.")
+            logger.info(f"{len(shard_offsets)} of {len(manifest['shards'])} shards changed since the last export.")
+        rows = dpo_dataset.export_parquet(data_dir, args.parquet, shard_offsets)
+        logger.info(f"Exported {rows} preference pairs to '{args.parquet}'.")
+        if args.since_manifest:
+            shutil.copyfile(data_dir / dpo_dataset.MANIFEST_FILE, args.since_manifest)
+
+
+if __name__ == "__main__":
+    main()
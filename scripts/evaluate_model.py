@@ -1,9 +1,10 @@
 import os
 import json
+import time
 import asyncio
 import argparse
 import logging
-from typing import List, Dict
+from typing import Any, Awaitable, Callable, List, Dict, Optional
 from dotenv import load_dotenv
 import re
 import sqlite3
@@ -13,7 +14,8 @@ import datetime
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from llm_utils import call_llm_api
+from llm_utils import call_llm_api, parse_model_map
+from feedback_db import EVALUATIONS_TABLE_SQL
 
 # --- 초기 설정 ---
 load_dotenv(dotenv_path='../.env')
@@ -26,23 +28,7 @@ DB_PATH = os.getenv("EVALUATION_DB_PATH", "evaluation_results.db")
 def init_db():
     """SQLite 데이터베이스를 초기화하고 evaluations 테이블을 생성합니다."""
     with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS evaluations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                model_a_name TEXT NOT NULL,
-                model_b_name TEXT NOT NULL,
-                judge_model_name TEXT NOT NULL,
-                total_prompts INTEGER NOT NULL,
-                win_count_b INTEGER NOT NULL,
-                loss_count_b INTEGER NOT NULL,
-                tie_count INTEGER NOT NULL,
-                error_count INTEGER NOT NULL,
-                win_rate_b REAL NOT NULL,
-                evaluation_log_path TEXT
-            )
-        """)
+        conn.execute(EVALUATIONS_TABLE_SQL)
         logger.info(f"Database initialized at '{DB_PATH}'")
 
 def save_evaluation_to_db(summary: Dict):
@@ -108,7 +94,114 @@ async def evaluate_pair(prompt: str, response_a: str, response_b: str, judge_mod
         logger.error(f"Failed to parse judge's response. Error: {e}. Response: {evaluation_str}")
         return {"winner": "Error", "justification": f"Parsing failed: {e}"}
 
-async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_dataset_path: str, output_log_path: str):
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class EvaluationEngine:
+    """
+    프롬프트 간에 응답 생성과 채점을 파이프라이닝하는 평가 엔진.
+    - 모델별 세마포어로 동시 호출 수를 제한합니다. 같은 모델이 여러 역할(예: 베이스라인과 심판)을 맡으면 한도를 공유합니다.
+    - 한 프롬프트의 두 응답이 준비되는 즉시 채점하므로, 심판 모델이 채점하는 동안에도 다음 프롬프트들의 응답 생성이 계속됩니다.
+    - 결과는 끝나는 순서대로 JSONL에 바로 기록하고(중단 시 보존), 반환값은 데이터셋 순서로 정렬하여 순차 실행과 같은 로그를 만듭니다.
+    """
+
+    STAGES = ("model_a", "model_b", "judge", "prompt")
+
+    def __init__(self, model_a: str, model_b: str, judge_model: str, default_concurrency: int = 2,
+                 model_concurrency: Optional[Dict[str, float]] = None):
+        self.model_a = model_a
+        self.model_b = model_b
+        self.judge_model = judge_model
+        self.default_concurrency = default_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.latencies: Dict[str, List[float]] = {stage: [] for stage in self.STAGES}
+        self.elapsed_s = 0.0
+
+    def _semaphore(self, model_name: str) -> asyncio.Semaphore:
+        if model_name not in self._semaphores:
+            limit = int(self.model_concurrency.get(model_name, self.default_concurrency))
+            self._semaphores[model_name] = asyncio.Semaphore(max(1, limit))
+        return self._semaphores[model_name]
+
+    async def _run_stage(self, stage: str, model_name: str, call: Callable[[], Awaitable[Any]]):
+        async with self._semaphore(model_name):
+            started = time.perf_counter()
+            try:
+                return await call()
+            finally:
+                self.latencies[stage].append(time.perf_counter() - started)
+
+    async def evaluate_prompt(self, prompt: str) -> Dict:
+        started = time.perf_counter()
+        response_a, response_b = await asyncio.gather(
+            self._run_stage("model_a", self.model_a, lambda: get_model_response(prompt, self.model_a)),
+            self._run_stage("model_b", self.model_b, lambda: get_model_response(prompt, self.model_b)),
+        )
+        evaluation = await self._run_stage(
+            "judge", self.judge_model, lambda: evaluate_pair(prompt, response_a, response_b, self.judge_model))
+        self.latencies["prompt"].append(time.perf_counter() - started)
+        return {
+            "prompt": prompt,
+            "model_a_response": response_a,
+            "model_b_response": response_b,
+            "evaluation": evaluation
+        }
+
+    async def run(self, eval_data: List[Dict], partial_log_path: Optional[str] = None) -> List[Dict]:
+        results: List[Optional[Dict]] = [None] * len(eval_data)
+        partial_log = open(partial_log_path, 'w', encoding='utf-8') if partial_log_path else None
+        started = time.perf_counter()
+        completed = 0
+
+        async def run_one(index: int, prompt: str):
+            nonlocal completed
+            try:
+                result_entry = await self.evaluate_prompt(prompt)
+            except Exception as e:
+                logger.error(f"Evaluation of prompt {index + 1} failed: {e}", exc_info=True)
+                result_entry = {"prompt": prompt, "model_a_response": "", "model_b_response": "",
+                                "evaluation": {"winner": "Error", "justification": f"Evaluation failed: {e}"}}
+            results[index] = result_entry
+            completed += 1
+            if partial_log:
+                partial_log.write(json.dumps({"index": index, **result_entry}, ensure_ascii=False) + "\n")
+                partial_log.flush()
+            evaluation = result_entry["evaluation"]
+            logger.info(f"--- Evaluated prompt {index + 1}/{len(eval_data)} ({completed} done) -> "
+                        f"Winner: {evaluation.get('winner', 'Error')}. Justification: {evaluation.get('justification', 'N/A')}")
+
+        try:
+            await asyncio.gather(*(run_one(index, item["prompt"]) for index, item in enumerate(eval_data)))
+        finally:
+            self.elapsed_s = time.perf_counter() - started
+            if partial_log:
+                partial_log.close()
+        return results
+
+    def report(self) -> Dict:
+        """처리량(prompts/min)과 단계별 지연 시간(평균, p50, p90, 초)."""
+        completed = len(self.latencies["prompt"])
+        stages = {}
+        for stage, values in self.latencies.items():
+            ordered = sorted(values)
+            stages[stage] = {
+                "count": len(ordered),
+                "mean_s": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+                "p50_s": round(_percentile(ordered, 0.5), 3),
+                "p90_s": round(_percentile(ordered, 0.9), 3),
+            }
+        return {
+            "prompts": completed,
+            "elapsed_s": round(self.elapsed_s, 2),
+            "prompts_per_min": round(completed / self.elapsed_s * 60, 2) if self.elapsed_s > 0 else 0.0,
+            "stages": stages,
+        }
+
+async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_dataset_path: str, output_log_path: str,
+                         concurrency: int = 2, model_concurrency: Optional[Dict[str, float]] = None):
     """
     모델 성능 평가 파이프라인을 실행하는 메인 함수.
     """
@@ -117,6 +210,7 @@ async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_data
     logger.info(f"  - Model B (Candidate): {model_b}")
     logger.info(f"  - Judge Model: {judge_model}")
     logger.info(f"  - Evaluation Dataset: {eval_dataset_path}")
+    logger.info(f"  - Concurrency per model: {concurrency} (overrides: {model_concurrency or {}})")
 
     # 1. 평가 데이터셋 로드
     try:
@@ -128,35 +222,20 @@ async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_data
         logger.error(f"❌ Failed to load or parse evaluation dataset: {e}")
         return
 
-    # 2. 각 프롬프트에 대해 평가 실행
-    results = []
-    scores = {"Model A": 0, "Model B": 0, "Tie": 0, "Error": 0}
-
-    for i, item in enumerate(eval_data):
-        prompt = item["prompt"]
-        logger.info(f"--- Evaluating prompt {i+1}/{len(eval_data)} ---")
-        
-        # 두 모델의 응답을 동시에 생성
-        response_a, response_b = await asyncio.gather(
-            get_model_response(prompt, model_a),
-            get_model_response(prompt, model_b)
-        )
+    # 2. 프롬프트들을 동시에 평가 (모델별 동시 호출 수 제한, 끝난 결과는 partial 로그에 바로 기록)
+    engine = EvaluationEngine(model_a, model_b, judge_model, concurrency, model_concurrency)
+    partial_log_path = f"{output_log_path}.partial.jsonl"
+    results = await engine.run(eval_data, partial_log_path)
 
-        # 심판의 평가 받기
-        evaluation = await evaluate_pair(prompt, response_a, response_b, judge_model)
-        
-        winner = evaluation.get("winner", "Error")
+    scores = {"Model A": 0, "Model B": 0, "Tie": 0, "Error": 0}
+    for result_entry in results:
+        winner = result_entry["evaluation"].get("winner", "Error")
         scores[winner] = scores.get(winner, 0) + 1
-            
-        result_entry = {
-            "prompt": prompt,
-            "model_a_response": response_a,
-            "model_b_response": response_b,
-            "evaluation": evaluation
-        }
-        results.append(result_entry)
-        
-        logger.info(f"  -> Winner: {winner}. Justification: {evaluation.get('justification', 'N/A')}")
+
+    report = engine.report()
+    logger.info(f"⏱️ Throughput: {report['prompts_per_min']} prompts/min ({report['prompts']} prompts in {report['elapsed_s']}s)")
+    for stage, stats in report["stages"].items():
+        logger.info(f"  - {stage}: mean {stats['mean_s']}s, p50 {stats['p50_s']}s, p90 {stats['p90_s']}s ({stats['count']} calls)")
 
     # 3. 결과 요약 및 출력
     total_comparisons = len(eval_data)
@@ -178,6 +257,7 @@ async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_data
         with open(output_log_path, 'w', encoding='utf-8') as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
         logger.info(f"✅ Detailed evaluation log saved to '{output_log_path}'")
+        os.remove(partial_log_path)
     except IOError as e:
         logger.error(f"❌ Failed to save evaluation log: {e}")
 
@@ -196,6 +276,7 @@ async def run_evaluation(model_a: str, model_b: str, judge_model: str, eval_data
         "evaluation_log_path": output_log_path
     }
     save_evaluation_to_db(summary_data)
+    return report
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate DPO model performance using a judge LLM.")
@@ -204,6 +285,9 @@ if __name__ == "__main__":
     parser.add_argument("--judge-model", type=str, default="llama3:70b", help="Name of the judge model.")
     parser.add_argument("--dataset", type=str, default="evaluation_dataset.json", help="Path to the evaluation dataset JSON file.")
     parser.add_argument("--output-log", type=str, default="evaluation_log.json", help="Path to save the detailed evaluation log JSON file.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Maximum concurrent calls per model.")
+    parser.add_argument("--model-concurrency", type=str, default="",
+                        help='Per-model overrides of --concurrency, e.g. "llama3:70b=1,biollama3=4".')
     
     args = parser.parse_args()
 
@@ -216,5 +300,7 @@ if __name__ == "__main__":
         model_b=args.model_b,
         judge_model=args.judge_model,
         eval_dataset_path=args.dataset,
-        output_log_path=args.output_log
+        output_log_path=args.output_log,
+        concurrency=args.concurrency,
+        model_concurrency=parse_model_map(args.model_concurrency)
     ))
\ No newline at end of file
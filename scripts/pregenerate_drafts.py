@@ -0,0 +1,160 @@
+"""
+자주 쓰이는 (워크플로, 단위 공정, 섹션) 조합의 초안을 오프피크에 미리 생성하여 draft_store에 저장하는 배치 도구.
+/populate_note는 같은 조합의 초안이 있으면 70b 채점을 기다리지 않고 바로 시작 옵션으로 돌려줍니다.
+
+    # 22시~6시 사이에만 새 조합을 시작하고, 창이 끝나면 진행 중인 조합을 마치고 종료 (다음 실행에서 이어서 진행)
+    python scripts/pregenerate_drafts.py --off-peak 22-6 --concurrency 2
+
+    # 일부 워크플로/섹션만, 이번 실행에서는 최대 100개 조합까지
+    python scripts/pregenerate_drafts.py --workflows WB030,WB040 --sections Method --limit 100
+
+조합 하나가 끝날 때마다 SOP 인덱스 버전을 키에 포함해 바로 저장하므로, 중단 후 다시 실행하면 남은 조합부터 이어서 생성합니다.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import datetime
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 프로젝트 루트의 모듈을 가져오기 위해 경로 추가
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+
+import rag_pipeline as rag_module
+from agents import arun_agent_team, get_cascade_policy, select_judge_model
+from draft_store import DEFAULT_SECTIONS, DraftStore, pregeneration_query
+from llm_utils import get_ollama_pool, get_residency_manager
+from main import ALL_UOS_DATA, ALL_WORKFLOWS_DATA, create_unit_operation_template
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+Combination = Tuple[str, str, str]  # (workflow_id, uo_id, section)
+
+
+def build_combinations(workflow_ids: Iterable[str], uo_ids: Iterable[str], sections: Iterable[str]) -> List[Combination]:
+    """워크플로 × UO × 섹션 조합. 같은 UO의 섹션들이 이어지도록 섹션을 가장 안쪽에 둡니다."""
+    uo_ids, sections = list(uo_ids), list(sections)
+    return [(workflow_id, uo_id, section) for workflow_id in workflow_ids for uo_id in uo_ids for section in sections]
+
+
+def parse_off_peak(window: Optional[str]) -> Callable[[], bool]:
+    """'22-6' 형식(시작 시-끝 시, 로컬 시간)의 오프피크 창을 현재 시각이 창 안인지 확인하는 함수로 바꿉니다."""
+    if not window:
+        return lambda: True
+    start, end = (int(part) for part in window.split("-"))
+
+    def in_window() -> bool:
+        hour = datetime.datetime.now().hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    return in_window
+
+
+async def pregenerate(store: DraftStore, sop_version: str, combinations: List[Combination], concurrency: int = 2,
+                      in_window: Callable[[], bool] = lambda: True, limit: Optional[int] = None,
+                      run_agent: Callable[[str, str, str], Awaitable[Dict]] = arun_agent_team) -> Dict:
+    """
+    저장되지 않은 조합만 concurrency개씩 동시에 생성합니다. 오프피크 창을 벗어나면 새 조합을 시작하지 않습니다.
+    Supervisor 평가를 통과한 옵션이 있는 조합만 저장하고, 실패한 조합은 다음 실행에서 다시 시도합니다.
+    """
+    completed = store.completed_keys(sop_version)
+    remaining = [combination for combination in combinations if combination not in completed]
+    pending = remaining[:limit] if limit is not None else remaining
+    stats = {"total": len(combinations), "already_done": len(combinations) - len(remaining),
+             "succeeded": 0, "failed": 0, "skipped": 0, "stopped_by_window": False}
+    logger.info(f"Pre-generating {len(pending)} of {len(combinations)} combinations for SOP index {sop_version} "
+                f"({stats['already_done']} already done, concurrency={concurrency}).")
+    iterator = iter(pending)
+    started = time.monotonic()
+
+    async def consume():
+        for workflow_id, uo_id, section in iterator:
+            if not in_window():
+                stats["stopped_by_window"] = True
+                return
+            query = pregeneration_query(workflow_id, ALL_WORKFLOWS_DATA.get(workflow_id, ""))
+            uo_block = create_unit_operation_template(uo_id, ALL_UOS_DATA.get(uo_id, "Unknown Operation"), "AI Assistant")
+            try:
+                result = await run_agent(query, uo_block, section)
+            except Exception as e:
+                logger.error(f"Failed to pre-generate {workflow_id}/{uo_id}/{section}: {e}", exc_info=True)
+                stats["failed"] += 1
+                continue
+            options = (result or {}).get("options") or []
+            if not options or result.get("uo_id") != uo_id:
+                stats["skipped"] += 1
+                continue
+            await asyncio.to_thread(store.put, sop_version, workflow_id, uo_id, section, query, options)
+            stats["succeeded"] += 1
+            done = stats["succeeded"] + stats["failed"] + stats["skipped"]
+            if done % 10 == 0:
+                elapsed = time.monotonic() - started
+                logger.info(f"Progress: {done}/{len(pending)} ({done / elapsed * 3600:.0f} combinations/hour).")
+
+    await asyncio.gather(*[consume() for _ in range(max(1, concurrency))])
+    stats["elapsed_s"] = round(time.monotonic() - started, 1)
+    if stats["stopped_by_window"]:
+        logger.info("Off-peak window ended; stopping. Run again to resume from the checkpoint.")
+    return stats
+
+
+def _select(all_ids: Iterable[str], selected: Optional[str]) -> List[str]:
+    if not selected:
+        return list(all_ids)
+    wanted = [item.strip() for item in selected.split(",") if item.strip()]
+    unknown = [item for item in wanted if item not in all_ids]
+    if unknown:
+        raise SystemExit(f"Unknown IDs: {', '.join(unknown)}")
+    return wanted
+
+
+async def main_async(args):
+    logger.info("Initializing RAG pipeline...")
+    rag_module.rag_pipeline = rag_module.RAGPipeline()
+    sop_version = rag_module.get_sop_index_version()
+    store = DraftStore(args.db_path)
+    if args.prune:
+        logger.info(f"Deleted {store.delete_other_versions(sop_version)} drafts from previous SOP index versions.")
+
+    sections = [section.strip() for section in args.sections.split(",")] if args.sections else list(DEFAULT_SECTIONS)
+    combinations = build_combinations(_select(ALL_WORKFLOWS_DATA, args.workflows), _select(ALL_UOS_DATA, args.uos), sections)
+    # 배치 동안 캐스케이드 모델과 채점 모델을 상주시킵니다.
+    get_residency_manager().note_burst(sorted({model for section in sections for model in get_cascade_policy(section)["tiers"][0]})
+                                       + [select_judge_model()])
+    pool_refresh_task = asyncio.create_task(get_ollama_pool().run_refresh_loop(float(os.getenv("OLLAMA_POOL_REFRESH_SECONDS", "15"))))
+    try:
+        stats = await pregenerate(store, sop_version, combinations, concurrency=args.concurrency,
+                                  in_window=parse_off_peak(args.off_peak), limit=args.limit)
+    finally:
+        pool_refresh_task.cancel()
+        store.close()
+    logger.info(f"Pre-generation finished: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate judged drafts for workflow x unit operation x section combinations.")
+    parser.add_argument("--db-path", type=str, default=os.getenv("DRAFT_STORE_PATH", "./.cache/pregenerated_drafts.db"),
+                        help="SQLite file shared with the API server (DRAFT_STORE_PATH).")
+    parser.add_argument("--workflows", type=str, default=None, help="Comma-separated workflow IDs (default: all).")
+    parser.add_argument("--uos", type=str, default=None, help="Comma-separated unit operation IDs (default: all).")
+    parser.add_argument("--sections", type=str, default=None, help=f"Comma-separated sections (default: {','.join(DEFAULT_SECTIONS)}).")
+    parser.add_argument("--concurrency", type=int, default=2, help="Combinations generated at the same time.")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of new combinations in this run.")
+    parser.add_argument("--off-peak", type=str, default=None,
+                        help="Local-hour window such as 22-6. New combinations are only started inside the window.")
+    parser.add_argument("--prune", action="store_true", help="Delete drafts generated for other SOP index versions.")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        logger.info("Interrupted; completed combinations are saved and will be skipped on the next run.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import admission as admission_module
+from admission import AdmissionController, AdmissionRejected
+
+ENDPOINTS = {
+    "chat": {"priority": "interactive", "limit": 2, "latency_budget_s": 10.0, "service_time_s": 4.0},
+    "populate_note": {"priority": "batch", "limit": 2, "latency_budget_s": 100.0, "service_time_s": 40.0},
+}
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_overtake_batch_and_limits_are_per_endpoint():
+    """슬롯이 비면 먼저 온 batch 대기자보다 interactive 대기자가 먼저 받고, 엔드포인트 한도를 넘지 않는지 테스트"""
+    controller = AdmissionController(ENDPOINTS, total_slots=2)
+    await controller.acquire("populate_note")
+    await controller.acquire("populate_note")
+    order = []
+
+    async def wait_for(endpoint):
+        await controller.acquire(endpoint)
+        order.append(endpoint)
+
+    batch = asyncio.create_task(wait_for("populate_note"))
+    await asyncio.sleep(0)
+    chat = asyncio.create_task(wait_for("chat"))
+    await asyncio.sleep(0)
+    assert controller.snapshot()["queue_depth"] == 2
+
+    controller.release("populate_note", 40.0)
+    await asyncio.sleep(0)
+    assert order == ["chat"]
+    controller.release("populate_note", 40.0)
+    await batch
+    assert order == ["chat", "populate_note"]
+    assert controller.endpoints["populate_note"].in_flight == 1 and controller.in_flight == 2
+    await chat
+
+
+@pytest.mark.asyncio
+async def test_rejects_with_retry_after_when_backlog_exceeds_budget():
+    """예상 대기 시간이 지연 예산을 넘으면 큐에 넣지 않고 Retry-After와 함께 거절하는지 테스트"""
+    controller = AdmissionController(ENDPOINTS, total_slots=4)
+    for _ in range(2):
+        await controller.acquire("chat")
+    # 한도 2, 처리 시간 4초 → 대기자가 n명일 때 예상 대기 (n + 1) * 4 / 2초: 4명이면 10초로 예산 안, 5명이면 12초로 거절
+    waiters = [asyncio.create_task(controller.acquire("chat")) for _ in range(4)]
+    await asyncio.sleep(0)
+    assert controller.estimate_wait("chat") == pytest.approx(10.0)
+    waiters.append(asyncio.create_task(controller.acquire("chat")))
+    await asyncio.sleep(0)
+    assert controller.estimate_wait("chat") == pytest.approx(12.0)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await controller.acquire("chat")
+    assert excinfo.value.retry_after_s == 2 and excinfo.value.queue_depth == 5
+    assert controller.endpoints["chat"].rejected == 1
+    # 다른 엔드포인트는 자기 한도 안에서 바로 슬롯을 받습니다.
+    assert await controller.acquire("populate_note") == 0.0
+
+    for task in waiters:
+        task.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    snapshot = controller.snapshot()
+    assert snapshot["queue_depth"] == 0 and snapshot["endpoints"]["chat"]["queued"] == 0
+    controller.release("chat", 2.0)
+    assert controller.endpoints["chat"].service_time_s == pytest.approx(3.6)
+
+
+def test_busy_endpoint_returns_429_with_retry_after(client: TestClient):
+    """한도가 찬 엔드포인트는 429와 Retry-After를 돌려주고, 대기열 지표가 /api/llm_metrics에 노출되는지 테스트"""
+    controller = AdmissionController({**ENDPOINTS, "chat": {**ENDPOINTS["chat"], "latency_budget_s": 0.0}}, total_slots=4)
+    controller.endpoints["chat"].in_flight = controller.endpoints["chat"].limit
+    controller.in_flight = controller.endpoints["chat"].limit
+    with patch.object(admission_module, '_admission_controller', controller):
+        response = client.post("/chat", json={"query": "hello"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+        assert response.json()["endpoint"] == "chat"
+        assert client.post("/chat/stream", json={"query": "hello"}).status_code == 429
+
+        metrics = client.get("/api/llm_metrics").json()["admission"]
+        assert metrics["endpoints"]["chat"]["rejected"] == 2
+        assert metrics["endpoints"]["chat"]["in_flight"] == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_releases_slot_when_client_leaves_before_body():
+    """본문이 시작되기 전에 클라이언트가 끊어도 /chat/stream의 슬롯이 한 번만 반납되는지 테스트"""
+    import main
+    from main import ChatRequest, chat_stream
+
+    controller = AdmissionController(ENDPOINTS, total_slots=4)
+    stream_started = []
+
+    async def fake_stream_chat(*args, **kwargs):
+        stream_started.append(True)
+        yield "token"
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(30)  # 응답 헤더를 보내는 도중에 연결이 끊긴 느린 클라이언트
+
+    prepared = (None, "conv-1", {"role": "user", "content": "hello"}, [], "biollama3")
+    with patch.object(admission_module, '_admission_controller', controller), \
+            patch('main._prepare_chat_turn', return_value=prepared), \
+            patch('main.stream_chat', fake_stream_chat):
+        response = await chat_stream(ChatRequest(query="hello"), http_request=None)
+        assert controller.endpoints["chat"].in_flight == 1
+        scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+        await asyncio.wait_for(response(scope, receive, send), timeout=1)
+
+    assert not stream_started
+    assert controller.endpoints["chat"].in_flight == 0 and controller.in_flight == 0
@@ -0,0 +1,68 @@
+import json
+import pytest
+from unittest.mock import patch, MagicMock
+
+import agents
+from llm_utils import ModelCircuitBreakers
+from agents import run_agent_team
+
+UO_BLOCK = """### [UHW010 Liquid Handling]
+
+#### Input
+- DNA sample
+
+#### Consumables
+- (e.g. filter, well-plate, etc.)
+"""
+
+GOOD_DRAFT = "- 96-well PCR plate, 0.2 ml\n- Filter tips, 200 µl\n- Reservoir, 25 ml\n- Sealing film, 1 sheet\n- Tubes, 1.5 ml"
+POOR_DRAFT = "Use the usual consumables."
+
+
+def _run_with_drafts(draft_by_model, judge_score):
+    called_models = []
+
+    async def fake_llm(system_prompt, user_prompt, model_name):
+        called_models.append(model_name)
+        if "DRAFTS TO EVALUATE" in user_prompt:
+            return json.dumps([{"draft_index": 0, "model": "m", "score": judge_score, "justification": "ok"}])
+        return draft_by_model[model_name]
+
+    mock_rag = MagicMock()
+    mock_rag.retrieve_context.return_value = []
+    mock_rag.format_context_for_prompt.return_value = "No relevant context found in the SOPs."
+    with patch('agents.call_llm_api', side_effect=fake_llm), patch.object(agents.rag_module, 'rag_pipeline', mock_rag):
+        result = run_agent_team("PCR cleanup", UO_BLOCK, "Consumables")
+    return result, called_models
+
+
+def test_cascade_stops_at_cheapest_model_when_pre_score_passes():
+    """첫 단계 초안의 사전 점수가 기준을 넘으면 상위 모델을 호출하지 않는지 테스트"""
+    result, called_models = _run_with_drafts({"biollama3": GOOD_DRAFT, "mixtral": GOOD_DRAFT}, judge_score=9.0)
+
+    assert called_models == ["biollama3", agents.SCORING_MODEL]
+    assert len(result["options"]) == 1
+
+
+def test_cascade_escalates_when_pre_score_is_low():
+    """첫 단계 초안의 사전 점수가 낮으면 다음 단계 모델로 확장하고 확장률에 반영되는지 테스트"""
+    before = agents.get_cascade_metrics()["by_section"].get("Consumables", {"populated": 0, "escalation_rate": 0.0})
+    _, called_models = _run_with_drafts({"biollama3": POOR_DRAFT, "mixtral": GOOD_DRAFT}, judge_score=9.0)
+
+    assert called_models == ["biollama3", "mixtral", agents.SCORING_MODEL]
+    after = agents.get_cascade_metrics()["by_section"]["Consumables"]
+    assert after["populated"] == before["populated"] + 1
+    assert after["escalation_rate"] > 0
+
+
+def test_open_circuit_skips_draft_model_and_falls_back_to_another_judge():
+    """서킷 브레이커가 열린 초안 모델과 채점 모델을 건너뛰고 대체 채점 모델을 사용하는지 테스트"""
+    breakers = ModelCircuitBreakers(failure_threshold=1, reset_seconds=60)
+    for model in ("biollama3", agents.SCORING_MODEL):
+        breakers.record_failure(model, ConnectionError("connection refused"))
+
+    with patch('agents.get_circuit_breakers', return_value=breakers):
+        result, called_models = _run_with_drafts({"mixtral": GOOD_DRAFT}, judge_score=9.0)
+
+    assert called_models == ["mixtral", "mixtral"]
+    assert len(result["options"]) == 1
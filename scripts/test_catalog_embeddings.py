@@ -0,0 +1,95 @@
+import hashlib
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import catalog_embeddings as catalog_embeddings_module
+from catalog_embeddings import CatalogEmbeddingIndex
+
+CATALOGS = {
+    "unit_operation": {
+        "UHW010": "Liquid Handling (액체 분주)",
+        "UHW100": "Thermocycling (PCR 반응)",
+        "UHW250": "Nucleic Acid Purification (DNA 정제)",
+        "USW110": "Sequence Alignment (서열 정렬)",
+    },
+    "workflow": {
+        "WB150": "PCR-based Target Amplification (PCR 증폭)",
+        "WL010": "Sequence Variant Analysis (서열 변이 분석)",
+    },
+}
+
+
+class FakeEmbeddings:
+    """단어 해시 bag-of-words 벡터를 돌려주는 결정적인 임베딩 (호출 수를 기록)"""
+
+    model = "fake-embed"
+
+    def __init__(self):
+        self.document_calls = 0
+
+    @staticmethod
+    def _vector(text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.lower().replace("(", " ").replace(")", " ").replace(":", " ").split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.document_calls += 1
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return self._vector(text)
+
+
+def test_recommendation_ranking_and_workflow_rerank(tmp_path):
+    """목표와 가까운 UO가 먼저 오고, 워크플로를 지정하면 워크플로 유사도로 재순위하는지 테스트"""
+    index = CatalogEmbeddingIndex(FakeEmbeddings(), CATALOGS, cache_path=str(tmp_path / "catalog.npz")).build()
+    result = index.recommend(FakeEmbeddings._vector("pcr thermocycling"), limit=2)
+    assert len(result["unit_operations"]) == 2 and result["unit_operations"][0]["id"] == "UHW100"
+    assert result["workflows"][0]["id"] == "WB150"
+
+    query = FakeEmbeddings._vector("sequence purification")
+    plain = [item["id"] for item in index.recommend(query, limit=4)["unit_operations"]]
+    reranked = index.recommend(query, workflow_id="WL010", limit=4, workflow_weight=0.5)["unit_operations"]
+    assert reranked[0]["id"] == "USW110"
+    assert sorted(plain) == sorted(item["id"] for item in reranked)
+    assert all(a["score"] >= b["score"] for a, b in zip(reranked, reranked[1:]))
+
+
+def test_catalog_vectors_are_cached_on_disk(tmp_path):
+    """같은 모델·카탈로그면 디스크 캐시를 재사용하고, 카탈로그가 바뀌면 다시 임베딩하는지 테스트"""
+    cache_path = str(tmp_path / "catalog.npz")
+    first = FakeEmbeddings()
+    built = CatalogEmbeddingIndex(first, CATALOGS, cache_path=cache_path, model_name="m").build()
+    assert first.document_calls == 1
+
+    second = FakeEmbeddings()
+    loaded = CatalogEmbeddingIndex(second, CATALOGS, cache_path=cache_path, model_name="m").build()
+    assert second.document_calls == 0
+    np.testing.assert_allclose(loaded.uo_matrix, built.uo_matrix)
+
+    changed = {**CATALOGS, "unit_operation": {**CATALOGS["unit_operation"], "UHW400": "Manual (수동 작업)"}}
+    third = FakeEmbeddings()
+    CatalogEmbeddingIndex(third, changed, cache_path=cache_path, model_name="m").build()
+    assert third.document_calls == 1
+
+
+def test_recommend_endpoint_and_scaffold_without_uo_ids(client: TestClient, tmp_path):
+    """/recommend_unit_operations와, UO를 고르지 않은 /create_scaffold가 추천 UO로 노트를 만드는지 테스트"""
+    index = CatalogEmbeddingIndex(FakeEmbeddings(), CATALOGS, cache_path=str(tmp_path / "catalog.npz")).build()
+    with patch.object(catalog_embeddings_module, 'catalog_embedding_index', index):
+        response = client.post("/recommend_unit_operations", json={"query": "pcr thermocycling", "workflow_id": "WB150", "limit": 2})
+        assert response.status_code == 200
+        assert response.json()["unit_operations"][0]["id"] == "UHW100"
+        assert client.post("/recommend_unit_operations", json={"query": "pcr", "workflow_id": "WX999"}).status_code == 404
+
+        response = client.post("/create_scaffold", json={"query": "pcr thermocycling", "workflow_id": "WB150", "recommend_top_k": 2})
+        assert response.status_code == 200
+        workflow_file = next(content for name, content in response.json()["files"].items() if name != "README.md")
+        assert workflow_file.count("### [") == 2 and "### [UHW100 Thermocycling" in workflow_file
+
+    with patch.object(catalog_embeddings_module, 'catalog_embedding_index', None):
+        assert client.post("/recommend_unit_operations", json={"query": "pcr"}).status_code == 503
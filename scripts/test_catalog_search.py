@@ -0,0 +1,56 @@
+import json
+from fastapi.testclient import TestClient
+
+from catalog_search import CatalogSearchIndex, normalize
+
+CATALOGS = {
+    "workflow": {
+        "WB030": "DNA Assembly (여러 DNA 단편을 특정 순서로 조립하여 유전 구조물 제작)",
+        "WB050": "RNA Extraction (유전자 발현 분석 등을 위해 생물학적 샘플에서 RNA 분리)",
+    },
+    "unit_operation": {
+        "UHW010": "Liquid Handling (액체 시약의 정밀 분주, 희석, 혼합 등 기본 작업)",
+        "UHW020": "96 Channel Liquid Handling (96-웰 플랫폼에서의 고처리량 동시 액체 분주/전송)",
+        "USW110": "Sequence Alignment (서열 유사성 비교 및 상동 서열 식별)",
+    },
+}
+
+
+def test_prefix_typo_and_korean_matching():
+    """ID/단어 접두어, 오타, 한글 검색어가 모두 기대한 항목을 가장 먼저 찾는지 테스트"""
+    index = CatalogSearchIndex(CATALOGS)
+    assert normalize("  DNA-Assembly (조립) ") == "dna assembly 조립"
+
+    assert index.search("UHW010")[0] == {"id": "UHW010", "name": CATALOGS["unit_operation"]["UHW010"], "type": "unit_operation", "score": 100.0}
+    assert [item["id"] for item in index.search("uhw0")] == ["UHW010", "UHW020"]
+    assert index.search("dna assem")[0]["id"] == "WB030"
+    assert index.search("liqid handlng")[0]["id"] == "UHW010"
+    assert index.search("sequnce alignmnt")[0]["id"] == "USW110"
+    assert index.search("액체 분주")[0]["id"] == "UHW010"
+    assert index.search("rna", item_type="unit_operation") == []
+    assert index.search("!!") == []
+
+
+def test_search_catalog_endpoint(client: TestClient):
+    """/search_catalog가 전체 카탈로그에서 결과를 반환하고 잘못된 type은 400을 반환하는지 테스트"""
+    response = client.get("/search_catalog", params={"q": "liquid handlng", "limit": 3})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 3 and results[0]["id"] == "UHW010"
+
+    workflows = client.get("/search_catalog", params={"q": "pcr", "type": "workflow"}).json()["results"]
+    assert workflows and all(item["type"] == "workflow" for item in workflows)
+    assert client.get("/search_catalog", params={"q": "pcr", "type": "sop"}).status_code == 400
+
+
+def test_constants_etag_revalidation(client: TestClient):
+    """/constants가 미리 직렬화한 본문과 ETag를 반환하고, If-None-Match가 같으면 304를 반환하는지 테스트"""
+    response = client.get("/constants")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    data = json.loads(response.content)
+    assert data["ALL_UOS"]["UHW010"].startswith("Liquid Handling")
+
+    assert client.get("/constants", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/constants", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/constants", headers={"If-None-Match": '"stale"'}).status_code == 200
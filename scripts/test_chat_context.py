@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import patch
+
+from chat_context import ContextWindowManager, estimate_tokens
+from test_conversation_store import _make_store
+
+
+def _turns(count, start=0):
+    messages = []
+    for i in range(start, start + count):
+        messages += [{"role": "user", "content": f"질문 {i}: PCR 조건을 알려주세요."},
+                     {"role": "assistant", "content": f"답변 {i}: 95°C 30초, 55°C 30초, 72°C 1분으로 30 cycles 진행합니다."}]
+    return messages
+
+
+def test_window_keeps_recent_turns_and_summary_for_long_conversations():
+    """요약된 긴 대화는 시스템 프롬프트+요약과 최근 keep_turns 턴만 보내 프롬프트 크기가 일정한지 테스트"""
+    manager = ContextWindowManager(default_budget=4000, keep_turns=3)
+    user_message = {"role": "user", "content": "마지막 질문"}
+    sizes = []
+    for turns in (10, 100):
+        context = {"messages": _turns(turns), "first_index": 0, "summary": "이전 요약", "summarized": turns * 2 - 6}
+        messages = manager.build_messages("system", context, user_message, "biollama3")
+        sizes.append(sum(estimate_tokens(m["content"]) for m in messages))
+        assert "이전 요약" in messages[0]["content"]
+        assert messages[1] == context["messages"][-6]
+        assert len(messages) == 1 + 6 + 1
+    assert sizes[0] == sizes[1]
+
+
+def test_window_includes_unsummarized_turns_within_model_budget():
+    """요약이 따라잡지 못한 턴은 모델별 토큰 예산 안에서만 포함되고, 항상 user 메시지부터 시작하는지 테스트"""
+    manager = ContextWindowManager(default_budget=4000, model_budgets={"small": 120}, keep_turns=1)
+    context = {"messages": _turns(8), "first_index": 0, "summary": "", "summarized": 0}
+    user_message = {"role": "user", "content": "질문"}
+
+    large = manager.build_messages("system", context, user_message, "biollama3")
+    small = manager.build_messages("system", context, user_message, "small")
+    assert len(large) == 1 + 16 + 1
+    assert 1 + 2 <= len(small) < len(large)
+    assert small[1]["role"] == "user"
+    assert sum(estimate_tokens(m["content"]) for m in small) <= 120
+
+
+@pytest.mark.asyncio
+async def test_refresh_summary_folds_old_turns_into_store():
+    """최근 턴보다 오래된 메시지를 기존 요약에 합치고, 요약된 위치를 저장하는지 테스트"""
+    store = _make_store()
+    await store.append("c1", _turns(5))
+    manager = ContextWindowManager(keep_turns=2)
+    prompts = []
+
+    async def fake_llm(system_prompt, user_prompt, model_name):
+        prompts.append(user_prompt)
+        return "요약: PCR 조건 논의"
+
+    with patch('chat_context.call_llm_api', side_effect=fake_llm):
+        await manager.refresh_summary(store, "c1", "biollama3")
+        await manager.refresh_summary(store, "c1", "biollama3")  # 새로 접을 메시지가 없으면 호출하지 않음
+
+    context = await store.load_context("c1")
+    assert context["summary"] == "요약: PCR 조건 논의"
+    assert context["summarized"] == 6
+    assert len(prompts) == 1 and "질문 2" in prompts[0] and "질문 3" not in prompts[0]
+    assert await store.acquire_summary_lock("c1")  # 요약 후 잠금이 해제됨
@@ -0,0 +1,186 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import conversation_store as conversation_module
+from conversation_store import ConversationStore
+
+
+class FakeAsyncRedis:
+    """ConversationStore가 사용하는 리스트/해시 명령만 흉내 내는 인메모리 Redis"""
+
+    def __init__(self):
+        self.lists = {}
+        self.hashes = {}
+        self.strings = {}
+        self.ttls = {}
+
+    def _lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def _rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    def _ltrim(self, key, start, end):
+        self.lists[key] = self._lrange(key, start, end)
+
+    def _hincrby(self, key, field, amount):
+        value = int(self.hashes.setdefault(key, {}).get(field, 0)) + amount
+        self.hashes[key][field] = str(value)
+        return value
+
+    def _hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def _hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def _expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    async def exists(self, key):
+        return int(key in self.lists)
+
+    async def lrange(self, key, start, end):
+        return self._lrange(key, start, end)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    async def delete(self, key):
+        self.ttls.pop(key, None)
+        found = [store.pop(key, None) is not None for store in (self.lists, self.hashes, self.strings)]
+        return int(any(found))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        operation = getattr(self.redis, f"_{name}")
+        return lambda *args, **kwargs: self.commands.append(lambda: operation(*args, **kwargs))
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+def _make_store(**kwargs) -> ConversationStore:
+    store = ConversationStore(redis_pool=None, **kwargs)
+    store.client = FakeAsyncRedis()
+    return store
+
+
+@pytest.mark.asyncio
+async def test_store_keeps_only_recent_messages_with_ttl():
+    """메시지가 packed 형식으로 저장되고, 상한을 넘으면 오래된 메시지부터 잘리며 TTL이 갱신되는지 테스트"""
+    store = _make_store(ttl_seconds=3600, max_messages=4)
+    for i in range(3):
+        await store.append("c1", [{"role": "user", "content": f"질문 {i}"}, {"role": "assistant", "content": f"답변 {i}"}])
+
+    raw = store.client.lists["chat:conv:c1"]
+    assert json.loads(raw[0]) == ["u", "질문 1"]
+    assert await store.load("c1") == [
+        {"role": "user", "content": "질문 1"}, {"role": "assistant", "content": "답변 1"},
+        {"role": "user", "content": "질문 2"}, {"role": "assistant", "content": "답변 2"},
+    ]
+    assert store.client.ttls["chat:conv:c1"] == 3600
+    assert await store.delete("c1")
+    assert not await store.exists("c1")
+
+
+def test_chat_persists_turns_in_store(client: TestClient):
+    """/chat이 대화 기록을 저장소에서 읽고, 성공한 턴만 저장소에 추가하는지 테스트"""
+    store = _make_store()
+    sent_messages = []
+
+    class FakeClient:
+        async def chat(self, model, messages, **kwargs):
+            sent_messages.append(messages)
+            return {"message": {"content": f"답변 {len(sent_messages)}"}}
+
+    with patch.object(conversation_module, 'conversation_store', store), \
+         patch('llm_utils.ollama.AsyncClient', return_value=FakeClient()):
+        first = client.post("/chat", json={"query": "안녕하세요"}).json()
+        second = client.post("/chat", json={"query": "다음 질문", "conversation_id": first["conversation_id"]}).json()
+        unknown = client.post("/chat", json={"query": "새 대화", "conversation_id": "expired-id"}).json()
+
+    assert second["conversation_id"] == first["conversation_id"]
+    assert [m["role"] for m in sent_messages[1]] == ["system", "user", "assistant", "user"]
+    assert unknown["conversation_id"] != "expired-id"
+    assert len(store.client.lists[f"chat:conv:{first['conversation_id']}"]) == 4
+
+
+class FakeStreamingClient:
+    def __init__(self, tokens, state):
+        self.tokens = tokens
+        self.state = state
+
+    async def chat(self, model, messages, stream=False, **kwargs):
+        async def parts():
+            try:
+                for i, token in enumerate(self.tokens):
+                    self.state["produced"] += 1
+                    yield {"message": {"content": token}, "done": i == len(self.tokens) - 1}
+            finally:
+                self.state["closed"] = True
+        return parts()
+
+
+def test_chat_stream_sends_sse_tokens_and_persists_on_completion(client: TestClient):
+    """/chat/stream이 토큰을 SSE로 보내고, 완료된 답변을 대화 기록에 저장하는지 테스트"""
+    store = _make_store()
+    state = {"produced": 0, "closed": False}
+    with patch.object(conversation_module, 'conversation_store', store), \
+         patch('llm_utils.ollama.AsyncClient', return_value=FakeStreamingClient(["안녕", "하세요", "!"], state)):
+        response = client.post("/chat/stream", json={"query": "인사해 주세요"})
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    assert events[0].startswith("event: meta")
+    tokens = [json.loads(e[len("data: "):])["token"] for e in events if e.startswith("data: ")]
+    assert tokens == ["안녕", "하세요", "!"]
+    assert events[-1].startswith("event: done")
+    conversation_id = json.loads(events[0].split("data: ", 1)[1])["conversation_id"]
+    assert store.client.lists[f"chat:conv:{conversation_id}"][-1] == '["a","안녕하세요!"]'
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_cancels_upstream_on_client_disconnect():
+    """클라이언트 연결이 끊기면 업스트림 생성을 중단하고, 미완성 답변은 저장하지 않는지 테스트"""
+    import main
+    store = _make_store()
+    state = {"produced": 0, "closed": False}
+
+    class DisconnectingRequest:
+        def __init__(self):
+            self.checks = 0
+
+        async def is_disconnected(self):
+            self.checks += 1
+            return self.checks > 2
+
+    with patch.object(conversation_module, 'conversation_store', store), \
+         patch('llm_utils.ollama.AsyncClient', return_value=FakeStreamingClient([f"t{i}" for i in range(100)], state)):
+        response = await main.chat_stream(main.ChatRequest(query="길게 답해 주세요"), DisconnectingRequest())
+        events = [event async for event in response.body_iterator]
+
+    assert len(events) == 1 + 2
+    assert state["closed"]
+    assert state["produced"] < 100
+    assert store.client.lists == {}
@@ -0,0 +1,72 @@
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import document_cache as document_cache_module
+from agents import find_uo_block
+from document_cache import DocumentCache, DocumentNotCached, content_hash
+
+DOCUMENT = (
+    "# Workflow\n\n"
+    "### [UHW010 Liquid Handling]\n#### Method\n(method)\n\n"
+    "### [UHW100 Thermocycling]\n#### Method\n(method)\n"
+)
+
+
+def test_resolve_full_hash_only_and_block_delta():
+    """전체 업로드 → 해시만 → 바뀐 블록만 보낸 경우 모두 전체 업로드와 같은 블록을 찾고, 갱신된 문서가 새 해시로 캐시되는지 테스트"""
+    cache = DocumentCache()
+    block, document = cache.resolve("UHW100", file_content=DOCUMENT)
+    document_hash = document.hash
+    assert block == find_uo_block(DOCUMENT, "UHW100") and document_hash == content_hash(DOCUMENT)
+    assert cache.resolve("UHW010", document_hash=document_hash) == (find_uo_block(DOCUMENT, "UHW010"), document)
+
+    edited_block = "### [UHW010 Liquid Handling]\n#### Method\n- Pipette 10 uL\n\n"
+    edited = DOCUMENT.replace(find_uo_block(DOCUMENT, "UHW010"), edited_block)
+    block, edited_document = cache.resolve("UHW010", document_hash=document_hash, uo_block=edited_block)
+    edited_hash = edited_document.hash
+    assert block == edited_block and edited_hash == content_hash(edited)
+    # 갱신된 문서는 해시만으로 다른 UO 블록도 찾을 수 있습니다.
+    assert cache.resolve("UHW100", document_hash=edited_hash)[0] == find_uo_block(edited, "UHW100")
+
+    # 기준 문서가 없어도 블록만으로 처리하고, 해시만 보낸 경우는 DocumentNotCached
+    assert cache.resolve("UHW010", document_hash="unknown", uo_block=edited_block) == (edited_block, None)
+    try:
+        cache.resolve("UHW010", document_hash="unknown")
+        assert False, "expected DocumentNotCached"
+    except DocumentNotCached as e:
+        assert e.document_hash == "unknown"
+    assert cache.snapshot()["misses"] == 2
+
+
+def test_lru_evicts_by_entry_count_and_size():
+    """문서 수와 전체 크기 한도를 넘으면 가장 오래 쓰지 않은 문서부터 내보내는지 테스트"""
+    cache = DocumentCache(max_entries=2, max_chars=30)
+    first, second = cache.add_text("a" * 10), cache.add_text("b" * 10)
+    assert cache.get(first.hash) is first  # first를 최근 사용으로 갱신
+    cache.add_text("c" * 10)
+    assert cache.get(second.hash) is None and cache.get(first.hash) is first
+    cache.add_text("d" * 25)
+    assert cache.snapshot()["documents"] == 1 and cache.snapshot()["chars"] == 25
+    cache.add_text("e" * 31)  # 한도보다 큰 문서는 캐시하지 않음
+    assert cache.snapshot()["documents"] == 1
+
+
+def test_populate_note_accepts_hash_and_returns_409_on_miss(client: TestClient):
+    """/populate_note가 해시만 보낸 요청을 캐시로 처리하고, 캐시에 없으면 409로 전체 업로드를 요청하는지 테스트"""
+    agent_result = {"uo_id": "UHW100", "section": "Method", "options": ["a"]}
+    request = {"uo_id": "UHW100", "section": "Method", "query": "PCR"}
+    with patch.object(document_cache_module, '_document_cache', DocumentCache()), \
+            patch('main.run_agent_team', return_value=agent_result) as run_agent_team, \
+            patch('main.get_residency_manager'):
+        response = client.post("/populate_note", json={**request, "content_hash": content_hash(DOCUMENT)})
+        assert response.status_code == 409
+        assert response.json()["error"] == "document_not_cached"
+
+        response = client.post("/populate_note", json={**request, "file_content": DOCUMENT})
+        assert response.status_code == 200 and response.headers["X-Content-Hash"] == content_hash(DOCUMENT)
+        response = client.post("/populate_note", json={**request, "content_hash": content_hash(DOCUMENT)})
+        assert response.json() == {**agent_result, "pregenerated": False}
+        assert run_agent_team.call_args.args == ("PCR", find_uo_block(DOCUMENT, "UHW100"), "Method")
+
+        assert client.post("/populate_note", json=request).status_code == 422
+        assert client.post("/populate_note", json={**request, "uo_id": "UHW999", "file_content": DOCUMENT}).status_code == 404
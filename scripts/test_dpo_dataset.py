@@ -0,0 +1,90 @@
+import json
+import pytest
+from unittest.mock import patch
+
+import dpo_dataset
+
+
+def _record(prompt, chosen, timestamp, rejected=("AI suggestion",)):
+    return {"prompt": prompt, "chosen": chosen, "rejected": list(rejected),
+            "metadata": {"timestamp_utc": timestamp, "unit_operation_id": "UHW010", "section": "Method"}}
+
+
+def test_compact_merges_legacy_files_into_deduplicated_shards(tmp_path):
+    """개별 JSON 파일을 날짜별 샤드로 합치면서 완전 중복과 근사 중복 쌍을 제거하는지 테스트"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    legacy = [
+        _record("Write Method for PCR", "- 95°C 30 s\n- 55°C 30 s", "2024-08-20T10:00:00+00:00"),
+        _record("Write Method for PCR", "- 95°C 30 s\n- 55°C 30 s", "2024-08-20T11:00:00+00:00"),   # 완전 중복
+        _record("Write  method for PCR", "- 95°C 30 s\n- 55°C 30 s.", "2024-08-21T09:00:00+00:00"),  # 근사 중복 (최신)
+        _record("Write Method for PCR", "- 98°C 10 s\n- 60°C 15 s\n- 72°C 1 min", "2024-09-01T09:00:00+00:00"),
+    ]
+    for i, record in enumerate(legacy):
+        (data_dir / f"2024_{i}.json").write_text(json.dumps(record), encoding="utf-8")
+
+    stats = dpo_dataset.compact(data_dir, near_threshold=95.0)
+
+    assert stats["exact_duplicates"] == 1 and stats["near_duplicates"] == 1 and stats["output"] == 2
+    assert [p.name for p in data_dir.glob("*.json")] == ["manifest.json"]
+    manifest = dpo_dataset.load_manifest(data_dir)
+    assert list(manifest["shards"]) == ["shards/2024/08/dpo-20240821.jsonl.gz", "shards/2024/09/dpo-20240901.jsonl.gz"]
+    assert manifest["total_records"] == 2
+    # 근사 중복 중에서는 가장 최근 레코드를 남김
+    kept = list(dpo_dataset.iter_shard(data_dir / "shards/2024/08/dpo-20240821.jsonl.gz"))
+    assert kept[0]["metadata"]["timestamp_utc"] == "2024-08-21T09:00:00+00:00"
+
+
+def test_appending_to_shards_updates_manifest_for_incremental_loading(tmp_path):
+    """샤드에 append하면 바뀐 샤드만 manifest 비교로 찾아낼 수 있는지 테스트"""
+    data_dir = tmp_path / "data"
+    dpo_dataset.append_to_shards(data_dir, [_record("p1", "c1", "2024-08-20T10:00:00+00:00"),
+                                            _record("p2", "c2", "2024-09-01T10:00:00+00:00")])
+    before = dpo_dataset.load_manifest(data_dir)
+
+    changed = dpo_dataset.append_to_shards(data_dir, [_record("p3", "c3", "2024-09-01T12:00:00+00:00")])
+    after = dpo_dataset.load_manifest(data_dir)
+
+    assert [p.name for p in changed] == ["dpo-20240901.jsonl.gz", "manifest.json"]
+    assert dpo_dataset.changed_shards(before, after) == ["shards/2024/09/dpo-20240901.jsonl.gz"]
+    assert after["total_records"] == 3
+    assert [r["prompt"] for r in dpo_dataset.iter_records(data_dir)] == ["p1", "p2", "p3"]
+
+
+def test_incremental_export_skips_records_already_exported(tmp_path):
+    """증분 export는 바뀐 샤드에서 지난 export 이후 추가된 레코드만 읽고, compaction 뒤에는 전체를 다시 읽는지 테스트"""
+    data_dir = tmp_path / "data"
+    dpo_dataset.append_to_shards(data_dir, [_record("p1", "c1", "2024-08-20T10:00:00+00:00"),
+                                            _record("p2", "c2", "2024-09-01T10:00:00+00:00")])
+    exported = dpo_dataset.load_manifest(data_dir)
+
+    dpo_dataset.append_to_shards(data_dir, [_record("p3", "c3", "2024-09-01T12:00:00+00:00"),
+                                            _record("p4", "c4", "2024-09-02T12:00:00+00:00")])
+    offsets = dpo_dataset.export_offsets(exported, dpo_dataset.load_manifest(data_dir))
+    assert offsets == {"shards/2024/09/dpo-20240901.jsonl.gz": 1, "shards/2024/09/dpo-20240902.jsonl.gz": 0}
+    assert [r["prompt"] for r in dpo_dataset.iter_export_records(data_dir, offsets)] == ["p3", "p4"]
+
+    dpo_dataset.compact(data_dir)
+    offsets = dpo_dataset.export_offsets(exported, dpo_dataset.load_manifest(data_dir))
+    assert sorted(r["prompt"] for r in dpo_dataset.iter_export_records(data_dir, offsets)) == ["p1", "p2", "p3", "p4"]
+
+
+def test_interrupted_compaction_keeps_existing_shards(tmp_path):
+    """기존 샤드를 백업으로 옮긴 뒤 새 샤드로 교체하기 전에 실패해도 데이터가 남고, 다음 compaction이 이를 복원하는지 테스트"""
+    data_dir = tmp_path / "data"
+    dpo_dataset.append_to_shards(data_dir, [_record("p1", "c1", "2024-08-20T10:00:00+00:00"),
+                                            _record("p2", "c2", "2024-09-01T10:00:00+00:00")])
+    real_replace = dpo_dataset.os.replace
+
+    def fail_on_swap(src, dst):
+        if ".compacting" in str(src):
+            raise OSError("disk full")
+        real_replace(src, dst)
+
+    with patch.object(dpo_dataset.os, "replace", side_effect=fail_on_swap), pytest.raises(OSError):
+        dpo_dataset.compact(data_dir)
+    assert len(list((data_dir / ".shards.previous").glob("**/*.jsonl.gz"))) == 2
+
+    stats = dpo_dataset.compact(data_dir)
+    assert stats["output"] == 2 and not (data_dir / ".shards.previous").exists()
+    assert [r["prompt"] for r in dpo_dataset.iter_records(data_dir)] == ["p1", "p2"]
@@ -1,51 +1,192 @@
+import asyncio
+import subprocess
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 
+import dpo_spool as dpo_module
+from dpo_spool import DPOSpool, DPOBatchCommitter, DPOGitOptions, push_preferences_to_git
+from bench_dpo_git import make_bare_remote, make_record
+
+TEST_PAYLOAD = {
+    "uo_id": "UHW010",
+    "section": "Method",
+    "chosen_original": "AI suggestion",
+    "chosen_edited": "User edited suggestion",
+    "rejected": [],
+    "query": "Test query",
+    "file_content": "### [UHW010 Liquid Handling]",
+    "file_path": "/test/path/001_WF_Test.md",
+    "supervisor_evaluations": []
+}
+
+
+def _git_committer(spool, tmp_path):
+    return DPOBatchCommitter(
+        spool, lambda records: push_preferences_to_git("token", "https://example.com/dpo.git", str(tmp_path / "repo"), records)
+    )
+
+
 @pytest.mark.asyncio
-async def test_dpo_git_push_logic(client: TestClient):
+async def test_dpo_git_push_logic(client: TestClient, tmp_path):
     """
-    /record_preference 호출 시 Git 관련 함수들이 올바른 순서로 호출되는지 테스트
+    /record_preference는 스풀에만 기록하고, 커미터가 Git 관련 함수들을 올바른 순서로 호출하는지 테스트
     """
     # git.Repo와 관련된 모든 객체와 메서드를 모킹
     mock_repo_instance = MagicMock()
     mock_origin = MagicMock()
     mock_repo_instance.remote.return_value = mock_origin
+    mock_repo_instance.is_dirty.return_value = False
 
-    # patch 데코레이터를 사용하여 git.Repo 클래스를 mock_repo_class로 대체
-    with patch('main.git.Repo', return_value=mock_repo_instance) as mock_repo_class, \
-         patch('main.Path.exists', return_value=True): # 로컬 저장소가 이미 존재한다고 가정
-
-        test_payload = {
-            "uo_id": "UHW010",
-            "section": "Method",
-            "chosen_original": "AI suggestion",
-            "chosen_edited": "User edited suggestion",
-            "rejected": [],
-            "query": "Test query",
-            "file_content": "### [UHW010 Liquid Handling]",
-            "file_path": "/test/path/001_WF_Test.md",
-            "supervisor_evaluations": []
-        }
-
-        # API 호출
-        response = client.post("/record_preference", json=test_payload)
-
-        # 응답 상태 코드 확인
+    with patch('dpo_spool.git.Repo', return_value=mock_repo_instance) as mock_repo_class:
+        (tmp_path / "repo").mkdir()  # 로컬 저장소가 이미 존재한다고 가정
+
+        # API 호출: 스풀에 기록된 뒤 곧바로 응답하며, 요청 경로에서는 Git을 사용하지 않음
+        response = client.post("/record_preference", json=TEST_PAYLOAD)
         assert response.status_code == 204
+        spool = dpo_module.get_dpo_spool()
+        assert spool.pending_count == 1
+        mock_repo_class.assert_not_called()
+
+        # 백그라운드 커미터 실행
+        assert _git_committer(spool, tmp_path).flush() == 1
 
-        # Git 관련 함수 호출 순서 및 내용 검증
         # 1. Repo 객체가 로컬 경로로 초기화되었는지 확인
         mock_repo_class.assert_called_once()
 
-        # 2. git pull (remotes.origin.pull)이 호출되었는지 확인
-        mock_repo_instance.remotes.origin.pull.assert_called_once()
+        # 2. git fetch 후 origin/main으로 reset 되었는지 확인
+        mock_origin.fetch.assert_called_once()
+        mock_repo_instance.git.reset.assert_called_with('--hard', 'origin/main')
 
-        # 3. git add (index.add)가 호출되었는지 확인
-        mock_repo_instance.index.add.assert_called_once()
+        # 3. git add (sparse checkout 밖의 새 파일 포함)가 호출되었는지 확인
+        mock_repo_instance.git.add.assert_called_once()
+        assert mock_repo_instance.git.add.call_args.args[:2] == ('--sparse', '--')
 
-        # 4. git commit (index.commit)이 호출되었는지 확인
-        mock_repo_instance.index.commit.assert_called_with("feat: Add DPO data for UHW010/Method")
+        # 4. git commit이 호출되었는지 확인
+        mock_repo_instance.git.commit.assert_called_with('--no-verify', '-m', "feat: Add DPO data for UHW010/Method")
 
         # 5. git push (remote().push)가 호출되었는지 확인
-        mock_origin.push.assert_called_once()
\ No newline at end of file
+        mock_origin.push.assert_called_once()
+
+    assert spool.pending_count == 0 and not spool.batch_files()
+
+
+def test_committer_batches_records_and_retries_with_backoff(tmp_path):
+    """여러 레코드를 하나의 커밋으로 묶고, 실패 시 배치를 보존한 채 백오프 후 재시도하는지 테스트"""
+    spool = DPOSpool(str(tmp_path / "spool"))
+    for i in range(3):
+        spool.append({"prompt": f"p{i}", "chosen": "c", "rejected": ["r"], "metadata": {}}, f"UHW0{i}0/Method")
+
+    commits = []
+    outcomes = [ConnectionError("remote unreachable"), None]
+
+    def commit_fn(records):
+        error = outcomes.pop(0)
+        if error:
+            raise error
+        commits.append(records)
+
+    committer = DPOBatchCommitter(spool, commit_fn, max_batch_size=3, retry_base_delay_s=60)
+    assert committer.should_flush(0.0)
+    assert committer.flush() == 0
+    assert len(spool.batch_files()) == 1
+    assert not committer.should_flush(0.0)  # 백오프 대기 중
+    assert committer.snapshot()["retry_in_s"] > 0
+
+    committer.next_attempt_at = 0.0
+    spool.append({"prompt": "p3", "chosen": "c", "rejected": ["r"], "metadata": {}}, "UHW040/Method")
+    assert committer.flush() == 4
+    assert len(commits) == 1 and [r["data"]["prompt"] for r in commits[0]] == ["p0", "p1", "p2", "p3"]
+    assert not spool.batch_files() and spool.pending_count == 0
+
+
+def test_committer_quarantines_torn_lines_and_runs_once_across_processes(tmp_path):
+    """끊긴 JSON 줄은 격리하고, 대기 파일이 없어도 실패하지 않으며, 커밋 잠금을 다른 프로세스가 잡고 있으면 건너뛰는지 테스트"""
+    spool = DPOSpool(str(tmp_path / "spool"))
+    spool.append({"prompt": "p0", "chosen": "c", "rejected": ["r"], "metadata": {}}, "UHW010/Method")
+    with open(spool.pending_path, 'a', encoding='utf-8') as f:
+        f.write('{"id": "torn", "subject": "UHW020/Me\n')
+    spool.append({"prompt": "p1", "chosen": "c", "rejected": ["r"], "metadata": {}}, "UHW030/Method")
+
+    commits = []
+    committer = DPOBatchCommitter(spool, commits.append)
+    with dpo_module.file_lock(spool.spool_dir / DPOBatchCommitter.COMMIT_LOCK_FILE):
+        assert committer.flush() == 0  # 다른 워커 프로세스가 커밋 중
+    assert spool.pending_path.exists()
+
+    assert committer.flush() == 2
+    assert [r["data"]["prompt"] for r in commits[0]] == ["p0", "p1"]
+    assert '"batch": "batch-' in spool.quarantine_path.read_text(encoding='utf-8')
+    assert not spool.batch_files()
+
+    # 다른 프로세스가 대기 파일을 이미 떼어 간 경우
+    spool.append({"prompt": "p2", "chosen": "c", "rejected": ["r"], "metadata": {}}, "UHW040/Method")
+    spool.pending_path.unlink()
+    assert spool.take_batch() is None and spool.pending_count == 0
+
+
+@pytest.mark.asyncio
+async def test_committer_loop_survives_errors(tmp_path):
+    """flush 중 예외가 나도 백그라운드 커미터 루프가 계속 도는지 테스트"""
+    committer = DPOBatchCommitter(DPOSpool(str(tmp_path / "spool")), lambda records: None)
+    calls = []
+
+    def failing_should_flush(now):
+        calls.append(now)
+        raise OSError("spool unavailable")
+
+    committer.should_flush = failing_should_flush
+    loop = asyncio.create_task(committer.run_loop(interval=0.01))
+    await asyncio.sleep(0.05)
+    assert not loop.done() and len(calls) > 1
+    loop.cancel()
+
+
+def test_resending_pushed_sharded_batch_is_a_no_op(tmp_path):
+    """푸시 후 스풀 정리 전에 중단되어 같은 배치를 다시 보내면, 샤드에 중복 없이 커밋 없이 성공하는지 테스트"""
+    remote = make_bare_remote(tmp_path / "remote.git", legacy_files=0)
+    options = DPOGitOptions(clone_mode="blobless", sparse=True, fetch_depth=1)
+    records = [make_record(0), make_record(1)]
+    push_preferences_to_git("", remote.as_uri(), str(tmp_path / "workspace"), records, "sharded", options=options)
+    head = subprocess.run(["git", "rev-parse", "main"], cwd=remote, check=True, capture_output=True, text=True).stdout
+
+    push_preferences_to_git("", remote.as_uri(), str(tmp_path / "other"), records, "sharded", options=options)
+    push_preferences_to_git("", remote.as_uri(), str(tmp_path / "workspace"), records, "sharded", options=options)
+    assert subprocess.run(["git", "rev-parse", "main"], cwd=remote, check=True, capture_output=True, text=True).stdout == head
+
+
+def _remote_files(remote_path, path):
+    output = subprocess.run(["git", "ls-tree", "-r", "--name-only", "main", path], cwd=remote_path,
+                            check=True, capture_output=True, text=True).stdout
+    return output.split()
+
+
+@pytest.mark.parametrize("write_mode", ["files", "sharded"])
+def test_sparse_partial_clone_workspace_against_local_remote(tmp_path, write_mode):
+    """
+    blobless + sparse 작업 공간이 data/의 기존 파일을 체크아웃하지 않고 푸시하며,
+    다른 작업 공간이 먼저 푸시해 거절되면 depth 제한 fetch 후 다시 푸시하는지 로컬 bare 저장소로 테스트
+    """
+    remote = make_bare_remote(tmp_path / "remote.git", legacy_files=30)
+    workspace = tmp_path / "workspace"
+    options = DPOGitOptions(clone_mode="blobless", sparse=True, fetch_depth=1)
+
+    push_preferences_to_git("", remote.as_uri(), str(workspace), [make_record(0)], write_mode, options=options)
+    assert not list(workspace.glob("data/seed_*.json"))  # 기존 레코드는 작업 트리에 없음
+    assert (workspace / "README.md").exists()
+
+    # 다른 프로세스(shallow 작업 공간)가 먼저 푸시
+    other_options = DPOGitOptions(clone_mode="shallow", sparse=True, fetch_depth=1)
+    push_preferences_to_git("", remote.as_uri(), str(tmp_path / "other"), [make_record(1)], write_mode, options=other_options)
+
+    # 캐시된 작업 공간은 fetch 없이 푸시를 시도하고, 거절되면 동기화 후 다시 푸시
+    push_preferences_to_git("", remote.as_uri(), str(workspace), [make_record(2), make_record(3)], write_mode, options=options)
+
+    if write_mode == "files":
+        assert len(_remote_files(remote, "data")) == 30 + 4
+    else:
+        manifest = subprocess.run(["git", "show", "main:data/manifest.json"], cwd=remote,
+                                  check=True, capture_output=True, text=True).stdout
+        assert '"total_records": 4' in manifest
+    assert subprocess.run(["git", "rev-parse", "--is-shallow-repository"], cwd=workspace,
+                          capture_output=True, text=True).stdout.strip() == "true"
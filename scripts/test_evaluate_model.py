@@ -1,6 +1,7 @@
 import pytest
 import asyncio
 import json
+import re
 import sqlite3
 import os
 from unittest.mock import patch, AsyncMock
@@ -88,4 +89,48 @@ async def test_run_evaluation_pipeline(tmp_path):
             assert row[2] == 1  # win_count_b
             assert row[3] == 0  # loss_count_b
             assert row[4] == 0  # tie_count
-            assert row[5] == 100.0  # win_rate_b
\ No newline at end of file
+            assert row[5] == 100.0  # win_rate_b
+
+@pytest.mark.asyncio
+async def test_concurrent_engine_matches_sequential_results_and_bounds_models(tmp_path):
+    """
+    동시 실행 엔진이 모델별 동시 호출 한도를 지키면서, 한도 1(순차에 해당)로 실행한 결과와 같은 로그를 데이터셋 순서로 만드는지 테스트
+    """
+    prompts = [{"prompt": f"Question {i}"} for i in range(12)]
+    eval_dataset_path = tmp_path / "dataset.json"
+    eval_dataset_path.write_text(json.dumps(prompts))
+    in_flight, peak = {}, {}
+
+    async def mock_llm_api(system_prompt, user_prompt, model_name):
+        in_flight[model_name] = in_flight.get(model_name, 0) + 1
+        peak[model_name] = max(peak.get(model_name, 0), in_flight[model_name])
+        # 뒤쪽 프롬프트가 먼저 끝나도록 지연을 달리합니다.
+        number = int(re.search(r"Question (\d+)", user_prompt).group(1))
+        await asyncio.sleep(0.001 * (12 - number))
+        in_flight[model_name] -= 1
+        if model_name == "judge-model":
+            winner = ["Model A", "Model B", "Tie"][number % 3]
+            return json.dumps({"winner": winner, "justification": f"Judged {number}"})
+        return f"{model_name} answer to {number}"
+
+    with patch('evaluate_model.call_llm_api', new_callable=AsyncMock) as mock_call_llm_api:
+        mock_call_llm_api.side_effect = mock_llm_api
+        init_db()
+        sequential_log, concurrent_log = tmp_path / "sequential.json", tmp_path / "concurrent.json"
+        await run_evaluation("model-a", "model-b", "judge-model", str(eval_dataset_path), str(sequential_log), concurrency=1)
+        assert peak == {"model-a": 1, "model-b": 1, "judge-model": 1}
+
+        peak.clear()
+        report = await run_evaluation("model-a", "model-b", "judge-model", str(eval_dataset_path), str(concurrent_log),
+                                      concurrency=4, model_concurrency={"judge-model": 2})
+        assert peak == {"model-a": 4, "model-b": 4, "judge-model": 2}
+
+    assert json.loads(concurrent_log.read_text()) == json.loads(sequential_log.read_text())
+    assert [entry["prompt"] for entry in json.loads(concurrent_log.read_text())] == [item["prompt"] for item in prompts]
+    assert not os.path.exists(f"{concurrent_log}.partial.jsonl")
+    assert report["prompts"] == 12 and report["prompts_per_min"] > 0
+    assert report["stages"]["judge"]["count"] == 12
+
+    with sqlite3.connect(TEST_DB_PATH) as conn:
+        rows = conn.execute("SELECT win_count_b, loss_count_b, tie_count FROM evaluations").fetchall()
+    assert rows == [(4, 4, 4), (4, 4, 4)]
@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+import pytest
+
+from feedback_db import FeedbackDatabase, FEEDBACK_METRICS_TABLE_SQL, feedback_rollup_query, summarize_histograms
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_batched_and_visible_to_readers(tmp_path):
+    """동시 쓰기가 writer 스레드에서 더 적은 커밋으로 묶이고, 쓰기 완료 후 읽기 전용 풀에서 바로 조회되는지 테스트"""
+    db = FeedbackDatabase(str(tmp_path / "metrics" / "feedback.db"), read_pool_size=2)
+    db.start()
+    try:
+        await asyncio.gather(*[
+            db.write("INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+                     (f"2024-01-01T00:00:{i:02d}", f"UHW{i:03d}", "Method", i / 100))
+            for i in range(50)
+        ])
+        assert db.snapshot()["writes"] == 50
+        assert db.snapshot()["commits"] < 50
+
+        results = await asyncio.gather(*[
+            db.fetch_all("SELECT uo_id FROM feedback_metrics WHERE timestamp >= ? ORDER BY timestamp", ("2024-01-01T00:00:40",))
+            for _ in range(8)
+        ])
+        assert all([row["uo_id"] for row in rows] == [f"UHW{i:03d}" for i in range(40, 50)] for rows in results)
+        assert db.snapshot()["read_connections"] <= 2
+
+        # 잘못된 쓰기는 해당 호출만 실패하고, 읽기 연결로는 쓸 수 없음
+        with pytest.raises(sqlite3.Error):
+            await db.write("INSERT INTO missing_table VALUES (?)", (1,))
+        with pytest.raises(sqlite3.OperationalError):
+            db.query("DELETE FROM feedback_metrics")
+        assert len(await db.fetch_all("SELECT id FROM feedback_metrics")) == 50
+    finally:
+        db.close()
+
+
+@pytest.mark.asyncio
+async def test_rollup_is_maintained_incrementally_and_backfilled(tmp_path):
+    """트리거가 시간별 rollup을 INSERT/DELETE마다 갱신하고, 기존 DB는 시작 시 한 번 backfill되는지 테스트"""
+    db_path = tmp_path / "feedback.db"
+    with sqlite3.connect(db_path) as conn:  # rollup 도입 이전의 DB
+        conn.execute(FEEDBACK_METRICS_TABLE_SQL)
+        conn.executemany("INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+                         [(f"2024-03-0{day}T1{day}:00:00+00:00", "UHW010", "Method", ratio)
+                          for day in (4, 5) for ratio in (0.2, 0.4, 0.9)])
+
+    db = FeedbackDatabase(str(db_path))
+    db.start()
+    try:
+        await db.write("INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+                       ("2024-03-05T23:00:00+00:00", "UHW020", "Method", 1.0))
+        await db.write("DELETE FROM feedback_metrics WHERE timestamp LIKE '2024-03-04%' AND edit_distance_ratio > 0.5")
+
+        sql, params = feedback_rollup_query("day", None)
+        daily = summarize_histograms(await db.fetch_all(sql, params), None)
+        assert [(row["bucket"], row["count"]) for row in daily] == [("2024-03-04", 2), ("2024-03-05", 4)]
+        assert daily[0]["mean"] == pytest.approx(0.3)
+        assert daily[1]["p90"] == pytest.approx(0.995)
+
+        sql, params = feedback_rollup_query("week", "uo_id", start_date="2024-03-05")
+        weekly = summarize_histograms(await db.fetch_all(sql, params), "uo_id")
+        assert [(row["bucket"], row["uo_id"], row["count"]) for row in weekly] == [
+            ("2024-03-04", "UHW010", 3), ("2024-03-04", "UHW020", 1)]
+        assert weekly[0]["p50"] == pytest.approx(0.405)
+    finally:
+        db.close()
@@ -0,0 +1,180 @@
+import json
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import job_queue as job_queue_module
+from job_queue import JobQueue
+from worker import JobWorker
+from test_conversation_store import FakeAsyncRedis
+
+FILE_CONTENT = "### [UHW010 Liquid Handling]\n#### Method\n(Method 내용을 입력하세요)\n"
+
+
+class FakeJobRedis(FakeAsyncRedis):
+    """JobQueue가 사용하는 해시/리스트/문자열 명령을 흉내 내는 인메모리 Redis"""
+
+    def _lpush(self, key, *values):
+        for value in values:
+            self.lists.setdefault(key, []).insert(0, value)
+
+    async def get(self, key):
+        return self.strings.get(key)
+
+    async def exists(self, key):
+        return int(key in self.lists or key in self.hashes or key in self.strings)
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hgetall(self, key):
+        return self._hgetall(key)
+
+    async def hset(self, key, mapping):
+        self._hset(key, mapping)
+
+    async def brpop(self, keys, timeout=0):
+        for key in keys:
+            if self.lists.get(key):
+                return key, self.lists[key].pop()
+        await asyncio.sleep(0.01)
+        return None
+
+
+def _make_queue(**kwargs) -> JobQueue:
+    queue = JobQueue(redis_pool=None, **kwargs)
+    queue.client = FakeJobRedis()
+    return queue
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_jobs_and_idempotency_key_reuses_job():
+    """같은 멱등성 키로는 작업이 한 번만 생성되고, 워커가 결과를 저장한 뒤 결과 TTL로 바꾸는지 테스트"""
+    queue = _make_queue(result_ttl_seconds=60, pending_ttl_seconds=600)
+    job_id, created = await queue.submit("populate_note", {"n": 1}, idempotency_key="req-1")
+    again, created_again = await queue.submit("populate_note", {"n": 1}, idempotency_key="req-1")
+    failing_id, _ = await queue.submit("populate_note", {"n": 0})
+    assert created and not created_again and again == job_id
+    assert queue.client.ttls[f"job:{job_id}"] == 600
+
+    async def handler(payload):
+        if not payload["n"]:
+            raise ValueError("no options")
+        return {"options": ["draft"] * payload["n"]}
+
+    worker = JobWorker(queue, {"populate_note": handler}, cancel_poll_s=0.01)
+    for _ in range(2):
+        await worker.run_job(await queue.dequeue(["populate_note"]))
+    assert await queue.dequeue(["populate_note"], timeout=0) is None  # 중복 제출은 큐에 들어가지 않음
+
+    job = await queue.get(job_id)
+    assert job["status"] == "succeeded" and job["result"] == {"options": ["draft"]}
+    assert queue.client.ttls[f"job:{job_id}"] == 60
+    assert queue.client.ttls["job:idem:populate_note:req-1"] == 60
+    failed = await queue.get(failing_id)
+    assert failed["status"] == "failed" and failed["error"] == "no options"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_with_same_idempotency_key_create_one_job():
+    """키를 먼저 잡은 요청이 job 해시를 쓰기 전에 같은 키로 다시 제출해도 작업이 하나만 생기는지 테스트"""
+    queue = _make_queue()
+    fake_set = queue.client.set
+
+    async def set_then_yield(key, value, nx=False, ex=None):
+        result = await fake_set(key, value, nx=nx, ex=ex)
+        await asyncio.sleep(0)  # 첫 요청이 job 해시를 쓰기 전에 두 번째 요청이 실행되도록 양보
+        return result
+
+    queue.client.set = set_then_yield
+    (first, first_created), (second, second_created) = await asyncio.gather(
+        queue.submit("populate_note", {"n": 1}, idempotency_key="req-1"),
+        queue.submit("populate_note", {"n": 1}, idempotency_key="req-1"),
+    )
+    assert first == second and [first_created, second_created].count(True) == 1
+    assert queue.client.lists[JobQueue.queue_key("populate_note")] == [first]
+
+    # 대기 중에 취소된 작업의 키는 결과 TTL로 줄어듭니다.
+    assert await queue.cancel(first) == "cancelled"
+    assert queue.client.ttls[queue._idempotency_key("populate_note", "req-1")] == queue.result_ttl_seconds
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_running_job_and_skips_queued_job():
+    """실행 중인 작업은 워커가 태스크를 취소하고, 대기 중인 작업은 실행되지 않는지 테스트"""
+    queue = _make_queue()
+    running_id, _ = await queue.submit("populate_note", {})
+    queued_id, _ = await queue.submit("populate_note", {})
+    state = {"started": 0, "cancelled": False}
+
+    async def slow_handler(payload):
+        state["started"] += 1
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+        return {}
+
+    worker = JobWorker(queue, {"populate_note": slow_handler}, cancel_poll_s=0.01)
+    run = asyncio.create_task(worker.run_job(await queue.dequeue(["populate_note"])))
+    await asyncio.sleep(0.05)
+    assert (await queue.get(running_id))["status"] == "running"
+    assert await queue.cancel(running_id) == "running"
+    assert await queue.cancel(queued_id) == "cancelled"
+    await asyncio.wait_for(run, timeout=1)
+
+    assert state["cancelled"] and (await queue.get(running_id))["status"] == "cancelled"
+    await worker.run_job(await queue.dequeue(["populate_note"]))
+    assert state["started"] == 1
+
+
+@pytest.mark.asyncio
+async def test_handler_cancelled_internally_fails_job_and_shutdown_requeues():
+    """핸들러가 스스로 취소로 끝나면 실패로 기록하고 워커는 계속 돌며, 워커 종료로 취소되면 작업을 큐에 되돌리는지 테스트"""
+    queue = _make_queue()
+    failing_id, _ = await queue.submit("populate_note", {"mode": "self-cancel"})
+
+    async def handler(payload):
+        if payload["mode"] == "self-cancel":
+            raise asyncio.CancelledError()
+        await asyncio.sleep(30)
+        return {}
+
+    worker = JobWorker(queue, {"populate_note": handler}, cancel_poll_s=0.01)
+    await worker.run_job(await queue.dequeue(["populate_note"]))
+    job = await queue.get(failing_id)
+    assert job["status"] == "failed" and job["error"] == "CancelledError"
+
+    slow_id, _ = await queue.submit("populate_note", {"mode": "slow"})
+    run = asyncio.create_task(worker.run_job(await queue.dequeue(["populate_note"])))
+    await asyncio.sleep(0.05)
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    assert (await queue.get(slow_id))["status"] == "queued"
+    assert await queue.dequeue(["populate_note"]) == slow_id
+
+
+def test_job_api_submit_poll_and_events(client: TestClient):
+    """/jobs/populate_note 제출 → 조회 → SSE 상태 이벤트 흐름을 테스트"""
+    queue = _make_queue()
+    payload = {"file_content": FILE_CONTENT, "uo_id": "UHW010", "section": "Method", "query": "PCR"}
+    with patch.object(job_queue_module, 'job_queue', queue):
+        response = client.post("/jobs/populate_note", json=payload, headers={"Idempotency-Key": "abc"})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert client.post("/jobs/populate_note", json=payload, headers={"Idempotency-Key": "abc"}).json() == {
+            "job_id": job_id, "status": "queued", "created": False}
+        assert client.post("/jobs/populate_note", json={**payload, "uo_id": "UHW999"}).status_code == 404
+
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+        asyncio.run(queue.finish(job_id, "succeeded", result={"uo_id": "UHW010", "section": "Method", "options": ["a"]}))
+        response = client.get(f"/jobs/{job_id}/events")
+        events = [block for block in response.text.split("\n\n") if block]
+        assert len(events) == 1 and events[0].startswith("event: status")
+        assert json.loads(events[0].split("data: ", 1)[1])["result"]["options"] == ["a"]
+
+        assert client.delete(f"/jobs/{job_id}").json()["status"] == "succeeded"
+        assert client.get("/jobs/unknown").status_code == 404
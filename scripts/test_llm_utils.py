@@ -0,0 +1,234 @@
+import pytest
+import time
+import asyncio
+from unittest.mock import patch
+
+import llm_utils
+from llm_utils import OllamaHostPool, LLMCallPolicy, ModelCircuitBreakers
+
+
+def test_pool_prefers_host_with_resident_model():
+    """모델이 이미 적재된 호스트가 처리 중 요청이 더 많더라도 우선 선택되는지 테스트"""
+    pool = OllamaHostPool(["http://gpu-a:11434", "http://gpu-b:11434"])
+    gpu_a, gpu_b = pool.hosts
+    gpu_b.resident_models = {"llama3:70b"}
+    gpu_b.in_flight = 2
+
+    host = pool.acquire("llama3:70b")
+    assert host is gpu_b
+    assert gpu_b.in_flight == 3
+
+
+def test_pool_routes_unloaded_model_to_least_loaded_host():
+    """어느 호스트에도 적재되지 않은 모델은 가장 한가한 호스트로 보내고, 이후 호출도 같은 호스트에 고정되는지 테스트"""
+    pool = OllamaHostPool(["http://gpu-a:11434", "http://gpu-b:11434"])
+    gpu_a, gpu_b = pool.hosts
+    gpu_a.in_flight = 1
+
+    first = pool.acquire("mixtral")
+    assert first is gpu_b
+    # 두 번째 호출 시 gpu_b가 더 바쁘더라도 모델 친화도로 인해 같은 호스트를 유지
+    gpu_b.in_flight = 5
+    assert pool.acquire("mixtral") is gpu_b
+
+
+def test_pool_ejects_failing_host_and_ignores_response_errors():
+    """연속 연결 실패 시 호스트가 제외되고, ResponseError는 헬스 판정에 반영되지 않는지 테스트"""
+    pool = OllamaHostPool(["http://gpu-a:11434", "http://gpu-b:11434"], failure_threshold=2, eject_seconds=60)
+    gpu_a, gpu_b = pool.hosts
+
+    for _ in range(2):
+        host = pool.acquire("biollama3")
+        pool.release(host, llm_utils.ollama.ResponseError("model not found"))
+    assert gpu_a.consecutive_failures == 0
+
+    for _ in range(2):
+        pool.release(pool.acquire("biollama3"), ConnectionError("connection refused"))
+    assert not gpu_a.is_available(time.monotonic())
+
+    # 제외된 호스트에 모델이 적재되어 있어도 건강한 호스트로 라우팅
+    assert pool.acquire("biollama3") is gpu_b
+
+
+@pytest.mark.asyncio
+async def test_call_llm_api_coalesces_identical_in_flight_calls():
+    """동시에 들어온 동일한 LLM 호출이 하나의 업스트림 요청으로 병합되는지 테스트"""
+    upstream_calls = []
+
+    async def fake_uncoalesced(system_prompt, user_prompt, model_name, options):
+        upstream_calls.append((model_name, user_prompt))
+        await asyncio.sleep(0.05)
+        return f"answer to {user_prompt}"
+
+    before = llm_utils.llm_single_flight.coalesced_calls
+    with patch('llm_utils._call_llm_api_uncoalesced', side_effect=fake_uncoalesced):
+        results = await asyncio.gather(
+            llm_utils.call_llm_api("sys", "same prompt", "biollama3"),
+            llm_utils.call_llm_api("sys", "same prompt", "biollama3"),
+            llm_utils.call_llm_api("sys", "other prompt", "biollama3"),
+        )
+
+    assert results == ["answer to same prompt", "answer to same prompt", "answer to other prompt"]
+    assert len(upstream_calls) == 2
+    assert llm_utils.llm_single_flight.coalesced_calls - before == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_follower_survives_leader_cancellation():
+    """병합된 호출의 leader가 취소되어도 follower는 취소되지 않고 직접 다시 실행하여 결과를 받는지 테스트"""
+    group = llm_utils.SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return "result"
+
+    leader = asyncio.create_task(group.do("key", fn))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(group.do("key", fn))
+    await asyncio.sleep(0.01)
+    assert group.coalesced_calls == 1
+
+    leader.cancel()
+    assert await follower == "result"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert len(calls) == 2 and group._calls == {}
+
+
+def test_residency_manager_keep_alive_and_cold_load_tracking():
+    """연속 트래픽이 있는 모델에 긴 keep_alive를 주고, 콜드 로드와 TTFT를 기록하는지 테스트"""
+    manager = llm_utils.ModelResidencyManager(["biollama3"], active_keep_alive="30m", idle_keep_alive="5m")
+
+    assert manager.keep_alive_for("biollama3") == "5m"
+    manager.record_request("biollama3")
+    assert manager.keep_alive_for("biollama3") == "30m"
+
+    manager.record_response("biollama3", {"load_duration": 12_000_000_000, "prompt_eval_duration": 500_000_000})
+    manager.record_response("biollama3", {"load_duration": 10_000_000, "prompt_eval_duration": 300_000_000})
+    stats = manager.snapshot()["biollama3"]
+    assert stats["cold_loads"] == 1
+    assert stats["mean_cold_load_s"] == pytest.approx(12.0)
+    assert stats["last_ttft_s"] == pytest.approx(0.31)
+
+
+@pytest.mark.asyncio
+async def test_residency_manager_releases_only_models_used_in_this_process():
+    """이 프로세스에서 요청한 적 없는 모델은 다른 프로세스가 쓰고 있을 수 있으므로 내리지 않는지 테스트"""
+    pool = OllamaHostPool(["http://gpu-a:11434"])
+    pool.hosts[0].resident_models = {"biollama3", "mixtral"}
+    manager = llm_utils.ModelResidencyManager(["biollama3", "mixtral"], release_after_s=0)
+    manager.record_request("mixtral")
+    released = []
+
+    class FakeClient:
+        def __init__(self, host):
+            pass
+
+        async def generate(self, model, prompt, keep_alive):
+            released.append((model, keep_alive))
+
+    with patch('llm_utils.get_ollama_pool', return_value=pool), patch('llm_utils.ollama.AsyncClient', FakeClient):
+        await manager.release_idle()
+    assert released == [("mixtral", 0)]
+    assert pool.hosts[0].resident_models == {"biollama3"}
+
+
+@pytest.mark.parametrize("content", [
+    "The answer is:   - 50 µl PBS\n- 10 mM Tris-HCl",
+    "```markdown\n- Centrifuge at 1,000 x g\n- Incubate 30 min\n```",
+    "Method: ```\nstep 1\n\nstep 2\n```  \n",
+    "  plain text with `inline` code and trailing spaces   \n\n",
+    "short",
+])
+def test_streaming_post_processor_matches_batch_post_processing(content):
+    """어떤 크기로 나뉘어 도착해도 스트리밍 후처리 결과가 _post_process_content와 같은지 테스트"""
+    expected = llm_utils._post_process_content(content.strip())
+    for size in (1, 2, 3, 7, len(content)):
+        processor = llm_utils.StreamingPostProcessor()
+        pieces = [processor.feed(content[i:i + size]) for i in range(0, len(content), size)]
+        assert "".join(pieces) + processor.finish() == expected
+
+
+@pytest.mark.asyncio
+async def test_stream_llm_api_stops_at_budget_and_closes_upstream():
+    """길이 예산을 넘으면 스트림을 조기 종료하고 업스트림 요청을 닫는지 테스트"""
+    produced = []
+    closed = asyncio.Event()
+
+    async def fake_stream():
+        try:
+            for i in range(100):
+                produced.append(i)
+                yield {"message": {"content": f"token{i} "}, "done": False}
+        finally:
+            closed.set()
+
+    class FakeClient:
+        async def chat(self, **kwargs):
+            assert kwargs["stream"] is True
+            return fake_stream()
+
+    pool = OllamaHostPool(["http://gpu-a:11434"])
+    with patch('llm_utils.get_ollama_pool', return_value=pool), \
+         patch('llm_utils.ollama.AsyncClient', return_value=FakeClient()):
+        chunks = [c async for c in llm_utils.stream_llm_api("sys", "user", "biollama3", max_chars=60)]
+
+    assert 60 <= len("".join(chunks)) < 80
+    assert len(produced) < 100
+    assert closed.is_set()
+    assert pool.hosts[0].in_flight == 0
+
+
+class _FailingClient:
+    def __init__(self, calls, error=None, delay=0.0):
+        self.calls = calls
+        self.error = error
+        self.delay = delay
+
+    async def chat(self, **kwargs):
+        self.calls.append(kwargs["model"])
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"message": {"content": "ok"}}
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried_then_open_the_circuit():
+    """일시적 오류는 재시도하고, 실패가 누적되면 서킷 브레이커가 열려 호출을 즉시 차단하는지 테스트"""
+    calls = []
+    policy = LLMCallPolicy(max_retries=2, retry_base_delay_s=0.0)
+    breakers = ModelCircuitBreakers(failure_threshold=2, reset_seconds=60)
+    with patch('llm_utils.get_ollama_pool', return_value=OllamaHostPool(["http://gpu-a:11434"])), \
+         patch('llm_utils.get_call_policy', return_value=policy), \
+         patch('llm_utils.get_circuit_breakers', return_value=breakers), \
+         patch('llm_utils.ollama.AsyncClient', return_value=_FailingClient(calls, ConnectionError("connection refused"))):
+        first = await llm_utils.call_llm_api("sys", "prompt 1", "mixtral")
+        await llm_utils.call_llm_api("sys", "prompt 2", "mixtral")
+        blocked = await llm_utils.call_llm_api("sys", "prompt 3", "mixtral")
+
+    assert first.startswith("(LLM Error")
+    assert len(calls) == 6  # 호출 2번 x (최초 시도 + 재시도 2회), 세 번째 호출은 업스트림에 도달하지 않음
+    assert "circuit breaker open" in blocked
+    snapshot = breakers.snapshot()["mixtral"]
+    assert snapshot["state"] == "open"
+    assert snapshot["trips"] == 1
+    assert breakers.available_models(["mixtral", "biollama3"]) == ["biollama3"]
+
+
+@pytest.mark.asyncio
+async def test_hung_model_times_out_without_retrying_client_errors():
+    """응답이 없는 모델은 모델별 타임아웃으로 끊기고, 4xx 응답은 재시도하지 않는지 테스트"""
+    calls = []
+    policy = LLMCallPolicy(default_timeout_s=30, model_timeouts={"llama3:70b": 0.05}, max_retries=0)
+    with patch('llm_utils.get_ollama_pool', return_value=OllamaHostPool(["http://gpu-a:11434"])), \
+         patch('llm_utils.get_call_policy', return_value=policy), \
+         patch('llm_utils.get_circuit_breakers', return_value=ModelCircuitBreakers()), \
+         patch('llm_utils.ollama.AsyncClient', return_value=_FailingClient(calls, delay=5.0)):
+        result = await asyncio.wait_for(llm_utils.call_llm_api("sys", "prompt", "llama3:70b"), timeout=2)
+    assert "TimeoutError" in result
+
+    assert not LLMCallPolicy.is_transient(llm_utils.ollama.ResponseError("model not found", 404))
+    assert LLMCallPolicy.is_transient(llm_utils.ollama.ResponseError("server busy", 503))
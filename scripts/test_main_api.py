@@ -13,7 +13,7 @@ async def test_record_preference_and_get_metrics(client: TestClient):
     /record_preference로 피드백을 저장하고 /api/feedback_metrics로 조회하는 기능 테스트
     """
     # Git 관련 동작은 모킹(mocking)하여 실제 Git 명령이 실행되지 않도록 함
-    with patch('main.git.Repo') as mock_repo:
+    with patch('dpo_spool.git.Repo') as mock_repo:
         # 테스트용 요청 데이터
         test_payload = {
             "uo_id": "UHW010",
@@ -55,7 +55,7 @@ def test_get_feedback_metrics_with_date_filter(client: TestClient):
     """
     # 'datetime.datetime.now'를 모킹하여 시간을 고정
     mock_now = MagicMock()
-    with patch('main.git.Repo'), patch('main.datetime.datetime', new=mock_now):
+    with patch('dpo_spool.git.Repo'), patch('main.datetime.datetime', new=mock_now):
         # 1. 2023년 데이터 삽입
         # isoformat()와 strftime() 메서드 호출의 반환 값을 명시적으로 설정합니다.
         mock_now.now.return_value.isoformat.return_value = '2023-06-15T10:00:00+00:00'
@@ -99,4 +99,61 @@ def test_get_feedback_metrics_with_date_filter(client: TestClient):
 
     # 4. 기간 필터링 (결과 없음)
     response = client.get("/api/feedback_metrics?start_date=2025-01-01")
-    assert len(response.json()) == 0
\ No newline at end of file
+    assert len(response.json()) == 0
+
+def test_feedback_metrics_bucketed_aggregation(client: TestClient):
+    """bucket/group_by를 지정하면 원본 행 대신 bucket별 count/mean/p50/p90 요약만 반환하는지 테스트"""
+    import feedback_db as feedback_db_module
+    db = feedback_db_module.get_feedback_db()
+    for i in range(200):
+        db.submit_write(
+            "INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+            (f"2024-08-{20 + i % 2}T{i % 24:02d}:00:00+00:00", "UHW010" if i % 3 else "UHW020", "Method", (i % 10) / 10)
+        ).result()
+
+    response = client.get("/api/feedback_metrics?bucket=day&group_by=uo_id")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 4
+    assert sum(row["count"] for row in data) == 200
+    assert set(data[0]) == {"bucket", "uo_id", "count", "mean", "p50", "p90"}
+
+    assert client.get("/api/feedback_metrics?bucket=month").status_code == 400
+    assert client.get("/api/feedback_metrics?bucket=day&group_by=experimenter").status_code == 400
+
+
+def test_feedback_metrics_cursor_pagination_and_ndjson(client: TestClient):
+    """(timestamp, id) keyset 페이지네이션이 같은 timestamp의 행도 빠짐없이 나누고, NDJSON 스트리밍이 전체 범위를 반환하는지 테스트"""
+    import json
+    import feedback_db as feedback_db_module
+    db = feedback_db_module.get_feedback_db()
+    for i in range(25):
+        db.submit_write(
+            "INSERT INTO feedback_metrics (timestamp, uo_id, section, edit_distance_ratio) VALUES (?, ?, ?, ?)",
+            (f"2024-08-20T10:00:{i // 5:02d}+00:00", f"UHW{i:03d}", "Method", 0.5)  # 5개씩 같은 timestamp
+        ).result()
+
+    pages, cursor = [], None
+    while True:
+        response = client.get("/api/feedback_metrics", params={"limit": 7, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+    assert [row["uo_id"] for page in pages for row in page] == [f"UHW{i:03d}" for i in range(25)]
+
+    response = client.get("/api/feedback_metrics?format=ndjson&start_date=2024-08-20")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["uo_id"] for row in lines] == [f"UHW{i:03d}" for i in range(25)]
+
+    assert client.get("/api/feedback_metrics?cursor=not-a-cursor").status_code == 400
+
+
+def test_dashboard_serves_root_dashboard_html(client: TestClient):
+    """/dashboard가 저장소 루트의 dashboard.html을 렌더링하는지 테스트"""
+    response = client.get("/dashboard")
+    assert response.status_code == 200
+    assert "/api/evaluation_history?bucket=day" in response.text
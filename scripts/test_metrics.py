@@ -0,0 +1,84 @@
+import os
+import json
+import threading
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import job_queue as job_queue_module
+from metrics import Counter, Gauge, Histogram, MetricsRegistry
+from test_job_queue import _make_queue
+
+
+def _make_registry():
+    registry = MetricsRegistry()
+    requests = Counter("test_requests_total", "Requests.", ("route",), registry=registry)
+    in_flight = Gauge("test_in_flight", "In flight.", registry=registry)
+    latency = Histogram("test_latency_seconds", "Latency.", ("route",), registry=registry, buckets=(0.1, 1.0))
+    return registry, requests, in_flight, latency
+
+
+def test_thread_shards_are_merged_into_prometheus_text():
+    """여러 스레드가 락 없이 기록한 값이 수집 시 합쳐지고, 히스토그램이 누적 버킷으로 출력되는지 테스트"""
+    registry, requests, in_flight, latency = _make_registry()
+
+    def work():
+        for value in (0.05, 0.5, 5.0):
+            requests.inc(route="/chat")
+            latency.observe(value, route="/chat")
+        in_flight.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    in_flight.dec()
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{route="/chat"} 12' in text
+    assert "test_in_flight 3" in text
+    assert 'test_latency_seconds_bucket{route="/chat",le="0.1"} 4' in text
+    assert 'test_latency_seconds_bucket{route="/chat",le="1.0"} 8' in text
+    assert 'test_latency_seconds_bucket{route="/chat",le="+Inf"} 12' in text
+    assert 'test_latency_seconds_count{route="/chat"} 12' in text
+    assert 'test_latency_seconds_sum{route="/chat"} 22.2' in text
+
+
+def test_multiprocess_snapshots_are_merged(tmp_path):
+    """공유 디렉터리의 다른 프로세스 지표를 합치되, 종료된 프로세스의 게이지는 제외하는지 테스트"""
+    registry, requests, in_flight, latency = _make_registry()
+    registry.configure(str(tmp_path))
+    requests.inc(2, route="/chat")
+    in_flight.inc()
+    latency.observe(0.5, route="/chat")
+
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    other = registry.snapshot()
+    other["test_in_flight"] = [[[], 5]]
+    (tmp_path / f"{dead.pid}.json").write_text(json.dumps({"pid": dead.pid, "metrics": other}))
+
+    text = registry.render()
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+    assert 'test_requests_total{route="/chat"} 4' in text
+    assert 'test_latency_seconds_count{route="/chat"} 2' in text
+    assert "test_in_flight 1" in text
+
+
+def test_metrics_endpoint_reports_route_latency(client: TestClient):
+    """라우트 템플릿 단위의 HTTP 지연 시간 히스토그램과 수락 제어 대기열 게이지가 /metrics에 노출되는지 테스트"""
+    assert client.get("/constants").status_code == 200
+    with patch.object(job_queue_module, 'job_queue', _make_queue()):
+        assert client.get("/jobs/unknown-id").status_code == 404
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'labnote_http_request_duration_seconds_count{method="GET",route="/constants",status="200"}' in text
+    assert 'labnote_http_request_duration_seconds_count{method="GET",route="/jobs/{job_id}",status="404"}' in text
+    assert "unknown-id" not in text
+    assert 'labnote_admission_queue_depth{endpoint="chat"} 0' in text
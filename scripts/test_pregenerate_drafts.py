@@ -0,0 +1,83 @@
+import os
+import sys
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import draft_store as draft_store_module
+from draft_store import DraftStore
+from document_cache import DocumentCache
+from main import create_unit_operation_template
+from pregenerate_drafts import build_combinations, pregenerate
+from rag_pipeline import compute_index_version
+
+
+@pytest.mark.asyncio
+async def test_pregenerate_checkpoints_and_resumes(tmp_path):
+    """조합마다 바로 저장하고, 다시 실행하면 저장된 조합은 건너뛰며, 실패나 오프피크 종료 후에도 이어서 진행하는지 테스트"""
+    store = DraftStore(str(tmp_path / "drafts.db"))
+    combinations = build_combinations(["WB030", "WB040"], ["UHW010", "UHW100"], ["Method"])
+    calls = []
+    failures = {("WB040", "UHW100"): 1}
+
+    async def fake_agent(query, uo_block, section):
+        workflow_id, uo_id = query.split(":", 1)[0], uo_block.split("[", 1)[1].split(" ", 1)[0]
+        calls.append((workflow_id, uo_id, section))
+        if len(calls) > 3 and failures.get((workflow_id, uo_id)):
+            failures[(workflow_id, uo_id)] -= 1
+            raise RuntimeError("judge unavailable")
+        return {"uo_id": uo_id, "section": section, "options": [f"{workflow_id} / {uo_id}"]}
+
+    stats = await pregenerate(store, "v1", combinations, concurrency=2, limit=3, run_agent=fake_agent)
+    assert stats["succeeded"] == 3 and len(calls) == 3
+    assert store.get("v1", "WB030", "UHW010", "Method")["options"] == ["WB030 / UHW010"]
+
+    stats = await pregenerate(store, "v1", combinations, run_agent=fake_agent, in_window=lambda: False)
+    assert stats["stopped_by_window"] and stats["already_done"] == 3 and len(calls) == 3
+
+    stats = await pregenerate(store, "v1", combinations, run_agent=fake_agent)
+    assert stats["failed"] == 1 and len(store.completed_keys("v1")) == 3
+    stats = await pregenerate(store, "v1", combinations, run_agent=fake_agent)
+    assert stats["succeeded"] == 1 and len(store.completed_keys("v1")) == 4
+    # SOP 인덱스 버전이 바뀌면 처음부터 다시 생성합니다.
+    assert store.completed_keys("v2") == set()
+    assert store.delete_other_versions("v2") == 4
+
+
+def test_sop_index_version_changes_with_documents(tmp_path):
+    """SOP 문서 내용이나 임베딩 모델이 바뀌면 인덱스 버전이 달라지는지 테스트"""
+    (tmp_path / "pcr.md").write_text("# PCR\n", encoding="utf-8")
+    version = compute_index_version(str(tmp_path), "nomic-embed-text")
+    assert version == compute_index_version(str(tmp_path), "nomic-embed-text")
+    assert version != compute_index_version(str(tmp_path), "other-model")
+    (tmp_path / "pcr.md").write_text("# PCR v2\n", encoding="utf-8")
+    assert version != compute_index_version(str(tmp_path), "nomic-embed-text")
+
+
+def test_populate_note_serves_pregenerated_draft(client: TestClient, tmp_path):
+    """요청한 경우 워크플로 파일의 빈 템플릿 블록에는 사전 생성 초안을 바로 돌려주고, 입력이 채워졌거나 요청하지 않으면 에이전트 팀을 실행하는지 테스트"""
+    store = DraftStore(str(tmp_path / "drafts.db"))
+    store.put("v1", "WB030", "UHW010", "Method", "WB030: DNA Assembly", ["pre-generated method"])
+    block = create_unit_operation_template("UHW010", "Liquid Handling", "Tester")
+    document = f'---\ntitle: "WB030 DNA Assembly"\n---\n\n## [WB030 DNA Assembly]\n{block}'
+    request = {"uo_id": "UHW010", "section": "Method", "query": "PCR", "file_content": document, "use_pregenerated": True}
+    agent_result = {"uo_id": "UHW010", "section": "Method", "options": ["fresh"]}
+    with patch.object(draft_store_module, '_draft_store', store), \
+            patch('main.rag_module.get_sop_index_version', return_value="v1"), \
+            patch('main.get_document_cache', return_value=DocumentCache()), \
+            patch('main.run_agent_team', return_value=agent_result) as run_agent_team, \
+            patch('main.get_residency_manager'):
+        response = client.post("/populate_note", json=request)
+        assert response.json() == {"uo_id": "UHW010", "section": "Method", "options": ["pre-generated method"], "pregenerated": True}
+        assert not run_agent_team.called
+
+        # 기본값은 사용자 목표(query)에 맞춰 새로 생성
+        default_request = {key: value for key, value in request.items() if key != "use_pregenerated"}
+        assert client.post("/populate_note", json=default_request).json()["options"] == ["fresh"]
+        filled = document.replace("- (samples from the previous step)", "- Purified plasmid", 1)
+        assert client.post("/populate_note", json={**request, "file_content": filled}).json()["pregenerated"] is False
+        assert client.post("/populate_note", json={**request, "section": "Reagent"}).json()["pregenerated"] is False
+        assert run_agent_team.call_count == 3
+    store.close()
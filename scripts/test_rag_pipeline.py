@@ -0,0 +1,54 @@
+import concurrent.futures
+import threading
+
+from rag_pipeline import EmbeddingMicroBatcher
+
+
+def test_micro_batcher_groups_concurrent_queries():
+    """동시에 들어온 쿼리들이 max_batch_size 단위로 묶여 전송되고, 결과가 올바른 호출자에게 돌아가는지 테스트"""
+    batch_sizes = []
+    release = threading.Event()
+
+    def fake_embed(texts):
+        release.wait(timeout=1)
+        batch_sizes.append(len(texts))
+        return [[float(text.split()[-1])] for text in texts]
+
+    batcher = EmbeddingMicroBatcher(fake_embed, max_batch_size=4, max_wait_ms=50)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(batcher.embed, f"query {i}") for i in range(8)]
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert results == [[float(i)] for i in range(8)]
+    assert sum(batch_sizes) == 8
+    assert max(batch_sizes) <= 4
+    assert len(batch_sizes) < 8
+
+
+def test_micro_batcher_skips_cancelled_requests_and_survives_errors():
+    """취소된 요청은 임베딩하지 않고, 임베딩 오류나 개수 불일치가 나도 배처 스레드가 계속 동작하는지 테스트"""
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(list(texts))
+        if texts == ["boom"]:
+            raise RuntimeError("embed failed")
+        if texts == ["short"]:
+            return []
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingMicroBatcher(fake_embed, max_batch_size=4, max_wait_ms=50)
+    cancelled = batcher.submit("cancelled")
+    assert cancelled.cancel()
+    assert batcher.embed("kept") == [1.0]
+    assert calls == [["kept"]]
+
+    for text in ("boom", "short"):
+        try:
+            batcher.embed(text)
+            assert False, "expected an exception"
+        except (RuntimeError, ValueError):
+            pass
+    assert batcher.embed("after errors") == [1.0]
+    assert batcher._thread.is_alive()
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import argparse
+import logging
+from typing import Awaitable, Callable, Dict
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+import rag_pipeline as rag_module
+import job_queue as job_queue_module
+from agents import arun_agent_team, find_uo_block, get_cascade_policy, select_judge_model
+from llm_utils import get_ollama_pool, get_residency_manager
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+async def populate_note_job(payload: Dict) -> Dict:
+    """/jobs/populate_note 작업: /populate_note와 같은 에이전트 팀을 워커의 이벤트 루프에서 실행합니다."""
+    uo_block = find_uo_block(payload["file_content"], payload["uo_id"])
+    if uo_block is None:
+        raise ValueError(f"Unit Operation block for ID '{payload['uo_id']}' not found.")
+    # populate 버스트가 시작되면 캐스케이드 첫 단계 모델과 채점 모델을 미리 적재합니다.
+    get_residency_manager().note_burst(get_cascade_policy(payload["section"])["tiers"][0] + [select_judge_model()])
+    result = await arun_agent_team(payload["query"], uo_block, payload["section"])
+    if not result or not result.get("options"):
+        raise RuntimeError("Agent team failed to generate options.")
+    return result
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict], Awaitable[Dict]]] = {
+    "populate_note": populate_note_job,
+}
+
+
+class JobWorker:
+    """
+    Redis 작업 큐에서 작업을 가져와 실행하는 워커. 한 프로세스가 concurrency개의 작업을 같은 이벤트 루프에서 동시에 실행합니다.
+    실행 중에는 cancel_poll_s마다 취소 요청을 확인하여, 요청되면 작업 태스크를 취소합니다 (진행 중인 LLM 호출도 취소).
+    """
+
+    def __init__(self, queue: job_queue_module.JobQueue, handlers: Dict[str, Callable[[Dict], Awaitable[Dict]]],
+                 concurrency: int = 1, cancel_poll_s: float = 1.0, dequeue_timeout_s: int = 5):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+        self.cancel_poll_s = cancel_poll_s
+        self.dequeue_timeout_s = dequeue_timeout_s
+
+    async def run_job(self, job_id: str):
+        job = await self.queue.claim(job_id)
+        if job is None:
+            return  # 대기 중에 취소되었거나 만료된 작업
+        handler = self.handlers[job["kind"]]
+        logger.info(f"Running {job['kind']} job {job_id}.")
+        task = asyncio.create_task(handler(job["payload"]))
+        cancelled_by_request = False
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=self.cancel_poll_s)
+                if not task.done() and await self.queue.is_cancel_requested(job_id):
+                    cancelled_by_request = True
+                    task.cancel()
+                    break
+            result = await task
+        except asyncio.CancelledError:
+            if cancelled_by_request:
+                await self.queue.finish(job_id, "cancelled")
+                logger.info(f"Cancelled {job['kind']} job {job_id}.")
+                return
+            if asyncio.current_task().cancelling():
+                # 워커 종료로 중단된 작업은 다른 워커가 이어서 실행하도록 큐에 되돌립니다.
+                task.cancel()
+                await asyncio.shield(self.queue.requeue(job_id, job["kind"]))
+                raise
+            # 취소 요청도 워커 종료도 아닌데 핸들러가 취소로 끝난 경우 (내부 호출이 취소됨) 실패로 기록하고 다음 작업을 계속 처리합니다.
+            logger.error(f"{job['kind']} job {job_id} failed: the handler was cancelled without a cancel request.")
+            await self.queue.finish(job_id, "failed", error="CancelledError")
+            return
+        except Exception as e:
+            logger.error(f"{job['kind']} job {job_id} failed: {e}", exc_info=True)
+            await self.queue.finish(job_id, "failed", error=str(e) or type(e).__name__)
+            return
+        await self.queue.finish(job_id, "succeeded", result=result)
+        logger.info(f"Finished {job['kind']} job {job_id}.")
+
+    async def _consume(self):
+        kinds = list(self.handlers)
+        while True:
+            job_id = await self.queue.dequeue(kinds, timeout=self.dequeue_timeout_s)
+            if job_id:
+                await self.run_job(job_id)
+
+    async def run(self):
+        logger.info(f"Job worker started (kinds={list(self.handlers)}, concurrency={self.concurrency}).")
+        await asyncio.gather(*[self._consume() for _ in range(self.concurrency)])
+
+
+async def main_async(concurrency: int):
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        raise ValueError("REDIS_URL environment variable is not set.")
+    logger.info("Initializing RAG pipeline...")
+    rag_module.rag_pipeline = rag_module.RAGPipeline()
+    redis_pool = redis.ConnectionPool.from_url(redis_url, decode_responses=True)
+    job_queue_module.job_queue = job_queue_module.JobQueue.from_env(redis_pool)
+    # 워커의 LLM 호출 지표는 API 서버의 /metrics에서 함께 집계되도록 공유 디렉터리에 내려 둡니다.
+    REGISTRY.configure(os.getenv("METRICS_MULTIPROC_DIR"))
+
+    background = [
+        asyncio.create_task(REGISTRY.run_flush_loop(float(os.getenv("METRICS_FLUSH_SECONDS", "5")))),
+        asyncio.create_task(get_residency_manager().run_loop(float(os.getenv("RESIDENCY_CHECK_INTERVAL_SECONDS", "60")))),
+        asyncio.create_task(get_ollama_pool().run_refresh_loop(float(os.getenv("OLLAMA_POOL_REFRESH_SECONDS", "15")))),
+    ]
+    try:
+        await JobWorker(job_queue_module.job_queue, JOB_HANDLERS, concurrency=concurrency).run()
+    finally:
+        for task in background:
+            task.cancel()
+        await redis_pool.disconnect()
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run agent jobs from the Redis job queue.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "2")),
+                        help="Number of jobs this process runs at the same time.")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args.concurrency))
+    except KeyboardInterrupt:
+        logger.info("Job worker stopped.")
+
+
+if __name__ == "__main__":
+    main()